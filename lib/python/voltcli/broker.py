@@ -0,0 +1,368 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+# Local connection broker. A background process holds authenticated database
+# connections and lends them to short-lived voltcli commands through a Unix
+# domain socket, so that back to back commands skip the TCP connect and the
+# authentication handshake. After a short hello the broker relays the
+# length-prefixed wire protocol messages unchanged in both directions.
+#
+# The hello carries the SHA-1 password digest that the wire protocol sends
+# to the server, never the password itself. The digest is still enough to
+# authenticate as that user, which is why the socket is owner-only.
+
+import os
+import time
+import json
+import errno
+import binascii
+import hashlib
+import select
+import socket
+import struct
+import threading
+import SocketServer
+
+import voltdbclient
+from voltcli import utility
+
+# Seconds without any client before the broker exits.
+default_idle_timeout = 300
+
+#===============================================================================
+def get_socket_path():
+#===============================================================================
+    """
+    Return the broker's Unix socket path in the state directory.
+    """
+    return os.path.join(utility.get_state_directory(), 'voltbroker.sock')
+
+#===============================================================================
+def write_message(sock, data):
+#===============================================================================
+    sock.sendall(struct.pack('>i', len(data)) + data)
+
+#===============================================================================
+def read_message(sock):
+#===============================================================================
+    header = read_bytes(sock, 4)
+    return read_bytes(sock, struct.unpack('>i', header)[0])
+
+#===============================================================================
+def read_bytes(sock, size):
+#===============================================================================
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise IOError('Connection closed by the broker.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+#===============================================================================
+def connect(host, port, username = '', password = '', timeout = None):
+#===============================================================================
+    """
+    Return a FastSerializer connected through the broker, or None if no
+    broker is running. Raises an exception if the broker can't connect to
+    the database on our behalf.
+    """
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        # Stale socket file left by a broker that didn't exit cleanly.
+        sock.close()
+        return None
+    try:
+        password_hash = hashlib.sha1(password or '').hexdigest()
+        write_message(sock, json.dumps(dict(host = host, port = port, username = username,
+                                            password_hash = password_hash)))
+        reply = json.loads(read_message(sock))
+    except (IOError, socket.error, ValueError):
+        sock.close()
+        return None
+    if 'error' in reply:
+        sock.close()
+        raise RuntimeError(reply['error'])
+    client = voltdbclient.FastSerializer(None, None, default_timeout = timeout)
+    client.host = host
+    client.port = port
+    client.socket = sock
+    client.socket.settimeout(timeout)
+    return client
+
+#===============================================================================
+class MessageCounter(object):
+#===============================================================================
+    """
+    Tracks length-prefixed message boundaries in a relayed byte stream
+    without buffering message bodies.
+    """
+    def __init__(self):
+        self.header = ''
+        self.remaining = 0
+
+    def feed(self, data):
+        """
+        Consume relayed data and return the number of messages completed.
+        """
+        count = 0
+        offset = 0
+        while offset < len(data):
+            if self.remaining > 0:
+                step = min(self.remaining, len(data) - offset)
+                self.remaining -= step
+                offset += step
+                if self.remaining == 0:
+                    count += 1
+            else:
+                step = min(4 - len(self.header), len(data) - offset)
+                self.header += data[offset:offset + step]
+                offset += step
+                if len(self.header) == 4:
+                    self.remaining = struct.unpack('>i', self.header)[0]
+                    self.header = ''
+                    if self.remaining == 0:
+                        count += 1
+        return count
+
+    def idle(self):
+        return not self.header and self.remaining == 0
+
+#===============================================================================
+def is_alive(sock):
+#===============================================================================
+    """
+    Return True if an idle database connection is still open. Nothing is
+    owed on an idle connection, so anything readable, including the end of
+    the stream after the server closed it, means it can't be reused.
+    """
+    try:
+        return not select.select([sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        return False
+
+#===============================================================================
+class ConnectionPool(object):
+#===============================================================================
+    """
+    Idle authenticated database connections keyed by host, port, user and
+    password digest. A connection is only lent to clients presenting the
+    credentials it was authenticated with.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def checkout(self, key, password_hash):
+        while True:
+            self.lock.acquire()
+            try:
+                connections = self.idle.get(key)
+                connection = connections and connections.pop()
+            finally:
+                self.lock.release()
+            if not connection:
+                break
+            if is_alive(connection.socket):
+                return connection
+            connection.close()
+        host, port, username = key[:3]
+        utility.info('Connecting to %s:%d...' % (host, port))
+        return voltdbclient.FastSerializer(host, port, username = username,
+                                           password_hash = password_hash)
+
+    def checkin(self, key, connection):
+        self.lock.acquire()
+        try:
+            self.idle.setdefault(key, []).append(connection)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+#===============================================================================
+class BrokerServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+#===============================================================================
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout):
+        SocketServer.UnixStreamServer.__init__(self, path, BrokerHandler)
+        self.pool = ConnectionPool()
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_activity = time.time()
+
+    def server_bind(self):
+        # Create the socket owner-only, as it accepts credentials. Setting
+        # the mode after binding would leave it open to other local users
+        # in between.
+        umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def client_started(self):
+        self.lock.acquire()
+        self.active += 1
+        self.lock.release()
+
+    def client_finished(self):
+        self.lock.acquire()
+        self.active -= 1
+        self.last_activity = time.time()
+        self.lock.release()
+
+    def is_idle(self):
+        self.lock.acquire()
+        try:
+            return self.active == 0 and time.time() - self.last_activity >= self.idle_timeout
+        finally:
+            self.lock.release()
+
+#===============================================================================
+class BrokerHandler(SocketServer.BaseRequestHandler):
+#===============================================================================
+    def handle(self):
+        self.server.client_started()
+        try:
+            self.broker()
+        finally:
+            self.server.client_finished()
+
+    def broker(self):
+        try:
+            hello = json.loads(read_message(self.request))
+            password_hash = binascii.unhexlify(str(hello['password_hash']))
+            key = (str(hello['host']), int(hello['port']), str(hello.get('username') or ''),
+                   hashlib.sha256(password_hash).hexdigest())
+        except (IOError, socket.error, ValueError, KeyError, TypeError):
+            return
+        try:
+            connection = self.server.pool.checkout(key, password_hash)
+        except Exception, e:
+            write_message(self.request, json.dumps(dict(
+                error = 'Broker unable to connect to %s:%d: %s' % (key[0], key[1], e))))
+            return
+        write_message(self.request, json.dumps(dict(status = 'ok')))
+        if self.relay(connection.socket):
+            self.server.pool.checkin(key, connection)
+        else:
+            connection.close()
+
+    def relay(self, database):
+        """
+        Relay until the client disconnects. Returns True if the database
+        connection has no partial or unanswered messages and can be reused.
+        """
+        client = self.request
+        requests = MessageCounter()
+        responses = MessageCounter()
+        pending = 0
+        database.settimeout(None)
+        while True:
+            try:
+                readable = select.select([client, database], [], [])[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                return False
+            try:
+                if client in readable:
+                    data = client.recv(65536)
+                    if not data:
+                        return pending == 0 and requests.idle() and responses.idle()
+                    pending += requests.feed(data)
+                    database.sendall(data)
+                if database in readable:
+                    data = database.recv(65536)
+                    if not data:
+                        return False
+                    pending -= responses.feed(data)
+                    client.sendall(data)
+            except socket.error:
+                return False
+
+#===============================================================================
+def is_listening(path):
+#===============================================================================
+    """
+    Return True if a process accepts connections on the Unix socket.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+#===============================================================================
+def serve(path, idle_timeout):
+#===============================================================================
+    """
+    Run the broker until it has had no clients for idle_timeout seconds.
+    """
+    if os.path.exists(path):
+        if is_listening(path):
+            utility.abort('A connection broker is already running at "%s".' % path)
+        # Stale socket file left by a broker that didn't exit cleanly.
+        os.remove(path)
+    try:
+        server = BrokerServer(path, idle_timeout)
+    except socket.error, e:
+        utility.abort('Unable to listen on "%s".' % path, e)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    utility.info('Brokering connections at "%s", idle timeout %d seconds.' % (path, idle_timeout))
+    try:
+        while not server.is_idle():
+            time.sleep(1)
+        utility.info('Exiting after %d idle seconds.' % idle_timeout)
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.pool.close()
+        if os.path.exists(path):
+            os.remove(path)
@@ -71,6 +71,10 @@ if not java:
     utility.abort('Could not find java in environment, set JAVA_HOME or put java in the path.')
 java_opts = []
 
+# Options explicitly requested through VOLTDB_HEAPMAX, VOLTDB_OPTS and
+# JAVA_OPTS. A tuning profile never overrides these.
+java_opts_user = []
+
 #If this is a large memory system commit the full heap
 specifyMinimumHeapSize = False
 if platform.system() == "Linux":
@@ -83,43 +87,193 @@ if platform.system() == "Linux":
 
 if 'VOLTDB_HEAPMAX' in os.environ:
     try:
-        java_opts.append('-Xmx%dm' % int(os.environ.get('VOLTDB_HEAPMAX')))
+        java_opts_user.append('-Xmx%dm' % int(os.environ.get('VOLTDB_HEAPMAX')))
         if specifyMinimumHeapSize:
-            java_opts.append('-Xms%dm' % int(os.environ.get('VOLTDB_HEAPMAX')))
-            java_opts.append('-XX:+AlwaysPreTouch')
+            java_opts_user.append('-Xms%dm' % int(os.environ.get('VOLTDB_HEAPMAX')))
+            java_opts_user.append('-XX:+AlwaysPreTouch')
     except ValueError:
-        java_opts.append(os.environ.get('VOLTDB_HEAPMAX'))
+        java_opts_user.append(os.environ.get('VOLTDB_HEAPMAX'))
 if 'VOLTDB_OPTS' in os.environ:
-    java_opts.extend(shlex.split(os.environ['VOLTDB_OPTS']))
+    java_opts_user.extend(shlex.split(os.environ['VOLTDB_OPTS']))
 if 'JAVA_OPTS' in os.environ:
-    java_opts.extend(shlex.split(os.environ['JAVA_OPTS']))
+    java_opts_user.extend(shlex.split(os.environ['JAVA_OPTS']))
+java_opts.extend(java_opts_user)
 if not [opt for opt in java_opts if opt.startswith('-Xmx')]:
     java_opts.append('-Xmx2048m')
     if specifyMinimumHeapSize:
         java_opts.append('-Xms2048m')
         java_opts.append('-XX:+AlwaysPreTouch')
 
+# Common options that are independent of the heap and collector choices.
+java_opts_common = [
+    '-server',
+    '-Djava.awt.headless=true -Dsun.net.inetaddr.ttl=300 -Dsun.net.inetaddr.negative.ttl=3600',
+    '-XX:+HeapDumpOnOutOfMemoryError',
+    '-XX:HeapDumpPath=/tmp',
+    '-Dsun.rmi.dgc.server.gcInterval=9223372036854775807',
+    '-Dsun.rmi.dgc.client.gcInterval=9223372036854775807',
+]
+
+# Default garbage collector options. A tuning profile replaces these.
+java_opts_gc = [
+    '-XX:+UseParNewGC',
+    '-XX:+UseConcMarkSweepGC',
+    '-XX:+CMSParallelRemarkEnabled',
+    '-XX:+UseTLAB',
+    '-XX:CMSInitiatingOccupancyFraction=75',
+    '-XX:+UseCMSInitiatingOccupancyOnly',
+    '-XX:+UseCondCardMark',
+    '-XX:CMSWaitDuration=120000',
+    '-XX:CMSMaxAbortablePrecleanTime=120000',
+    '-XX:+ExplicitGCInvokesConcurrent',
+    '-XX:+CMSScavengeBeforeRemark',
+    '-XX:+CMSClassUnloadingEnabled',
+]
+
+# Options that select a garbage collector, e.g. -XX:+UseG1GC.
+collector_re = re.compile(r'-XX:\+Use\w+GC$')
+
 # Set common options now.
-java_opts.append('-server')
-java_opts.append('-Djava.awt.headless=true -Dsun.net.inetaddr.ttl=300 -Dsun.net.inetaddr.negative.ttl=3600')
-java_opts.append('-XX:+HeapDumpOnOutOfMemoryError')
-java_opts.append('-XX:HeapDumpPath=/tmp')
-java_opts.append('-XX:+UseParNewGC')
-java_opts.append('-XX:+UseConcMarkSweepGC')
-java_opts.append('-XX:+CMSParallelRemarkEnabled')
-java_opts.append('-XX:+UseTLAB')
-java_opts.append('-XX:CMSInitiatingOccupancyFraction=75')
-java_opts.append('-XX:+UseCMSInitiatingOccupancyOnly')
-java_opts.append('-XX:+UseCondCardMark')
-java_opts.append('-Dsun.rmi.dgc.server.gcInterval=9223372036854775807')
-java_opts.append('-Dsun.rmi.dgc.client.gcInterval=9223372036854775807')
-java_opts.append('-XX:CMSWaitDuration=120000')
-java_opts.append('-XX:CMSMaxAbortablePrecleanTime=120000')
-java_opts.append('-XX:+ExplicitGCInvokesConcurrent')
-java_opts.append('-XX:+CMSScavengeBeforeRemark')
-java_opts.append('-XX:+CMSClassUnloadingEnabled')
+java_opts.extend(java_opts_common)
+java_opts.extend(java_opts_gc)
 java_opts.append('-XX:PermSize=64m')
 
+class HostInfo(object):
+    """
+    Hardware and operating system facts relevant to JVM tuning. Values that
+    can't be determined on this platform are left as None.
+    """
+    def __init__(self):
+        self.cores          = None
+        self.memory_mb      = None
+        self.numa_nodes     = None
+        self.thp            = None
+        self.hugepages      = None
+        self.hugepage_kb    = None
+        self.cgroup_cpus    = None
+        self.cgroup_mem_mb  = None
+
+    def effective_cores(self):
+        """
+        Cores usable by the server, taking a cgroup CPU quota into account.
+        """
+        cores = self.cores or 1
+        if self.cgroup_cpus:
+            cores = max(1, min(cores, self.cgroup_cpus))
+        return cores
+
+    def effective_memory_mb(self):
+        """
+        Memory usable by the server, taking a cgroup memory limit into account.
+        """
+        memory_mb = self.memory_mb
+        if self.cgroup_mem_mb and (memory_mb is None or self.cgroup_mem_mb < memory_mb):
+            memory_mb = self.cgroup_mem_mb
+        return memory_mb
+
+def _read_first_line(path):
+    # Internal function to read a sysfs/procfs value or return None.
+    try:
+        f = open(path)
+        try:
+            return f.readline().strip()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+def get_host_info():
+    """
+    Inspect the local host (cores, memory, NUMA nodes, transparent huge pages,
+    huge page pool and cgroup limits) and return a HostInfo object.
+    """
+    host = HostInfo()
+    try:
+        host.cores = os.sysconf('SC_NPROCESSORS_ONLN')
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        f = open('/proc/meminfo')
+        try:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                if fields[0] == 'MemTotal:':
+                    host.memory_mb = int(fields[1]) / 1024
+                elif fields[0] == 'HugePages_Total:':
+                    host.hugepages = int(fields[1])
+                elif fields[0] == 'Hugepagesize:':
+                    host.hugepage_kb = int(fields[1])
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        pass
+    if host.memory_mb is None:
+        try:
+            host.memory_mb = (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')) / (1024 * 1024)
+        except (ValueError, OSError, AttributeError):
+            pass
+    if os.path.isdir('/sys/devices/system/node'):
+        host.numa_nodes = len(glob.glob('/sys/devices/system/node/node[0-9]*')) or None
+    # The active transparent huge page setting is bracketed, e.g. "always [madvise] never".
+    thp = _read_first_line('/sys/kernel/mm/transparent_hugepage/enabled')
+    if thp:
+        m = re.search(r'\[(\w+)\]', thp)
+        if m:
+            host.thp = m.group(1)
+    # Memory limit, cgroup v2 first, then v1. Huge "unlimited" values are ignored.
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        limit = _read_first_line(path)
+        if limit and limit.isdigit():
+            limit_mb = int(limit) / (1024 * 1024)
+            if host.memory_mb is None or limit_mb < host.memory_mb:
+                host.cgroup_mem_mb = limit_mb
+            break
+    # CPU quota, cgroup v2 ("quota period") first, then v1.
+    quota = period = None
+    cpu_max = _read_first_line('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        fields = cpu_max.split()
+        if len(fields) == 2 and fields[0].isdigit():
+            quota, period = int(fields[0]), int(fields[1])
+    else:
+        quota_s = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period_s = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota_s and period_s and quota_s.isdigit() and period_s.isdigit():
+            quota, period = int(quota_s), int(period_s)
+    if quota and period:
+        host.cgroup_cpus = max(1, (quota + period - 1) / period)
+    return host
+
+def build_java_opts(profile):
+    """
+    Build the JVM option list with a tuning profile's heap and collector
+    options replacing the defaults. Explicit user options come last, since
+    the JVM uses the last occurrence of a flag, and the options they set are
+    left out of the rest: all of the profile's heap options when they set
+    -Xmx, the collector selection when they choose a collector, and any
+    other -X option they repeat. The profile is a dictionary with optional
+    "heap" and "gc" option strings.
+    """
+    if not profile:
+        return java_opts
+    user_symbols = set(utility.java_option_symbol(opt)
+                       for opt in java_opts_user if opt.startswith('-X'))
+    opts = []
+    if not [opt for opt in java_opts_user if opt.startswith('-Xmx')]:
+        opts.extend(shlex.split(profile.get('heap', '')))
+    opts.extend(java_opts_common)
+    gc_opts = shlex.split(profile.get('gc', '')) or java_opts_gc
+    if [opt for opt in java_opts_user if collector_re.match(opt)]:
+        gc_opts = [opt for opt in gc_opts if not collector_re.match(opt)]
+    opts.extend(gc_opts)
+    opts.append('-XX:PermSize=64m')
+    opts = [opt for opt in opts
+            if not (opt.startswith('-X') and utility.java_option_symbol(opt) in user_symbols)]
+    opts.extend(java_opts_user)
+    return opts
+
 def initialize(standalone_arg, command_name_arg, command_dir_arg, version_arg):
     """
     Set the VOLTDB_LIB and VOLTDB_VOLTDB environment variables based on the
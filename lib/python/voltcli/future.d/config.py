@@ -36,10 +36,14 @@ def config(runner):
             bad.append(arg)
     if bad:
         runner.abort('Bad arguments (must be KEY=VALUE format):', bad)
-    for arg in runner.opts.keyvalue:
-        key, value = [s.strip() for s in arg.split('=', 1)]
-        # Default to 'volt.' if simple name is given.
-        if key.find('.') == -1:
-            key = 'volt.%s' % key
-        runner.config.set_local(key, value)
-        runner.info('Configuration: %s=%s' % (key, value))
+    runner.config.begin_batch()
+    try:
+        for arg in runner.opts.keyvalue:
+            key, value = [s.strip() for s in arg.split('=', 1)]
+            # Default to 'volt.' if simple name is given.
+            if key.find('.') == -1:
+                key = 'volt.%s' % key
+            runner.config.set_local(key, value)
+            runner.info('Configuration: %s=%s' % (key, value))
+    finally:
+        runner.config.end_batch()
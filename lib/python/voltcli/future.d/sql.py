@@ -25,10 +25,311 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import sys
+import csv
+import time
+import shlex
+import binascii
+from voltcli import utility
+
+# Invocations sent ahead of reading their responses.
+pipeline_window = 100
+
+# Parameters of procedures that aren't in the catalog, e.g. system procedures,
+# are sent as strings for the server to convert.
+string_param = utility.volt_types['VARCHAR']
+
+# "show" and "list" subjects -> @SystemCatalog selector
+catalog_selectors = {
+    'tables':     'TABLES',
+    'proc':       'PROCEDURES',
+    'procedures': 'PROCEDURES',
+    'classes':    'CLASSES',
+}
+
+# SQLCommand commands that only work in the interactive interpreter.
+interactive_commands = ('help', 'go', 'recall', 'file', 'load classes', 'remove classes')
+
+numeric_types = set([
+    VOLT.FastSerializer.VOLTTYPE_TINYINT,
+    VOLT.FastSerializer.VOLTTYPE_SMALLINT,
+    VOLT.FastSerializer.VOLTTYPE_INTEGER,
+    VOLT.FastSerializer.VOLTTYPE_BIGINT,
+    VOLT.FastSerializer.VOLTTYPE_FLOAT,
+    VOLT.FastSerializer.VOLTTYPE_DECIMAL,
+])
+
+def split_statements(text):
+    """
+    Split text into statements at semi-colons outside of quotes and
+    comments. Return the statements and any unterminated remainder.
+    """
+    statements = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == '-' and text.startswith('--', i):
+            end = text.find('\n', i)
+            if end == -1:
+                end = len(text)
+            text = text[:i] + text[end:]
+            continue
+        elif c == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            if end == -1:
+                break
+            text = text[:i] + ' ' + text[end + 2:]
+            continue
+        elif c == ';':
+            statements.append(text[start:i].strip())
+            start = i + 1
+        i += 1
+    return [s for s in statements if s], text[start:].strip()
+
+def is_exit(statement):
+    return statement.lower() in ('exit', 'quit')
+
+def get_words(statement):
+    lexer = shlex.shlex(statement, posix = True)
+    lexer.whitespace += ','
+    lexer.whitespace_split = True
+    return list(lexer)
+
+def format_value(value, wire_type):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if wire_type == VOLT.FastSerializer.VOLTTYPE_VARBINARY:
+        return binascii.hexlify(value).upper()
+    return str(value)
+
+class Formatter(object):
+    """
+    Writes result tables in the fixed, csv or tab output format.
+    """
+    def __init__(self, format, clean, f = sys.stdout):
+        self.format = format
+        self.clean = clean
+        self.f = f
+        if format == 'csv':
+            self.writer = csv.writer(f, lineterminator = '\n')
+
+    def write(self, table, elapsed):
+        types = [column.type for column in table.columns]
+        headings = [column.name or 'modified_tuples' for column in table.columns]
+        rows = [[format_value(value, types[i]) for i, value in enumerate(row)]
+                    for row in table.tuples]
+        if self.format == 'fixed':
+            self.write_fixed(types, headings, rows)
+        elif self.format == 'csv':
+            if not self.clean:
+                self.writer.writerow(headings)
+            self.writer.writerows(rows)
+        else:
+            if not self.clean:
+                self.f.write('%s\n' % '\t'.join(headings))
+            for row in rows:
+                self.f.write('%s\n' % '\t'.join(row))
+        if not self.clean:
+            self.f.write('\n(Returned %d rows in %.2fs)\n\n' % (len(rows), elapsed))
+
+    def write_fixed(self, types, headings, rows):
+        widths = [len(heading) for heading in headings]
+        for row in rows:
+            for i, value in enumerate(row):
+                widths[i] = max(widths[i], len(value))
+        def format_row(row):
+            values = []
+            for i, value in enumerate(row):
+                if types[i] in numeric_types:
+                    values.append(value.rjust(widths[i]))
+                else:
+                    values.append(value.ljust(widths[i]))
+            return ' '.join(values).rstrip()
+        if not self.clean:
+            self.f.write('%s\n' % format_row(headings))
+            self.f.write('%s\n' % ' '.join(['-' * width for width in widths]))
+        for row in rows:
+            self.f.write('%s\n' % format_row(row))
+
+class Session(object):
+    """
+    Runs statements over one connection. Calls are pipelined up to the
+    window and results are written in statement order.
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        self.client = runner.client
+        self.formatter = Formatter(runner.opts.format, runner.opts.clean)
+        self.handle = 0
+        self.pending = {}
+        self.responses = {}
+        self.next_handle = 1
+        self.layouts = None
+        self.failures = 0
+
+    def get_layouts(self):
+        """
+        Return the cached parameter types of catalog procedures, keyed by
+        upper case name. Loaded once, before any pipelined calls are sent.
+        """
+        if self.layouts is None:
+            self.drain()
+            response = self.runner.call_proc('@SystemCatalog',
+                                             [VOLT.FastSerializer.VOLTTYPE_STRING],
+                                             ['PROCEDURECOLUMNS'])
+            table = response.table(0).table
+            names = [column.name for column in table.columns]
+            name_index = names.index('PROCEDURE_NAME')
+            type_index = names.index('TYPE_NAME')
+            position_index = names.index('ORDINAL_POSITION')
+            params = {}
+            for row in table.tuples:
+                params.setdefault(row[name_index].upper(), []).append(
+                        (row[position_index], utility.volt_types.get(row[type_index], string_param)))
+            self.layouts = {}
+            for name, layout in params.items():
+                self.layouts[name] = [param for position, param in sorted(layout)]
+        return self.layouts
+
+    def get_call(self, statement):
+        """
+        Translate a statement into (procedure name, wire types, parameters).
+        """
+        words = statement.split(None, 1)
+        command = words[0].lower()
+        if command in ('exec', 'execute'):
+            args = get_words(statement)[1:]
+            if not args:
+                raise ValueError('Missing procedure name.')
+            name, args = args[0], args[1:]
+            layout = None
+            if not name.startswith('@'):
+                layout = self.get_layouts().get(name.upper())
+                if layout is not None and len(layout) != len(args):
+                    raise ValueError('Procedure %s expects %d parameters, %d were given.'
+                                        % (name, len(layout), len(args)))
+            if layout is None:
+                layout = [string_param] * len(args)
+            params = []
+            for i, arg in enumerate(args):
+                if arg.upper() == 'NULL':
+                    params.append(None)
+                else:
+                    params.append(layout[i][1](arg))
+            return name, [param[0] for param in layout], params
+        string_types = [VOLT.FastSerializer.VOLTTYPE_STRING]
+        phrase = ' '.join(statement.lower().split())
+        for interactive_command in interactive_commands:
+            if phrase == interactive_command or phrase.startswith(interactive_command + ' '):
+                raise ValueError('"%s" is only supported in the interactive interpreter.'
+                                    % interactive_command.upper())
+        if command == 'explain' and len(words) > 1:
+            return '@Explain', string_types, [words[1]]
+        if command == 'explainproc' and len(words) > 1:
+            return '@ExplainProc', string_types, [words[1].strip()]
+        if command in ('show', 'list') and len(words) > 1:
+            selector = catalog_selectors.get(words[1].strip().lower())
+            if selector:
+                return '@SystemCatalog', string_types, [selector]
+        return '@AdHoc', string_types, [statement]
+
+    def execute(self, statement):
+        # Every statement takes the next handle, so results and errors are
+        # written in statement order.
+        self.handle += 1
+        handle = self.handle
+        try:
+            name, types, params = self.get_call(statement)
+            message = VOLT.VoltProcedure(self.client, name, types).serialize(params, handle)
+        except utility.volt_value_errors, e:
+            self.responses[handle] = (statement, e, 0)
+            self.write_responses()
+            return
+        self.client.socket.sendall(message)
+        self.pending[handle] = (statement, time.time())
+        while len(self.pending) >= pipeline_window:
+            self.receive()
+
+    def receive(self):
+        response = VOLT.VoltResponse(self.client)
+        statement, sent = self.pending.pop(response.clientHandle)
+        self.responses[response.clientHandle] = (statement, response, time.time() - sent)
+        self.write_responses()
+
+    def write_responses(self):
+        while self.next_handle in self.responses:
+            statement, response, elapsed = self.responses.pop(self.next_handle)
+            self.next_handle += 1
+            if isinstance(response, Exception):
+                self.failures += 1
+                utility.error('%s' % statement, response)
+            elif response.status != 1:
+                self.failures += 1
+                messages = [response.statusString]
+                if self.runner.opts.exception_stacks and response.exception:
+                    messages.append(str(response.exception))
+                utility.error('%s' % statement, messages)
+            else:
+                for table in response.tables:
+                    self.formatter.write(table, elapsed)
+            sys.stdout.flush()
+
+    def drain(self):
+        while self.pending:
+            self.receive()
+
+def run_interactive(runner):
+    # SQLCommand provides the interactive interpreter with its local
+    # commands, e.g. "file", "recall", "help" and "load classes".
+    args = []
+    if runner.opts.host:
+        if runner.opts.host.host:
+            args.append('--servers=%s' % runner.opts.host.host)
+        if runner.opts.host.port:
+            args.append('--port=%d'    % runner.opts.host.port)
+    if runner.opts.username:
+        args.append('--user=%s'     % runner.opts.username)
+        args.append('--password=%s' % runner.opts.password)
+    if runner.opts.format:
+        args.append('--output-format=%s' % runner.opts.format.lower())
+    if runner.opts.clean:
+        args.append('--output-skip-metadata')
+    if runner.opts.exception_stacks:
+        args.append('--debug')
+    runner.java_execute('org.voltdb.utils.SQLCommand', None, *args)
+
+def read_file(runner, path):
+    if path == '-':
+        return sys.stdin.read()
+    try:
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, OSError), e:
+        runner.abort('Unable to read SQL file "%s".' % path, e)
+
 @VOLT.Command(
-    bundles = VOLT.ConnectionBundle(),
+    bundles = VOLT.ClientBundle(),
     description  = 'Run the interactive SQL interpreter.',
-    description2 = 'Optional arguments are executed as non-interactive queries.',
+    description2 = '''
+Optional arguments and --file input are executed as non-interactive queries,
+pipelined over one connection. Statements are separated by semi-colons. Besides
+SQL, "exec PROC [PARAM ...]", "explain SQL", "explainproc PROC",
+"show|list tables|procedures|classes" and "exit" are supported. Input is read
+from stdin when it is not a terminal. Without any input the interactive
+interpreter is started, which also supports "file", "recall", "help" and
+"load|remove classes".''',
     options = [
         VOLT.EnumOption(None, '--format', 'format',
                         'output format', 'fixed', 'csv', 'tab',
@@ -39,6 +340,8 @@
         VOLT.BooleanOption(None, '--exception-stacks', 'exception_stacks',
                            'display exception stack traces',
                            default = False),
+        VOLT.StringOption('-f', '--file', 'file',
+                          'file of statements to execute ("-" for stdin)'),
     ],
     arguments = [
         VOLT.StringArgument('query', min_count = 0, max_count = None,
@@ -46,21 +349,27 @@
     ],
 )
 def sql(runner):
-    args = []
-    if runner.opts.host:
-        if runner.opts.host.host:
-            args.append('--servers=%s' % runner.opts.host.host)
-        if runner.opts.host.port:
-            args.append('--port=%d'    % runner.opts.host.port)
-    if runner.opts.username:
-        args.append('--user=%s'     % runner.opts.username)
-        args.append('--password=%s' % runner.opts.password)
+    texts = []
     for query in runner.opts.query:
-        args.append('--query=%s' % query)
-    if runner.opts.format:
-        args.append('--output-format=%s' % runner.opts.format.lower())
-    if runner.opts.clean:
-        args.append('--output-skip-metadata')
-    if runner.opts.exception_stacks:
-        args.append('--debug')
-    runner.java_execute('org.voltdb.utils.SQLCommand', None, *args)
+        texts.append(query)
+    if runner.opts.file:
+        texts.append(read_file(runner, runner.opts.file))
+    if not texts and not sys.stdin.isatty():
+        texts.append(sys.stdin.read())
+    if not texts:
+        run_interactive(runner)
+        return
+    session = Session(runner)
+    statements = []
+    for text in texts:
+        text_statements, remainder = split_statements(text)
+        statements.extend(text_statements)
+        if remainder:
+            statements.append(remainder)
+    for statement in statements:
+        if is_exit(statement):
+            break
+        session.execute(statement)
+    session.drain()
+    if session.failures:
+        sys.exit(1)
@@ -30,6 +30,7 @@ __author__ = 'scooper'
 import sys
 import os
 import inspect
+import threading
 
 import voltdbclient
 from verbs import *
@@ -78,6 +79,9 @@ Python versions, as long is it is version 2.4 or later.
 
       python2.6 bin/%(name)s VERB [ OPTIONS ... ] [ ARGUMENTS ... ]'''
 
+# Java classes that get the persisted tuning profile (see "voltdb tune").
+tuned_java_classes = ['org.voltdb.VoltDB']
+
 # README file template.
 readme_template = '''
 === %(name)s README ===
@@ -132,7 +136,11 @@ class JavaRunner(object):
         if kwargs_classpath:
             classpath = ':'.join((kwargs_classpath, classpath))
         java_args = [environment.java]
-        java_opts = utility.merge_java_options(environment.java_opts, java_opts_override)
+        if java_class in tuned_java_classes:
+            base_java_opts = environment.build_java_opts(self.get_tuning_profile())
+        else:
+            base_java_opts = environment.java_opts
+        java_opts = utility.merge_java_options(base_java_opts, java_opts_override)
         java_args.extend(java_opts)
         java_args.append('-Dlog4j.configuration=file://%s' % os.environ['LOG4J_CONFIG_PATH'])
         java_args.append('-Djava.library.path="%s"' % os.environ['VOLTDB_VOLTDB'])
@@ -148,6 +156,18 @@ class JavaRunner(object):
         else:
             return utility.run_cmd(*java_args)
 
+    def get_tuning_profile(self):
+        """
+        Return the persisted tuning profile as a dictionary, e.g. with "heap"
+        and "gc" option strings, or None if "voltdb tune" hasn't saved one.
+        """
+        profile = {}
+        for key, value in self.config.query_pairs(filter = 'tune.'):
+            profile[key.split('.', 1)[1]] = value
+        if profile:
+            utility.verbose_info('Applying tuning profile:', utility.dict_to_sorted_pairs(profile))
+        return profile or None
+
     def compile(self, outdir, *srcfiles):
         """
         Compile Java source using javac.
@@ -181,6 +201,8 @@ class VerbRunner(object):
         self.java = JavaRunner(self.verb, self.config, **kwargs)
         # Populated for Volt client verbs.
         self.client = None
+        # Populated with (host, client) pairs for cluster-wide client verbs.
+        self.clients = None
 
     def shell(self, *args):
         """
@@ -414,6 +436,86 @@ class VerbRunner(object):
         utility.verbose_info(response)
         return utility.VoltResponseWrapper(response)
 
+    def call_proc_monitored(self, sysproc_name, types, args, monitor, interval=2,
+                            check_status=True, timeout=None):
+        """
+        Call a procedure like call_proc() while calling monitor(client) every
+        interval seconds until the call returns. The monitor receives its own
+        connection so that it can poll statistics while the main connection
+        waits for the response. Monitor failures are reported as warnings.
+        """
+        if self.client is None:
+            utility.abort('Command is not set up as a client.',
+                          'Add an appropriate admin or client bundle to @VOLT.Command().')
+        kwargs = {}
+        if self.opts.username:
+            kwargs['username'] = self.opts.username
+            if self.opts.password:
+                kwargs['password'] = self.opts.password
+        try:
+            monitor_client = voltdbclient.FastSerializer(self.opts.host.host, self.opts.host.port, **kwargs)
+        except Exception, e:
+            utility.abort('Unable to open a monitoring connection.', e)
+        utility.verbose_info('Call procedure: %s%s' % (sysproc_name, tuple(args)))
+        proc = voltdbclient.VoltProcedure(self.client, sysproc_name, types)
+        result = {}
+        def call():
+            try:
+                result['response'] = proc.call(params=args, timeout=timeout)
+            except Exception, e:
+                result['exception'] = e
+        thread = threading.Thread(target=call)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                thread.join(interval)
+                if not thread.isAlive():
+                    break
+                try:
+                    monitor(monitor_client)
+                except Exception, e:
+                    utility.warning('Monitoring "%s" failed.' % sysproc_name, e)
+        finally:
+            monitor_client.close()
+        if 'exception' in result:
+            utility.abort('"%s" procedure call failed.' % sysproc_name, result['exception'])
+        response = result['response']
+        if check_status and response.status != 1:
+            utility.abort('"%s" procedure call failed.' % sysproc_name, (response,))
+        utility.verbose_info(response)
+        return utility.VoltResponseWrapper(response)
+
+    def call_proc_all(self, sysproc_name, types, args, check_status=True, timeout=None):
+        """
+        Call a procedure on every connected cluster host in parallel. Returns
+        a response wrapper whose tables merge the per-host tables, with the
+        host added as the first column. Hosts that fail are reported and
+        cause an abort when check_status is True, otherwise they are skipped.
+        """
+        if not self.clients:
+            utility.abort('Command is not set up as a cluster client.',
+                          'Add a cluster admin bundle to @VOLT.Command().')
+        utility.verbose_info('Call procedure on %d hosts: %s%s'
+                                % (len(self.clients), sysproc_name, tuple(args)))
+        def call(host_client):
+            proc = voltdbclient.VoltProcedure(host_client[1], sysproc_name, types)
+            return proc.call(params=args, timeout=timeout)
+        host_responses = []
+        failed = []
+        for (host, client), response, e in utility.run_parallel(call, self.clients):
+            if e is not None:
+                failed.append('%s: %s' % (host, e))
+            elif response.status != 1:
+                failed.append('%s: %s' % (host, response.statusString))
+            else:
+                host_responses.append((host, response))
+        if failed:
+            if check_status:
+                utility.abort('"%s" procedure call failed.' % sysproc_name, failed)
+            utility.warning('"%s" procedure call failed on some hosts.' % sysproc_name, failed)
+        return utility.VoltResponseWrapper(merge_host_responses(host_responses))
+
     def java_execute(self, java_class, java_opts_override, *args, **kwargs):
         """
         Execute a Java program.
@@ -524,6 +626,29 @@ runner.main('%(name)s', '', '%(version)s', '%(description)s',
         output = utility.kwargs_get_string(kwargs, 'daemon_output', default=environment.command_dir)
         return utility.Daemonizer(name, description, output=output)
 
+#===============================================================================
+def merge_host_responses(host_responses):
+#===============================================================================
+    """
+    Merge (host, VoltResponse) pairs into one VoltResponse. Each merged table
+    gets a leading HOST column followed by the original columns.
+    """
+    merged = voltdbclient.VoltResponse(None)
+    merged.status = 1
+    merged.tables = []
+    for host, response in host_responses:
+        for i in range(len(response.tables)):
+            table = response.tables[i]
+            if i == len(merged.tables):
+                merged_table = voltdbclient.VoltTable(None)
+                merged_table.columns = ([voltdbclient.VoltColumn(
+                                            type = voltdbclient.FastSerializer.VOLTTYPE_STRING,
+                                            name = 'HOST')]
+                                        + table.columns)
+                merged.tables.append(merged_table)
+            merged.tables[i].tuples.extend([[host] + list(row) for row in table.tuples])
+    return merged
+
 #===============================================================================
 class VOLT(object):
 #===============================================================================
@@ -547,6 +672,7 @@ class VOLT(object):
         self.VoltTable      = voltdbclient.VoltTable
         self.VoltColumn     = voltdbclient.VoltColumn
         self.FastSerializer = voltdbclient.FastSerializer
+        self.VoltVarbinaryFile = voltdbclient.VoltVarbinaryFile
         # For declaring multi-command verbs like "show".
         self.Modifier = Modifier
         # Bundles
@@ -554,6 +680,7 @@ class VOLT(object):
         self.ClientBundle     = ClientBundle
         self.AdminBundle      = AdminBundle
         self.ServerBundle     = ServerBundle
+        self.ClusterAdminBundle = ClusterAdminBundle
         # As a convenience expose the utility module so that commands don't
         # need to import it.
         self.utility = utility
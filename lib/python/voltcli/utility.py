@@ -41,10 +41,18 @@ import re
 import pkgutil
 import binascii
 import stat
+import struct
+import time
+import calendar
+import datetime
+import decimal
 import daemon
 import signal
 import textwrap
 import string
+import threading
+import Queue
+import voltdbclient
 
 #===============================================================================
 class Global:
@@ -461,6 +469,44 @@ def pipe_cmd(*args):
     except Exception, e:
         warning('Exception running command: %s' % ' '.join(args), e)
 
+#===============================================================================
+def run_parallel(function, items, max_threads = None):
+#===============================================================================
+    """
+    Call function(item) for each item using a pool of worker threads, one per
+    item unless max_threads is lower. Return a list of (item, result,
+    exception) tuples in the original item order.
+    Exceptions are captured rather than raised so that one failing item
+    doesn't prevent collecting the results of the others.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = Queue.Queue()
+    for i in range(len(items)):
+        pending.put(i)
+    def worker():
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (items[i], function(items[i]), None)
+            except Exception, e:
+                results[i] = (items[i], None, e)
+    thread_count = len(items)
+    if max_threads is not None:
+        thread_count = min(max_threads, thread_count)
+    threads = [threading.Thread(target = worker) for i in range(thread_count)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # Join with a timeout so that a keyboard interrupt still gets through.
+        while thread.isAlive():
+            thread.join(0.1)
+    return results
+
 #===============================================================================
 def daemon_file_name(base_name=None, host=None, instance=None):
 #===============================================================================
@@ -750,6 +796,15 @@ class Zipper(object):
     def _abort(self, *msgs):
         abort('Fatal error writing zip file "%s".' % self.output_path, msgs)
 
+#===============================================================================
+def java_option_symbol(opt):
+#===============================================================================
+    """
+    Return the symbol that identifies a -X... java option regardless of its
+    value, the alphabetic characters after "-X".
+    """
+    return ''.join([c for c in opt[2:] if c.isalpha()])
+
 #===============================================================================
 def merge_java_options(*opts):
 #===============================================================================
@@ -763,8 +818,7 @@ def merge_java_options(*opts):
         if opt is not None:
             # This is somewhat simplistic logic that might have unlikely failure scenarios.
             if opt.startswith('-X'):
-                # The symbol is the initial string of contiguous alphabetic characters.
-                sym = ''.join([c for c in opt[2:] if c.isalpha()])
+                sym = java_option_symbol(opt)
                 if sym not in xargs:
                     xargs.add(sym)
                     ret_opts.append(opt)
@@ -1074,20 +1128,43 @@ class FileGenerator(object):
             output_stream.close()
 
 
+#===============================================================================
+def get_file_stamp(path):
+#===============================================================================
+    """
+    Return (modification time, size) for detecting file changes, or None if
+    the file doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except (IOError, OSError):
+        return None
+    return (st.st_mtime, st.st_size)
+
 #===============================================================================
 class INIConfigManager(object):
 #===============================================================================
     """
-    Loads/saves INI format configuration to and from a dictionary.
+    Loads/saves INI format configuration to and from a dictionary. Parsed
+    files are cached per process until they change on disk, and saves
+    replace the file atomically.
     """
 
+    # Parsed dictionaries keyed by path, with the file stamp they came from.
+    cache = {}
+
     def load(self, path):
+        stamp = get_file_stamp(path)
+        cached = INIConfigManager.cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return dict(cached[1])
         parser = ConfigParser.SafeConfigParser()
         parser.read(path)
         d = dict()
         for section in parser.sections():
             for name, value in parser.items(section):
                 d['%s.%s' % (section, name)] = value
+        INIConfigManager.cache[path] = (stamp, dict(d))
         return d
 
     def save(self, path, d):
@@ -1104,12 +1181,54 @@ class INIConfigManager(object):
                 parser.add_section(section)
                 cur_section = section
             parser.set(cur_section, name, d[key])
-        f = File(path, 'w')
+        # Write a temporary file and rename it so that readers never see a
+        # partially written configuration.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        f = File(temp_path, 'w')
         f.open()
         try:
             parser.write(f)
         finally:
             f.close()
+        try:
+            os.rename(temp_path, path)
+        except (IOError, OSError), e:
+            abort('Unable to replace configuration file "%s".' % path, e)
+        INIConfigManager.cache[path] = (get_file_stamp(path), dict(d))
+
+#===============================================================================
+class ConfigIndex(object):
+#===============================================================================
+    """
+    Index of configuration keys by section, i.e. the part before the first
+    '.', so that prefix queries such as "volt." only scan their section.
+    """
+
+    def __init__(self, d):
+        self.sections = {}
+        for key in d:
+            self.add(key)
+
+    def add(self, key):
+        self.sections.setdefault(key.split('.', 1)[0], set()).add(key)
+
+    def remove(self, key):
+        keys = self.sections.get(key.split('.', 1)[0])
+        if keys is not None:
+            keys.discard(key)
+
+    def find(self, filter):
+        """
+        Generate the keys starting with filter.
+        """
+        if filter.find('.') != -1:
+            sections = [filter.split('.', 1)[0]]
+        else:
+            sections = [section for section in self.sections if section.startswith(filter)]
+        for section in sections:
+            for key in self.sections.get(section, ()):
+                if key.startswith(filter):
+                    yield key
 
 #===============================================================================
 class PersistentConfig(object):
@@ -1117,6 +1236,7 @@ class PersistentConfig(object):
     """
     Persistent access to configuration data. Manages two configuration
     files, one for permanent configuration and the other for local state.
+    Changes made between begin_batch() and end_batch() are saved once.
     """
 
     def __init__(self, format, path, local_path):
@@ -1135,22 +1255,52 @@ class PersistentConfig(object):
             self.local = self.config_manager.load(self.local_path)
         else:
             self.local = {}
+        self.permanent_index = ConfigIndex(self.permanent)
+        self.local_index = ConfigIndex(self.local)
+        self.batch_depth = 0
+        self.dirty_permanent = False
+        self.dirty_local = False
+
+    def begin_batch(self):
+        """
+        Defer saving until the matching end_batch() call.
+        """
+        self.batch_depth += 1
+
+    def end_batch(self):
+        """
+        Save whatever changed since the outermost begin_batch() call.
+        """
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self.flush()
+
+    def flush(self):
+        """
+        Save modified configuration files.
+        """
+        if self.dirty_permanent:
+            self.save_permanent()
+        if self.dirty_local:
+            self.save_local()
 
     def save_permanent(self):
         """
         Save the permanent configuration.
         """
         self.config_manager.save(self.path, self.permanent)
+        self.dirty_permanent = False
 
     def save_local(self):
         """
         Save the local configuration (overrides and additions to permanent).
         """
-        if self.local:
+        if self.local_path:
             self.config_manager.save(self.local_path, self.local)
         else:
-            error('No local configuration was specified. (%s)' % tag,
+            error('No local configuration was specified.',
                   'For reference, the permanent configuration is "%s".' % self.path)
+        self.dirty_local = False
 
     def get(self, key):
         """
@@ -1165,14 +1315,31 @@ class PersistentConfig(object):
         Set a key/value pair in the permanent configuration.
         """
         self.permanent[key] = value
-        self.save_permanent()
+        self.permanent_index.add(key)
+        self.dirty_permanent = True
+        if self.batch_depth == 0:
+            self.save_permanent()
 
     def set_local(self, key, value):
         """
         Set a key/value pair in the local configuration.
         """
         self.local[key] = value
-        if self.local:
+        self.local_index.add(key)
+        self.dirty_local = True
+        if self.batch_depth == 0:
+            self.save_local()
+
+    def remove_local(self, *keys):
+        """
+        Remove keys from the local configuration.
+        """
+        for key in keys:
+            if key in self.local:
+                del self.local[key]
+                self.local_index.remove(key)
+        self.dirty_local = True
+        if self.batch_depth == 0:
             self.save_local()
 
     def query(self, filter = None):
@@ -1182,14 +1349,13 @@ class PersistentConfig(object):
         """
         if filter:
             results = {}
-            for key in self.local:
-                if key.startswith(filter):
-                    results[key] = self.local[key]
-            for key in self.permanent:
-                if key not in results and key.startswith(filter):
+            for key in self.local_index.find(filter):
+                results[key] = self.local[key]
+            for key in self.permanent_index.find(filter):
+                if key not in results:
                     results[key] = self.permanent[key]
         else:
-            results = self.local
+            results = dict(self.local)
             for key in self.permanent:
                 if key not in results:
                     results[key] = self.permanent[key]
@@ -1273,6 +1439,45 @@ class VoltResponseWrapper(object):
             output.append(self.format_tables())
         return '\n\n'.join(output)
 
+#===============================================================================
+def volt_timestamp(value):
+#===============================================================================
+    """
+    Convert microseconds since the epoch or "YYYY-MM-DD[ HH:MM:SS[.ffffff]]"
+    in UTC to a datetime. The serializer converts through local time, so
+    the result is a local datetime for the same instant.
+    """
+    if value.isdigit():
+        micros = int(value)
+    else:
+        if len(value) == 10:
+            value += ' 00:00:00'
+        fraction = 0
+        if '.' in value:
+            value, digits = value.split('.', 1)
+            fraction = int((digits + '000000')[:6])
+        seconds = calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+        micros = seconds * 1000000 + fraction
+    return datetime.datetime.fromtimestamp(micros / 1000000).replace(microsecond = micros % 1000000)
+
+# @SystemCatalog TYPE_NAME -> (wire type, converter from the string form)
+# Shared by verbs that send user supplied text as typed parameters.
+volt_types = {
+    'TINYINT':   (voltdbclient.FastSerializer.VOLTTYPE_TINYINT,   int),
+    'SMALLINT':  (voltdbclient.FastSerializer.VOLTTYPE_SMALLINT,  int),
+    'INTEGER':   (voltdbclient.FastSerializer.VOLTTYPE_INTEGER,   int),
+    'BIGINT':    (voltdbclient.FastSerializer.VOLTTYPE_BIGINT,    int),
+    'FLOAT':     (voltdbclient.FastSerializer.VOLTTYPE_FLOAT,     float),
+    'DECIMAL':   (voltdbclient.FastSerializer.VOLTTYPE_DECIMAL,   decimal.Decimal),
+    'VARCHAR':   (voltdbclient.FastSerializer.VOLTTYPE_STRING,    lambda value: value.decode('utf-8')),
+    'VARBINARY': (voltdbclient.FastSerializer.VOLTTYPE_VARBINARY, binascii.unhexlify),
+    'TIMESTAMP': (voltdbclient.FastSerializer.VOLTTYPE_TIMESTAMP, volt_timestamp),
+}
+
+# Errors raised converting or serializing a bad value. struct.error covers
+# integers outside the column's range.
+volt_value_errors = (ValueError, TypeError, OverflowError, struct.error, decimal.InvalidOperation)
+
 #===============================================================================
 class MessageDict(dict):
 #===============================================================================
@@ -29,6 +29,7 @@ __author__ = 'scooper'
 
 import sys
 from voltdbclient import *
+from voltcli import broker
 from voltcli import cli
 from voltcli import environment
 from voltcli import utility
@@ -552,7 +553,8 @@ class BaseClientBundle(ConnectionBundle):
     """
     Bundle class to automatically create a client connection.  Use by
     assigning an instance to the "bundles" keyword inside a decorator
-    invocation.
+    invocation. The connection goes through the local connection broker
+    ("voltadmin broker start") when one is running.
     """
     def __init__(self, default_port):
         ConnectionBundle.__init__(self, default_port = default_port, min_count = 1, max_count = 1)
@@ -564,7 +566,9 @@ class BaseClientBundle(ConnectionBundle):
                 kwargs['username'] = runner.opts.username
                 if runner.opts.password:
                     kwargs['password'] = runner.opts.password
-            runner.client = FastSerializer(runner.opts.host.host, runner.opts.host.port, **kwargs)
+            runner.client = broker.connect(runner.opts.host.host, runner.opts.host.port, **kwargs)
+            if runner.client is None:
+                runner.client = FastSerializer(runner.opts.host.host, runner.opts.host.port, **kwargs)
         except Exception, e:
             utility.abort(e)
 
@@ -592,3 +596,83 @@ class AdminBundle(BaseClientBundle):
     """
     def __init__(self, **kwargs):
         BaseClientBundle.__init__(self, 21211, **kwargs)
+
+#===============================================================================
+class ClusterAdminBundle(ConnectionBundle):
+#===============================================================================
+    """
+    Bundle class to create admin client connections to every node in the
+    cluster. The nodes are either listed with --host or, when a single host is
+    given, discovered through @SystemInformation. Connections are made in
+    parallel. Use runner.call_proc_all() to run a procedure on all of them.
+    """
+    def __init__(self, default_port = 21211, discover = True):
+        ConnectionBundle.__init__(self, default_port = default_port, min_count = 1, max_count = None)
+        self.discover = discover
+
+    def initialize(self, verb):
+        ConnectionBundle.initialize(self, verb)
+        verb.add_options(
+            cli.IntegerOption(None, '--timeout', 'timeout',
+                              'per-host connection and call timeout in seconds',
+                              default = 10))
+
+    def start(self, verb, runner):
+        kwargs = {}
+        if runner.opts.username:
+            kwargs['username'] = runner.opts.username
+            if runner.opts.password:
+                kwargs['password'] = runner.opts.password
+        kwargs['connect_timeout'] = runner.opts.timeout
+        kwargs['procedure_timeout'] = runner.opts.timeout
+        hosts = runner.opts.host
+        if self.discover and len(hosts) == 1:
+            hosts = self._discover(hosts[0], kwargs)
+        def connect(host):
+            return FastSerializer(host.host, host.port, **kwargs)
+        runner.clients = []
+        failed = []
+        for host, client, e in utility.run_parallel(connect, hosts):
+            name = '%s:%d' % (host.host, host.port)
+            if e is None:
+                runner.clients.append((name, client))
+            else:
+                failed.append('%s: %s' % (name, e))
+        if failed:
+            self.stop(verb, runner)
+            utility.abort('Unable to connect to all cluster hosts.', failed)
+        runner.client = runner.clients[0][1]
+
+    def stop(self, verb, runner):
+        if runner.clients:
+            for name, client in runner.clients:
+                client.close()
+        runner.clients = None
+        runner.client = None
+
+    def _discover(self, host, kwargs):
+        # Ask one node for the addresses and ports of all the nodes.
+        if self.default_port == 21211:
+            port_key = 'ADMINPORT'
+        else:
+            port_key = 'CLIENTPORT'
+        try:
+            client = FastSerializer(host.host, host.port, **kwargs)
+            try:
+                proc = VoltProcedure(client, '@SystemInformation', [FastSerializer.VOLTTYPE_STRING])
+                response = proc.call(params = ['OVERVIEW'])
+            finally:
+                client.close()
+        except Exception, e:
+            utility.abort('Unable to discover cluster hosts through %s:%d.' % (host.host, host.port), e)
+        if response.status != 1 or not response.tables:
+            utility.abort('Cluster host discovery failed.', (response,))
+        overview = {}
+        for host_id, key, value in response.tables[0].tuples:
+            overview.setdefault(host_id, {})[key] = value
+        hosts = []
+        for host_id in sorted(overview.keys()):
+            info = overview[host_id]
+            hosts.extend(utility.parse_hosts('%s:%s' % (info['IPADDRESS'], info[port_key])))
+        utility.verbose_info('Discovered cluster hosts:', ['%s:%d' % (h.host, h.port) for h in hosts])
+        return hosts
@@ -0,0 +1,88 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+from voltcli import daemon
+from voltcli import utility
+from voltcli import broker as connection_broker
+
+class BrokerDaemonizer(utility.Daemonizer):
+    """
+    Daemonizer that runs the broker in the forked process instead of
+    executing another program.
+    """
+    def on_started(self, path, idle_timeout):
+        connection_broker.serve(path, idle_timeout)
+
+def get_daemonizer(description):
+    return BrokerDaemonizer('voltbroker', description, output = utility.get_state_directory())
+
+def broker_start(runner):
+    if runner.opts.idle_timeout <= 0:
+        runner.abort('The idle timeout must be positive.')
+    path = connection_broker.get_socket_path()
+    if runner.opts.foreground:
+        connection_broker.serve(path, runner.opts.idle_timeout)
+    else:
+        get_daemonizer('connection broker').start_daemon(path, runner.opts.idle_timeout)
+
+def broker_stop(runner):
+    get_daemonizer('Connection broker').stop_daemon()
+    path = connection_broker.get_socket_path()
+    if os.path.exists(path):
+        os.remove(path)
+
+def broker_status(runner):
+    pid, alive = daemon.get_status(get_daemonizer('connection broker').pidfile)
+    if alive:
+        runner.info('Connection broker is running as process ID %d at "%s".'
+                        % (pid, connection_broker.get_socket_path()))
+    else:
+        runner.info('Connection broker is not running.')
+
+@VOLT.Multi_Command(
+    description = 'Keep database connections open for other commands.',
+    description2 = '''
+The broker holds authenticated connections and lends them to client and admin
+commands through a local Unix socket, so that scripted command sequences skip
+connecting and authenticating each time. Commands use the broker automatically
+while it runs. It exits after the idle timeout passes with no commands.''',
+    options = (
+        VOLT.IntegerOption('-t', '--idle-timeout', 'idle_timeout',
+                           'seconds without commands before the broker exits',
+                           default = connection_broker.default_idle_timeout),
+        VOLT.BooleanOption('-f', '--foreground', 'foreground',
+                           'run the broker in the foreground'),
+    ),
+    modifiers = (
+        VOLT.Modifier('start', broker_start, 'Start the connection broker.'),
+        VOLT.Modifier('stop', broker_stop, 'Stop the connection broker.'),
+        VOLT.Modifier('status', broker_status, 'Show whether the connection broker is running.'),
+    )
+)
+def broker(runner):
+    runner.go()
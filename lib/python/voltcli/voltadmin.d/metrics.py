@@ -0,0 +1,321 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import sys
+import os
+import re
+import time
+import socket
+import threading
+import Queue
+import BaseHTTPServer
+import SocketServer
+from voltcli import utility
+
+default_selectors = 'PROCEDURE,INITIATOR,TABLE,INDEX,MEMORY,CPU,IOSTATS'
+
+# Columns that @Statistics reports as per-interval deltas when polled with the
+# interval flag. They are accumulated into Prometheus counters. All other
+# numeric columns are exported as gauges holding the latest value.
+counter_columns = {
+    'PROCEDURE': set(['INVOCATIONS', 'TIMED_INVOCATIONS', 'ABORTS', 'FAILURES']),
+    'INITIATOR': set(['INVOCATIONS', 'ABORTS', 'FAILURES']),
+    'IOSTATS':   set(['BYTES_READ', 'MESSAGES_READ', 'BYTES_WRITTEN', 'MESSAGES_WRITTEN']),
+}
+
+numeric_types = set([
+    VOLT.FastSerializer.VOLTTYPE_TINYINT,
+    VOLT.FastSerializer.VOLTTYPE_SMALLINT,
+    VOLT.FastSerializer.VOLTTYPE_INTEGER,
+    VOLT.FastSerializer.VOLTTYPE_BIGINT,
+    VOLT.FastSerializer.VOLTTYPE_FLOAT,
+    VOLT.FastSerializer.VOLTTYPE_DECIMAL,
+])
+
+# Polling should take no more than this fraction of the sampling interval.
+max_poll_fraction = 0.1
+
+re_metric_char = re.compile('[^a-zA-Z0-9_]')
+
+def daemon_name(port):
+    return 'voltmetrics_%d' % port
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class ConnectionPool(object):
+    """
+    Fixed-size pool of admin connections shared by the polling threads.
+    Broken connections are dropped and re-established on the next checkout.
+    """
+    def __init__(self, host, port, size, **kwargs):
+        self.host = host
+        self.port = port
+        self.kwargs = kwargs
+        self.idle = Queue.Queue()
+        for i in range(size):
+            self.idle.put(None)
+
+    def call(self, name, types, params):
+        client = self.idle.get()
+        try:
+            if client is None:
+                client = VOLT.FastSerializer(self.host, self.port, **self.kwargs)
+            response = VOLT.VoltProcedure(client, name, types).call(params = params)
+        except Exception:
+            if client is not None:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+            self.idle.put(None)
+            raise
+        self.idle.put(client)
+        return response
+
+class Exporter(object):
+    """
+    Polls @Statistics selectors and renders the Prometheus text exposition.
+    The rendered text is rebuilt once per poll so that scrapes only copy a
+    string, no matter how many tables and procedures the schema has.
+    """
+    def __init__(self, pool, selectors, min_interval, max_interval):
+        self.pool = pool
+        self.selectors = selectors
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # selector -> {(metric, labels): accumulated counter value}
+        self.counters = dict((selector, {}) for selector in selectors)
+        # selector -> list of (metric, kind, labels, value)
+        self.samples = dict((selector, []) for selector in selectors)
+        self.scrape_errors = 0
+        self.poll_seconds = 0.0
+        self.text = ''
+        self.lock = threading.Lock()
+
+    def poll_selector(self, selector):
+        types = [VOLT.FastSerializer.VOLTTYPE_STRING, VOLT.FastSerializer.VOLTTYPE_TINYINT]
+        response = self.pool.call('@Statistics', types, [selector, 1])
+        if response.status != 1:
+            raise VOLT.VoltException(response.statusString)
+        return response.tables[0]
+
+    def update_selector(self, selector, table):
+        counters = counter_columns.get(selector, set())
+        label_columns = []
+        value_columns = []
+        for i, column in enumerate(table.columns):
+            if column.name == 'TIMESTAMP':
+                continue
+            if column.type not in numeric_types or column.name.endswith('_ID'):
+                label_columns.append((i, re_metric_char.sub('_', column.name.lower())))
+            else:
+                name = re_metric_char.sub('_', '%s_%s' % (selector, column.name)).lower()
+                value_columns.append((i, 'voltdb_%s' % name, column.name in counters))
+        accumulated = self.counters[selector]
+        samples = []
+        for row in table.tuples:
+            labels = ','.join(['%s="%s"' % (name, escape_label(row[i])) for i, name in label_columns])
+            for i, metric, is_counter in value_columns:
+                value = row[i]
+                if value is None:
+                    continue
+                if is_counter:
+                    key = ('%s_total' % metric, labels)
+                    accumulated[key] = accumulated.get(key, 0) + value
+                else:
+                    samples.append((metric, 'gauge', labels, value))
+        # Rows only appear for activity during the interval, so counters of
+        # e.g. idle procedures are carried over from earlier polls.
+        for (metric, labels), value in sorted(accumulated.items()):
+            samples.append((metric, 'counter', labels, value))
+        self.samples[selector] = samples
+
+    def poll(self):
+        start = time.time()
+        errors = []
+        results = utility.run_parallel(self.poll_selector, self.selectors)
+        for selector, table, e in results:
+            if e is None:
+                self.update_selector(selector, table)
+            else:
+                errors.append('%s: %s' % (selector, e))
+        self.poll_seconds = time.time() - start
+        if errors:
+            self.scrape_errors += 1
+            utility.warning('Statistics polling failed.', errors)
+        # Back off when polling is expensive relative to the interval and
+        # speed back up as it gets cheaper again.
+        self.interval = min(self.max_interval,
+                            max(self.min_interval, self.poll_seconds / max_poll_fraction))
+        self.render()
+
+    def render(self):
+        lines = []
+        metrics = {}
+        for selector in self.selectors:
+            for metric, kind, labels, value in self.samples[selector]:
+                metrics.setdefault((metric, kind), []).append((labels, value))
+        for metric, kind in sorted(metrics.keys()):
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for labels, value in metrics[(metric, kind)]:
+                lines.append('%s{%s} %s' % (metric, labels, value))
+        lines.append('# TYPE voltdb_exporter_poll_seconds gauge')
+        lines.append('voltdb_exporter_poll_seconds %f' % self.poll_seconds)
+        lines.append('# TYPE voltdb_exporter_interval_seconds gauge')
+        lines.append('voltdb_exporter_interval_seconds %f' % self.interval)
+        lines.append('# TYPE voltdb_exporter_errors_total counter')
+        lines.append('voltdb_exporter_errors_total %d' % self.scrape_errors)
+        text = '\n'.join(lines) + '\n'
+        self.lock.acquire()
+        try:
+            self.text = text
+        finally:
+            self.lock.release()
+
+    def get_text(self):
+        self.lock.acquire()
+        try:
+            return self.text
+        finally:
+            self.lock.release()
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.get_text()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        utility.verbose_info(format % args)
+
+def serve(exporter, address, port):
+    try:
+        server = MetricsServer((address, port), MetricsHandler)
+    except socket.error, e:
+        utility.abort('Unable to listen for HTTP requests on %s:%d.' % (address, port), e)
+    server.exporter = exporter
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    utility.info('Serving metrics at http://%s:%d/metrics' % (address, port))
+    exporter.run()
+
+class MetricsDaemonizer(utility.Daemonizer):
+    """
+    Daemonizer that keeps running the exporter in the forked process
+    instead of executing another program.
+    """
+    def on_started(self, exporter, address, port):
+        serve(exporter, address, port)
+
+def get_exporter(runner):
+    selectors = [s.strip().upper() for s in runner.opts.selectors.split(',') if s.strip()]
+    if not selectors:
+        runner.abort('At least one statistics selector is required.')
+    if runner.opts.interval <= 0 or runner.opts.max_interval < runner.opts.interval:
+        runner.abort('The interval must be positive and no larger than the maximum interval.')
+    kwargs = {}
+    if runner.opts.username:
+        kwargs['username'] = runner.opts.username
+        if runner.opts.password:
+            kwargs['password'] = runner.opts.password
+    pool = ConnectionPool(runner.opts.host.host, runner.opts.host.port,
+                          min(runner.opts.connections, len(selectors)), **kwargs)
+    exporter = Exporter(pool, selectors, runner.opts.interval, runner.opts.max_interval)
+    # Poll once up front so that connection and selector errors are
+    # reported before going into the background. The deltas since the
+    # statistics were last polled are counted like any other interval.
+    try:
+        for selector in selectors:
+            exporter.update_selector(selector, exporter.poll_selector(selector))
+    except Exception, e:
+        runner.abort('Unable to poll statistics from %s:%d.'
+                        % (runner.opts.host.host, runner.opts.host.port), e)
+    return exporter
+
+def metrics_start(runner):
+    exporter = get_exporter(runner)
+    if runner.opts.daemon:
+        daemonizer = MetricsDaemonizer(daemon_name(runner.opts.port), 'metrics exporter',
+                                       output = utility.get_state_directory())
+        daemonizer.start_daemon(exporter, runner.opts.address, runner.opts.port)
+    else:
+        serve(exporter, runner.opts.address, runner.opts.port)
+
+def metrics_stop(runner):
+    daemonizer = utility.Daemonizer(daemon_name(runner.opts.port), 'Metrics exporter',
+                                    output = utility.get_state_directory())
+    daemonizer.stop_daemon()
+
+@VOLT.Multi_Command(
+    bundles = VOLT.ConnectionBundle(default_port = 21211),
+    description = 'Export database statistics for Prometheus scraping.',
+    description2 = '''
+Polls @Statistics selectors with the interval (delta) flag and serves the
+latest values in Prometheus text format. Per-interval counts such as
+invocations are accumulated into counters. The sampling interval grows when
+polling is slow, up to the maximum interval.''',
+    options = (
+        VOLT.IntegerOption('-P', '--port', 'port',
+                           'HTTP port to serve metrics on', default = 9102),
+        VOLT.StringOption('-a', '--address', 'address',
+                          'HTTP address to listen on', default = '127.0.0.1'),
+        VOLT.StringOption('-s', '--selectors', 'selectors',
+                          'comma-separated @Statistics selectors', default = default_selectors),
+        VOLT.IntegerOption('-i', '--interval', 'interval',
+                           'minimum seconds between polls', default = 10),
+        VOLT.IntegerOption(None, '--max-interval', 'max_interval',
+                           'maximum seconds between polls', default = 120),
+        VOLT.IntegerOption('-c', '--connections', 'connections',
+                           'number of pooled database connections', default = 2),
+        VOLT.BooleanOption('-B', '--background', 'daemon',
+                           'run the exporter in the background (as a daemon process)'),
+    ),
+    modifiers = (
+        VOLT.Modifier('start', metrics_start, 'Start exporting metrics.'),
+        VOLT.Modifier('stop', metrics_stop, 'Stop a background metrics exporter.'),
+    )
+)
+def metrics(runner):
+    runner.go()
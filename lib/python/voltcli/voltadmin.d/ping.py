@@ -0,0 +1,58 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from voltcli import utility
+
+def check_nodes(runner):
+    # Every node reports the live cluster members it sees. Nodes that can't
+    # be reached in time fail the call, and a partitioned node disagrees.
+    columns = [VOLT.FastSerializer.VOLTTYPE_STRING]
+    response = runner.call_proc_all('@SystemInformation', columns, ['OVERVIEW'])
+    views = {}
+    for row in response.table(0).tuples():
+        views.setdefault(row[0], set()).add(row[1])
+    rows = []
+    for host, client in runner.clients:
+        host_ids = sorted(views.get(host, []))
+        rows.append((host, len(host_ids), ','.join([str(host_id) for host_id in host_ids])))
+    print utility.format_table(rows, caption = 'Cluster Nodes',
+                               headings = ('HOST', 'NODES SEEN', 'HOST IDS'))
+    if len(set([row[2] for row in rows])) > 1:
+        runner.abort('The nodes disagree about the cluster membership.')
+    runner.info('All %d nodes responded.' % len(rows))
+
+@VOLT.Command(
+    bundles = VOLT.ClusterAdminBundle(),
+    description = 'Check that every node of a live database responds.',
+    description2 = '''
+Connects to every node in parallel, either those listed with --host or, given
+one host, all the nodes it reports, and asks each of them for the cluster
+members it sees. Fails if a node can't be reached within --timeout seconds or
+the nodes disagree.''',
+)
+def ping(runner):
+    check_nodes(runner)
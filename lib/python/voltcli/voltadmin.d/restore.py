@@ -25,14 +25,129 @@
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import sys
+import time
+import json
 import urllib
 
+def kb_to_mb(kilobytes):
+    return kilobytes / 1024.0
+
+class RestoreMonitor(object):
+    """
+    Tracks restore progress through @Statistics TABLE, which reports the
+    tuples and memory loaded so far per host and table. @SnapshotStatus only
+    covers snapshot saves.
+
+    Every site holding a copy reports a row, i.e. each k-safety replica of a
+    partition and every site for replicated tables. Host figures include all
+    of them, table totals count each partition once, using the replica that
+    has loaded the most.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.last = None
+        self.hosts = {}
+        self.tables = {}
+        self.partitioned = None
+
+    def get_partitioned_tables(self, client):
+        types = [VOLT.FastSerializer.VOLTTYPE_STRING]
+        response = VOLT.VoltProcedure(client, '@SystemCatalog', types).call(params = ['TABLES'])
+        if response.status != 1:
+            raise VOLT.VoltException(response.statusString)
+        table = response.tables[0]
+        ci = dict((table.columns[i].name, i) for i in range(len(table.columns)))
+        partitioned = set()
+        for row in table.tuples:
+            # Replicated tables have no remarks, partitioned ones name their
+            # partition column.
+            try:
+                remarks = json.loads(row[ci['REMARKS']] or '{}')
+            except ValueError:
+                continue
+            if 'partitionColumn' in remarks:
+                partitioned.add(row[ci['TABLE_NAME']])
+        return partitioned
+
+    def poll(self, client):
+        if self.partitioned is None:
+            self.partitioned = self.get_partitioned_tables(client)
+        types = [VOLT.FastSerializer.VOLTTYPE_STRING, VOLT.FastSerializer.VOLTTYPE_TINYINT]
+        response = VOLT.VoltProcedure(client, '@Statistics', types).call(params = ['TABLE', 0])
+        if response.status != 1:
+            raise VOLT.VoltException(response.statusString)
+        table = response.tables[0]
+        ci = dict((table.columns[i].name, i) for i in range(len(table.columns)))
+        hosts = {}
+        copies = {}
+        for row in table.tuples:
+            tuples = row[ci['TUPLE_COUNT']]
+            memory = row[ci['TUPLE_DATA_MEMORY']] + row[ci['STRING_DATA_MEMORY']]
+            host = hosts.setdefault(row[ci['HOSTNAME']], [0, 0])
+            host[0] += tuples
+            host[1] += memory
+            name = row[ci['TABLE_NAME']]
+            partition = None
+            if name in self.partitioned:
+                partition = row[ci['PARTITION_ID']]
+            copies[(name, partition)] = max(copies.get((name, partition), (0, 0)), (tuples, memory))
+        tables = {}
+        for (name, partition), (tuples, memory) in copies.items():
+            total = tables.setdefault(name, [0, 0])
+            total[0] += tuples
+            total[1] += memory
+        now = time.time()
+        previous = self.hosts
+        self.last, elapsed = now, now - (self.last or self.start)
+        self.hosts = hosts
+        self.tables = tables
+        return previous, max(elapsed, 0.001)
+
+    def show_progress(self, client):
+        previous, elapsed = self.poll(client)
+        rates = {}
+        for host, (tuples, memory) in self.hosts.items():
+            rates[host] = (memory - previous.get(host, (0, 0))[1]) / elapsed
+        loading = sorted([rate for rate in rates.values() if rate > 0])
+        rows = []
+        for host in sorted(self.hosts.keys()):
+            tuples, memory = self.hosts[host]
+            status = ''
+            # Hosts loading far slower than the others are likely on slow disks.
+            if loading and rates[host] < loading[len(loading) / 2] / 2:
+                status = 'STRAGGLER'
+            rows.append((host, tuples, '%.1f' % kb_to_mb(memory),
+                         '%.1f' % kb_to_mb(rates[host]), status))
+        headings = ('HOST', 'TUPLES', 'MB', 'MB/S', 'STATUS')
+        sys.stdout.write(VOLT.utility.format_table(rows, caption = 'Snapshot Restore Progress (%ds)'
+                                                        % (time.time() - self.start),
+                                                   headings = headings))
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+    def show_summary(self, client):
+        self.poll(client)
+        duration = max(time.time() - self.start, 0.001)
+        rows = [(name, tuples, '%.1f' % kb_to_mb(memory))
+                    for name, (tuples, memory) in sorted(self.tables.items(), key = lambda item: -item[1][1])]
+        print VOLT.utility.format_table(rows, caption = 'Restored Tables', headings = ('TABLE', 'TUPLES', 'MB'))
+        tuples = sum([table[0] for table in self.tables.values()])
+        memory = sum([table[1] for table in self.tables.values()])
+        print 'Snapshot restored %d tuples (%.1f MB) to %d hosts in %.1f seconds (%.1f MB/s).' % (
+                    tuples, kb_to_mb(memory), len(self.hosts), duration, kb_to_mb(memory) / duration)
+
 @VOLT.Command(
     bundles = VOLT.AdminBundle(),
     description = 'Restore a VoltDB database snapshot.',
     options = (
         # Hidden option to restore the hashinator in addition to the tables.
         VOLT.BooleanOption('-S', '--hashinator', 'hashinator', None, default = False),
+        VOLT.BooleanOption('-m', '--monitor', 'monitor',
+                           'display per-host progress until the restore completes',
+                           default = False),
+        VOLT.IntegerOption('-i', '--interval', 'interval',
+                           'seconds between progress updates', default = 2)
     ),
     arguments = (
         VOLT.PathArgument('directory', 'the snapshot server directory', absolute = True),
@@ -48,6 +163,14 @@ def restore(runner):
     json_opts = ['{path:"%s",nonce:"%s",hashinator:"%s"}' % (runner.opts.directory, nonce, hashinator)]
     runner.verbose_info('@SnapshotRestore "%s"' % json_opts)
     columns = [VOLT.FastSerializer.VOLTTYPE_STRING]
-    print 'voltadmin: Snapshot restore has been started. Check the server logs for ongoing status of the restore operation.'
-    response = runner.call_proc('@SnapshotRestore', columns, json_opts)
+    if runner.opts.monitor:
+        print 'voltadmin: Snapshot restore has been started.'
+        monitor = RestoreMonitor()
+        response = runner.call_proc_monitored('@SnapshotRestore', columns, json_opts,
+                                              monitor.show_progress, interval = runner.opts.interval)
+    else:
+        print 'voltadmin: Snapshot restore has been started. Check the server logs for ongoing status of the restore operation.'
+        response = runner.call_proc('@SnapshotRestore', columns, json_opts)
     print response.table(0).format_table(caption = 'Snapshot Restore Results')
+    if runner.opts.monitor:
+        monitor.show_summary(runner.client)
@@ -26,8 +26,157 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 import os
+import sys
+import time
 import urllib
 
+# Hosts whose progress is below this fraction of the median are stragglers.
+straggler_fraction = 0.5
+
+# Seconds to wait for a started snapshot to show up in @SnapshotStatus.
+snapshot_appear_timeout = 60
+
+def bytes_to_mb(size):
+    return size / (1024.0 * 1024.0)
+
+def get_snapshot_rows(client, directory, nonce):
+    """
+    Return the @SnapshotStatus rows for the latest snapshot with the given
+    directory and nonce as dictionaries.
+    """
+    proc = VOLT.VoltProcedure(client, '@SnapshotStatus', [])
+    response = proc.call(params = [])
+    if response.status != 1:
+        raise VOLT.VoltException(response.statusString)
+    table = response.tables[0]
+    names = [column.name for column in table.columns]
+    rows = [dict(zip(names, row)) for row in table.tuples]
+    rows = [row for row in rows if row['NONCE'] == nonce and row['PATH'] == directory]
+    if rows:
+        txnid = max([row['TXNID'] for row in rows])
+        rows = [row for row in rows if row['TXNID'] == txnid]
+    return rows
+
+class HostProgress(object):
+    """
+    Snapshot progress of one host. @SnapshotStatus reports a table's size
+    once the table is completely written, so progress is counted in whole
+    tables.
+    """
+    def __init__(self, host):
+        self.host = host
+        self.tables = 0
+        self.tables_done = 0
+        self.size = 0
+        self.start_time = None
+        self.end_time = 0
+        self.failed = 0
+
+    def add(self, row):
+        self.tables += 1
+        if row['SIZE'] > 0 or row['END_TIME'] != 0:
+            self.tables_done += 1
+        self.size += row['SIZE']
+        self.start_time = row['START_TIME']
+        self.end_time = row['END_TIME']
+        if row['RESULT'] != 'SUCCESS':
+            self.failed += 1
+
+    def finished(self):
+        return self.end_time != 0
+
+    def fraction(self):
+        if self.finished() or self.tables == 0:
+            return 1.0
+        return self.tables_done / float(self.tables)
+
+    def elapsed(self, now_ms):
+        end_time = self.end_time
+        if end_time == 0:
+            end_time = now_ms
+        return max(end_time - self.start_time, 1) / 1000.0
+
+    def row(self, now_ms, stragglers):
+        elapsed = self.elapsed(now_ms)
+        if self.finished():
+            status = 'done'
+            eta = ''
+        else:
+            status = 'running'
+            eta = ''
+            if self.tables_done > 0:
+                eta = '%ds' % (elapsed * (self.tables - self.tables_done) / self.tables_done)
+        if self.failed:
+            status = 'FAILED'
+        elif self.host in stragglers:
+            status = 'STRAGGLER'
+        return (self.host, '%d/%d' % (self.tables_done, self.tables),
+                '%.1f' % bytes_to_mb(self.size), '%.1f' % (bytes_to_mb(self.size) / elapsed),
+                '%.1fs' % elapsed, eta, status)
+
+def get_progress(rows):
+    hosts = {}
+    for row in rows:
+        hosts.setdefault(row['HOSTNAME'], HostProgress(row['HOSTNAME'])).add(row)
+    return [hosts[host] for host in sorted(hosts.keys())]
+
+def get_stragglers(progress):
+    fractions = sorted([host.fraction() for host in progress])
+    if not fractions:
+        return set()
+    median = fractions[len(fractions) / 2]
+    stragglers = set()
+    for host in progress:
+        # Still running while most hosts are done, or well behind the median.
+        if not host.finished() and (median == 1.0 or host.fraction() < median * straggler_fraction):
+            stragglers.add(host.host)
+    return stragglers
+
+def show_progress(progress):
+    now_ms = time.time() * 1000
+    stragglers = get_stragglers(progress)
+    headings = ('HOST', 'TABLES', 'MB', 'MB/S', 'ELAPSED', 'ETA', 'STATUS')
+    rows = [host.row(now_ms, stragglers) for host in progress]
+    sys.stdout.write(VOLT.utility.format_table(rows, caption = 'Snapshot Save Progress',
+                                               headings = headings))
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+
+def show_summary(rows, progress):
+    tables = {}
+    for row in rows:
+        size, hosts = tables.get(row['TABLE'], (0, 0))
+        tables[row['TABLE']] = (size + row['SIZE'], hosts + 1)
+    table_rows = [(name, hosts, '%.1f' % bytes_to_mb(size))
+                    for name, (size, hosts) in sorted(tables.items(), key = lambda item: -item[1][0])]
+    print VOLT.utility.format_table(table_rows, caption = 'Snapshot Table Sizes',
+                                    headings = ('TABLE', 'HOSTS', 'MB'))
+    start_time = min([host.start_time for host in progress])
+    end_time = max([host.end_time for host in progress])
+    duration = max(end_time - start_time, 1) / 1000.0
+    size = sum([host.size for host in progress])
+    slowest = min(progress, key = lambda host: host.size / host.elapsed(end_time))
+    failed = sum([host.failed for host in progress])
+    print 'Snapshot saved %.1f MB from %d hosts in %.1f seconds (%.1f MB/s).' % (
+                bytes_to_mb(size), len(progress), duration, bytes_to_mb(size) / duration)
+    print 'Slowest host: %s (%.1f MB/s).' % (slowest.host, bytes_to_mb(slowest.size) / slowest.elapsed(end_time))
+    if failed:
+        VOLT.utility.warning('%d table file(s) failed to save.' % failed)
+
+def monitor_snapshot(runner, client, directory, nonce):
+    # Wait for every host of the latest matching snapshot to finish.
+    start = time.time()
+    while True:
+        rows = get_snapshot_rows(client, directory, nonce)
+        progress = get_progress(rows)
+        if progress and min([host.finished() for host in progress]):
+            return rows, progress
+        if progress:
+            show_progress(progress)
+        elif time.time() - start > snapshot_appear_timeout:
+            runner.abort('Snapshot "%s" does not appear in the snapshot status.' % nonce)
+        time.sleep(runner.opts.interval)
+
 @VOLT.Command(
     bundles = VOLT.AdminBundle(),
     description = 'Save a VoltDB database snapshot.',
@@ -37,7 +186,12 @@ import urllib
                            default = False),
         VOLT.EnumOption('-f', '--format', 'format',
                         'snapshot format', 'native', 'csv',
-                        default = 'native')
+                        default = 'native'),
+        VOLT.BooleanOption('-m', '--monitor', 'monitor',
+                           'display per-host progress until the snapshot completes',
+                           default = False),
+        VOLT.IntegerOption('-i', '--interval', 'interval',
+                           'seconds between progress updates', default = 2)
     ),
     arguments = (
         VOLT.PathArgument('directory', 'the snapshot server directory', absolute = True),
@@ -55,5 +209,19 @@ def save(runner):
                     % (uri, nonce, blocking, runner.opts.format)]
     runner.verbose_info('@SnapshotSave "%s"' % json_opts)
     columns = [VOLT.FastSerializer.VOLTTYPE_STRING]
-    response = runner.call_proc('@SnapshotSave', columns, json_opts)
+    if runner.opts.monitor and runner.opts.blocking:
+        def monitor(client):
+            progress = get_progress(get_snapshot_rows(client, runner.opts.directory, runner.opts.nonce))
+            if progress:
+                show_progress(progress)
+        response = runner.call_proc_monitored('@SnapshotSave', columns, json_opts, monitor,
+                                              interval = runner.opts.interval)
+    else:
+        response = runner.call_proc('@SnapshotSave', columns, json_opts)
     print response.table(0).format_table(caption = 'Snapshot Save Results')
+    if runner.opts.monitor:
+        failed = [row for row in response.table(0).tuples() if 'FAILURE' in row]
+        if failed:
+            runner.abort('The snapshot failed to start on some hosts.')
+        rows, progress = monitor_snapshot(runner, runner.client, runner.opts.directory, runner.opts.nonce)
+        show_summary(rows, progress)
@@ -0,0 +1,313 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import sys
+import time
+import copy
+import math
+import struct
+
+# Terminal escape sequence to clear the screen and home the cursor.
+clear_screen = '\033[2J\033[H'
+
+class StatisticsError(Exception):
+    pass
+
+def get_statistics(runner, selector):
+    # Cumulative (non-interval) statistics so that other tools polling with
+    # the interval flag aren't disturbed. Deltas are computed here instead.
+    columns = [VOLT.FastSerializer.VOLTTYPE_STRING, VOLT.FastSerializer.VOLTTYPE_TINYINT]
+    response = runner.call_proc('@Statistics', columns, [selector, 0], check_status = False)
+    if response.status() != 1:
+        raise StatisticsError('@Statistics %s failed: %s' % (selector, response.response.statusString))
+    return response.table(0).table
+
+def column_index(table):
+    return dict((table.columns[i].name, i) for i in range(len(table.columns)))
+
+class LatencyHistogram(object):
+    """
+    Host round trip latencies from @Statistics LATENCY_HISTOGRAM, decoded
+    from the uncompressed HdrHistogram form (little endian lowest and
+    highest trackable values, significant digits, total count, then the
+    bucket counts). Values are in microseconds.
+    """
+    def __init__(self, data):
+        lowest, highest, digits, self.total = struct.unpack_from('<qqiq', data)
+        self.unit_magnitude = int(math.floor(math.log(lowest, 2)))
+        sub_bucket_count_magnitude = int(math.ceil(math.log(2 * 10 ** digits, 2)))
+        self.half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.half_count = 1 << self.half_count_magnitude
+        length = (len(data) - struct.calcsize('<qqiq')) / 8
+        self.counts = list(struct.unpack_from('<%dq' % length, data, struct.calcsize('<qqiq')))
+
+    def diff(self, older):
+        """
+        Return the histogram of the values recorded since older.
+        """
+        delta = copy.copy(self)
+        # A total that went backwards means the statistics were reset, e.g.
+        # by a node restart, so the current counts are the whole delta.
+        if older is not None and older.total <= self.total and len(older.counts) == len(self.counts):
+            delta.total = self.total - older.total
+            delta.counts = [cur - prev for cur, prev in zip(self.counts, older.counts)]
+        return delta
+
+    def add(self, other):
+        if len(other.counts) == len(self.counts):
+            self.total += other.total
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+
+    def value(self, index):
+        bucket = max((index >> self.half_count_magnitude) - 1, 0)
+        sub_bucket = index - ((bucket + 1) << self.half_count_magnitude) + self.half_count
+        return sub_bucket << (bucket + self.unit_magnitude)
+
+    def percentile_ms(self, percentile):
+        target = max(int(percentile / 100.0 * self.total + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.value(index) / 1000.0
+        return 0.0
+
+    def row(self):
+        return ['%.3f' % self.percentile_ms(p) for p in (50, 95, 99)]
+
+class Counters(object):
+    """
+    Procedure counters accumulated for one procedure or one host.
+    """
+    def __init__(self):
+        self.invocations = 0
+        self.timed = 0
+        self.time_ns = 0
+        self.max_ns = 0
+        self.aborts = 0
+        self.failures = 0
+
+    def add_delta(self, prev, cur):
+        # A counter that went backwards means the statistics were reset, e.g.
+        # by a node restart, so the current values are the whole delta.
+        if prev is None or cur[0] < prev[0]:
+            prev = (0, 0, 0, 0, 0, 0)
+        invocations, timed, avg_ns, max_ns, aborts, failures = cur
+        self.invocations += invocations - prev[0]
+        self.timed += timed - prev[1]
+        self.time_ns += avg_ns * timed - prev[2] * prev[1]
+        self.max_ns = max(self.max_ns, max_ns)
+        self.aborts += aborts - prev[4]
+        self.failures += failures - prev[5]
+
+    def add(self, other):
+        self.invocations += other.invocations
+        self.timed += other.timed
+        self.time_ns += other.time_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        self.aborts += other.aborts
+        self.failures += other.failures
+
+    def row(self, name, seconds):
+        avg_ms = 0.0
+        if self.timed > 0:
+            avg_ms = self.time_ns / float(self.timed) / 1000000.0
+        return [name,
+                '%.1f' % (self.invocations / seconds),
+                '%.3f' % avg_ms,
+                '%.3f' % (self.max_ns / 1000000.0),
+                self.aborts,
+                self.failures]
+
+class Sample(object):
+    """
+    One poll of the statistics selectors.
+    """
+    def __init__(self, runner, tables):
+        self.when = time.time()
+        self.procedures = {}
+        table = get_statistics(runner, 'PROCEDURE')
+        ci = column_index(table)
+        for row in table.tuples:
+            key = (row[ci['HOSTNAME']], row[ci['PARTITION_ID']], row[ci['PROCEDURE']])
+            self.procedures[key] = (row[ci['INVOCATIONS']],
+                                    row[ci['TIMED_INVOCATIONS']],
+                                    row[ci['AVG_EXECUTION_TIME']],
+                                    row[ci['MAX_EXECUTION_TIME']],
+                                    row[ci['ABORTS']],
+                                    row[ci['FAILURES']])
+        self.cpu = {}
+        table = get_statistics(runner, 'CPU')
+        ci = column_index(table)
+        for row in table.tuples:
+            self.cpu[row[ci['HOSTNAME']]] = row[ci['PERCENT_USED']]
+        self.latency = {}
+        table = get_statistics(runner, 'LATENCY_HISTOGRAM')
+        ci = column_index(table)
+        for row in table.tuples:
+            self.latency[row[ci['HOSTNAME']]] = LatencyHistogram(row[ci['UNCOMPRESSED_HISTOGRAM']])
+        self.memory = {}
+        table = get_statistics(runner, 'MEMORY')
+        ci = column_index(table)
+        for row in table.tuples:
+            self.memory[row[ci['HOSTNAME']]] = (row[ci['RSS']], row[ci['JAVAUSED']], row[ci['TUPLEDATA']])
+        self.tables = {}
+        if tables:
+            table = get_statistics(runner, 'TABLE')
+            ci = column_index(table)
+            for row in table.tuples:
+                name = row[ci['TABLE_NAME']]
+                self.tables[name] = self.tables.get(name, 0) + row[ci['TUPLE_COUNT']]
+
+def render(runner, prev, cur):
+    seconds = max(cur.when - prev.when, 0.001)
+    # Every k-safety replica of a partition reports the procedures it ran.
+    # Hosts are charged for all of them, procedures for the busiest replica
+    # of each partition, which has run every write and, as the master,
+    # every read.
+    partitions = {}
+    hosts = {}
+    for key, values in cur.procedures.items():
+        host, partition, procedure = key
+        counters = Counters()
+        counters.add_delta(prev.procedures.get(key), values)
+        hosts.setdefault(host, Counters()).add(counters)
+        busiest = partitions.get((partition, procedure))
+        if busiest is None or counters.invocations > busiest.invocations:
+            partitions[(partition, procedure)] = counters
+    procedures = {}
+    for (partition, procedure), counters in partitions.items():
+        procedures.setdefault(procedure, Counters()).add(counters)
+    headings = ('PROCEDURE', 'TPS', 'AVG_MS', 'LIFETIME_MAX_MS', 'ABORTS', 'FAILURES')
+    names = sorted(procedures.keys(), key = lambda name: -procedures[name].invocations)
+    rows = [procedures[name].row(name, seconds) for name in names[:runner.opts.limit]]
+    latency = {}
+    cluster_latency = None
+    for host, histogram in cur.latency.items():
+        latency[host] = histogram.diff(prev.latency.get(host))
+        if cluster_latency is None:
+            cluster_latency = copy.copy(latency[host])
+        else:
+            cluster_latency.add(latency[host])
+    percentiles = '-'
+    if cluster_latency is not None and cluster_latency.total > 0:
+        percentiles = '/'.join(cluster_latency.row())
+    output = []
+    total = Counters()
+    for counters in procedures.values():
+        total.invocations += counters.invocations
+        total.failures += counters.failures
+    output.append('%s  interval: %.1fs  hosts: %d  TPS: %.1f  failures: %d  P50/P95/P99_MS: %s'
+                    % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cur.when)),
+                       seconds, len(cur.memory), total.invocations / seconds, total.failures,
+                       percentiles))
+    output.append(VOLT.utility.format_table(rows, caption = 'Procedures', headings = headings))
+    rows = []
+    for host in sorted(set(hosts.keys()) | set(cur.memory.keys())):
+        row = hosts.get(host, Counters()).row(host, seconds)
+        rss, java_used, tuple_data = cur.memory.get(host, (0, 0, 0))
+        if host in latency and latency[host].total > 0:
+            row.extend(latency[host].row())
+        else:
+            row.extend(['', '', ''])
+        row.extend([cur.cpu.get(host, ''), rss / 1024, java_used / 1024, tuple_data / 1024])
+        rows.append(row)
+    headings = ('HOST', 'TPS', 'AVG_MS', 'LIFETIME_MAX_MS', 'ABORTS', 'FAILURES',
+                'P50_MS', 'P95_MS', 'P99_MS', 'CPU%', 'RSS_MB', 'JAVA_MB', 'TUPLE_MB')
+    output.append(VOLT.utility.format_table(rows, caption = 'Hosts', headings = headings))
+    if cur.tables:
+        rows = []
+        for name in sorted(cur.tables.keys()):
+            growth = (cur.tables[name] - prev.tables.get(name, cur.tables[name])) / seconds
+            rows.append((name, cur.tables[name], '%.1f' % growth))
+        output.append(VOLT.utility.format_table(rows, caption = 'Tables',
+                                                headings = ('TABLE', 'TUPLES', 'TUPLES/S')))
+    if sys.stdout.isatty():
+        sys.stdout.write(clear_screen)
+    sys.stdout.write('%s\n\n' % '\n'.join(output))
+    sys.stdout.flush()
+
+def render_error(e):
+    # Keep the last display on a terminal and report the failure below it.
+    sys.stdout.write('%s  %s, retrying\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), e))
+    sys.stdout.flush()
+
+def poll(runner):
+    """
+    Return a new sample, or None after reporting why it couldn't be taken.
+    """
+    try:
+        return Sample(runner, runner.opts.tables)
+    except StatisticsError, e:
+        render_error(e)
+        return None
+
+@VOLT.Command(
+    bundles = VOLT.AdminBundle(),
+    description = 'Display live per-procedure and per-host throughput and latency.',
+    description2 = '''
+Polls @Statistics (PROCEDURE, LATENCY_HISTOGRAM, CPU, MEMORY and optionally
+TABLE) over a single admin connection and shows rates computed from the
+differences between samples. AVG_MS and LIFETIME_MAX_MS are execution times
+reported by the procedure statistics. P50_MS, P95_MS and P99_MS are
+percentiles of the round trip latency of all calls to each host during the
+interval, the server doesn't keep latency histograms per procedure.
+Procedure rates count each partition once, host rates include the work of
+k-safety replicas. LIFETIME_MAX_MS is the longest execution since the
+statistics were last reset, as the cumulative statistics have no interval
+maximum. A failed poll is reported and the next one is compared with the
+last successful sample.''',
+    options = (
+        VOLT.IntegerOption('-i', '--interval', 'interval',
+                           'seconds between samples', default = 5),
+        VOLT.IntegerOption('-n', '--count', 'count',
+                           'number of updates to display, 0 for no limit', default = 0),
+        VOLT.IntegerOption('-l', '--limit', 'limit',
+                           'maximum number of procedures to display', default = 20),
+        VOLT.BooleanOption('-t', '--tables', 'tables',
+                           'include per-table tuple counts (more costly on large schemas)',
+                           default = False),
+    )
+)
+def top(runner):
+    if runner.opts.interval <= 0:
+        runner.abort('The interval must be a positive number of seconds.')
+    runner.info('Collecting statistics every %d seconds...' % runner.opts.interval)
+    prev = poll(runner)
+    last_poll = time.time()
+    updates = 0
+    while runner.opts.count == 0 or updates < runner.opts.count:
+        time.sleep(max(0, last_poll + runner.opts.interval - time.time()))
+        last_poll = time.time()
+        cur = poll(runner)
+        if cur is None:
+            updates += 1
+            continue
+        if prev is not None:
+            render(runner, prev, cur)
+            updates += 1
+        prev = cur
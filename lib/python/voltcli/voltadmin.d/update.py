@@ -26,12 +26,168 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 import os
+import zipfile
+import zlib
 from voltcli import utility
 
+# Catalog type codes and the names @SystemCatalog COLUMNS reports for them.
+catalog_type_names = {
+    3: 'TINYINT',
+    4: 'SMALLINT',
+    5: 'INTEGER',
+    6: 'BIGINT',
+    8: 'FLOAT',
+    9: 'VARCHAR',
+    11: 'TIMESTAMP',
+    22: 'DECIMAL',
+    25: 'VARBINARY',
+}
+
+# Default CRUD procedures are generated from the schema, not compiled in.
+default_procedure_suffixes = ('.insert', '.update', '.delete', '.select', '.upsert')
+
+class Schema(object):
+    """
+    Tables (with column types) and procedures of a catalog.
+    """
+    def __init__(self):
+        self.tables = {}
+        self.procedures = set()
+
+    def add_procedure(self, name):
+        if not name.lower().endswith(default_procedure_suffixes):
+            self.procedures.add(name)
+
+def get_catalog_crc(jar):
+    """
+    Compute the CRC that the server reports as CATALOGCRC through
+    @SystemInformation, i.e. a CRC32 over the sorted entry names and
+    contents, skipping build information and the report, and skipping the
+    time stamped first line of the generated DDL.
+    """
+    # The server reads the jar with a JarInputStream, which consumes the
+    # leading manifest entries.
+    names = jar.namelist()
+    for manifest_name in ('META-INF/', 'META-INF/MANIFEST.MF'):
+        if names and names[0].upper() == manifest_name:
+            names = names[1:]
+    crc = 0
+    for name in sorted(names):
+        if name in ('buildinfo.txt', 'catalog-report.html'):
+            continue
+        data = jar.read(name)
+        if name == 'autogen-ddl.sql':
+            data = data[data.find('\n'):]
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        crc = zlib.crc32(name, crc)
+        crc = zlib.crc32(data, crc)
+    return crc & 0xffffffff
+
+def get_catalog_schema(jar):
+    """
+    Extract tables, columns and procedures from the catalog commands.
+    """
+    schema = Schema()
+    previous = None
+    for line in jar.read('catalog.txt').splitlines():
+        words = line.split(' ')
+        if words[0] == 'add' and len(words) == 4:
+            path, collection, name = words[1:]
+            if collection == 'tables' and path.endswith('#database'):
+                schema.tables[name] = {}
+            elif collection == 'procedures' and path.endswith('#database'):
+                schema.add_procedure(name)
+        elif words[0] == 'set' and len(words) == 4:
+            path, field, value = words[1:]
+            if path == '$PREV':
+                path = previous
+            previous = path
+            parts = path.split('/')
+            # /clusters#cluster/databases#database/tables#<table>/columns#<column>
+            if (field == 'type' and len(parts) == 5
+                    and parts[3].startswith('tables#') and parts[4].startswith('columns#')):
+                table = parts[3].split('#', 1)[1]
+                column = parts[4].split('#', 1)[1]
+                schema.tables.setdefault(table, {})[column] = catalog_type_names.get(int(value), value)
+    return schema
+
+def get_live_schema(runner):
+    schema = Schema()
+    columns = [VOLT.FastSerializer.VOLTTYPE_STRING]
+    for row in runner.call_proc('@SystemCatalog', columns, ['TABLES']).table(0).tuples():
+        schema.tables[row[2]] = {}
+    for row in runner.call_proc('@SystemCatalog', columns, ['COLUMNS']).table(0).tuples():
+        schema.tables.setdefault(row[2], {})[row[3]] = row[5]
+    for row in runner.call_proc('@SystemCatalog', columns, ['PROCEDURES']).table(0).tuples():
+        schema.add_procedure(row[2])
+    return schema
+
+def get_live_catalog_crc(runner):
+    columns = [VOLT.FastSerializer.VOLTTYPE_STRING]
+    for host_id, key, value in runner.call_proc('@SystemInformation', columns, ['OVERVIEW']).table(0).tuples():
+        if key == 'CATALOGCRC':
+            return long(value)
+    return None
+
+def diff_schemas(old, new):
+    """
+    Return a list of human readable schema changes.
+    """
+    changes = []
+    for table in sorted(set(old.tables) - set(new.tables)):
+        changes.append('drop table %s' % table)
+    for table in sorted(set(new.tables) - set(old.tables)):
+        changes.append('add table %s (%d columns)' % (table, len(new.tables[table])))
+    for table in sorted(set(old.tables) & set(new.tables)):
+        old_columns = old.tables[table]
+        new_columns = new.tables[table]
+        for column in sorted(set(old_columns) - set(new_columns)):
+            changes.append('drop column %s.%s' % (table, column))
+        for column in sorted(set(new_columns) - set(old_columns)):
+            changes.append('add column %s.%s %s' % (table, column, new_columns[column]))
+        for column in sorted(set(old_columns) & set(new_columns)):
+            if old_columns[column] != new_columns[column]:
+                changes.append('alter column %s.%s %s -> %s'
+                                    % (table, column, old_columns[column], new_columns[column]))
+    for procedure in sorted(old.procedures - new.procedures):
+        changes.append('drop procedure %s' % procedure)
+    for procedure in sorted(new.procedures - old.procedures):
+        changes.append('add procedure %s' % procedure)
+    return changes
+
+def check_catalog(runner, path):
+    """
+    Display the schema changes made by the catalog. Return False if the
+    catalog is identical to the running one.
+    """
+    try:
+        jar = zipfile.ZipFile(path)
+        try:
+            crc = get_catalog_crc(jar)
+            schema = get_catalog_schema(jar)
+        finally:
+            jar.close()
+    except (IOError, OSError, KeyError, zipfile.BadZipfile), e:
+        runner.abort('Unable to read catalog "%s".' % path, e)
+    if crc == get_live_catalog_crc(runner):
+        return False
+    changes = diff_schemas(get_live_schema(runner), schema)
+    if changes:
+        runner.info('Schema changes:', changes)
+    else:
+        runner.info('No table or procedure changes, only procedure code or other catalog content changed.')
+    return True
+
 @VOLT.Command(
     bundles=VOLT.AdminBundle(),
     description='Update the schema of a running database.',
     description2='Either a catalog (extension .jar), a deployment file (extension .xml), or both, must be provided.',
+    options=(
+        VOLT.BooleanOption('-f', '--force', 'force',
+                           'send the catalog even if it is identical to the running one',
+                           default=False),
+    ),
     arguments=(
         VOLT.StringArgument(
             'catalog_or_deployment',
@@ -48,8 +204,11 @@ def update(runner):
         if extension == '.jar':
             if not catalog is None:
                 runner.abort('More than one catalog .jar file was specified.')
-            catalog = VOLT.utility.File(catalog_or_deployment).read_hex()
-            columns[0] = VOLT.FastSerializer.VOLTTYPE_STRING
+            if not os.path.isfile(catalog_or_deployment):
+                runner.abort('Catalog "%s" does not exist.' % catalog_or_deployment)
+            # Streamed from the file as raw bytes when the call is sent.
+            catalog = VOLT.VoltVarbinaryFile(catalog_or_deployment)
+            columns[0] = VOLT.FastSerializer.VOLTTYPE_VARBINARY
         elif extension == '.xml':
             if not deployment is None:
                 runner.abort('More than one deployment .xml file was specified.')
@@ -61,6 +220,14 @@ def update(runner):
                     % extension)
     if catalog is None and deployment is None:
         runner.abort('At least one catalog .jar or deployment .xml file is required.')
+    if not catalog is None and not runner.opts.force:
+        if not check_catalog(runner, catalog.path):
+            if deployment is None:
+                runner.info('The catalog is identical to the running catalog, skipping the update.')
+                return
+            runner.info('The catalog is identical to the running catalog, updating the deployment only.')
+            catalog = None
+            columns[0] = VOLT.FastSerializer.VOLTTYPE_NULL
     params = [catalog, deployment]
     # call_proc() aborts with an error if the update failed.
     runner.call_proc('@UpdateApplicationCatalog', columns, params)
@@ -0,0 +1,270 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import glob
+import time
+import socket
+from xml.etree import ElementTree
+from voltcli import daemon
+from voltcli import utility
+
+# Daemon (PID and output file) name prefix for cluster instances.
+daemon_prefix = 'voltcluster_'
+
+# Ports reserved per instance, relative to the instance base port.
+# Replication uses 3 consecutive ports.
+port_offsets = (
+    ('port',            0),
+    ('adminport',       1),
+    ('internalport',    2),
+    ('zkport',          3),
+    ('httpport',        4),
+    ('replicationport', 5),
+)
+ports_per_instance = 10
+
+# Seconds between readiness probes.
+probe_interval = 0.5
+
+def get_ports(runner, instance):
+    base = runner.opts.base_port + instance * ports_per_instance
+    return dict((name, base + offset) for name, offset in port_offsets)
+
+def check_ports(runner):
+    """
+    Abort if any port that the instances need is already in use.
+    """
+    busy = []
+    for instance in range(runner.opts.count):
+        ports = get_ports(runner, instance)
+        for port in sorted(ports.values()) + [ports['replicationport'] + 1, ports['replicationport'] + 2]:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                try:
+                    sock.bind(('', port))
+                except socket.error:
+                    busy.append(port)
+            finally:
+                sock.close()
+    if busy:
+        runner.abort('Ports needed by the cluster are in use:', busy,
+                     'Stop the processes using them or choose another --base-port.')
+
+def write_deployment(runner, instance):
+    """
+    Write the instance deployment file, based on the --deployment file if
+    provided, with the host count and a separate voltdbroot.
+    """
+    instance_dir = os.path.join(runner.opts.dir, 'host%d' % instance)
+    if runner.opts.deployment:
+        try:
+            root = ElementTree.parse(runner.opts.deployment).getroot()
+        except (IOError, OSError, SyntaxError), e:
+            runner.abort('Unable to read deployment file "%s".' % runner.opts.deployment, e)
+    else:
+        root = ElementTree.Element('deployment')
+    cluster = root.find('cluster')
+    if cluster is None:
+        cluster = ElementTree.SubElement(root, 'cluster')
+    cluster.set('hostcount', str(runner.opts.count))
+    if runner.opts.sites:
+        cluster.set('sitesperhost', str(runner.opts.sites))
+    if runner.opts.kfactor is not None:
+        cluster.set('kfactor', str(runner.opts.kfactor))
+    paths = root.find('paths')
+    if paths is None:
+        paths = ElementTree.SubElement(root, 'paths')
+    voltdbroot = paths.find('voltdbroot')
+    if voltdbroot is None:
+        voltdbroot = ElementTree.SubElement(paths, 'voltdbroot')
+    voltdbroot.set('path', os.path.abspath(os.path.join(instance_dir, 'voltdbroot')))
+    path = os.path.abspath(os.path.join(instance_dir, 'deployment.xml'))
+    try:
+        if not os.path.isdir(instance_dir):
+            os.makedirs(instance_dir)
+        ElementTree.ElementTree(root).write(path)
+    except (IOError, OSError), e:
+        runner.abort('Unable to write deployment file "%s".' % path, e)
+    return path
+
+def start_instance(runner, instance, leader):
+    """
+    Start one server daemon from a forked child so that the daemonizer's
+    exit doesn't end this process. Returns the child PID.
+    """
+    deployment = write_deployment(runner, instance)
+    args = ['create']
+    if runner.opts.catalog:
+        args.extend(['catalog', runner.opts.catalog])
+    args.extend(['deployment', deployment, 'host', leader])
+    for name, port in sorted(get_ports(runner, instance).items()):
+        args.extend([name, str(port)])
+    kwargs = {}
+    runner.setup_daemon_kwargs(kwargs, name = '%s%d' % (daemon_prefix, instance),
+                                       description = 'VoltDB server instance %d' % instance)
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            runner.java_execute('org.voltdb.VoltDB', None, *args, **kwargs)
+        except SystemExit, e:
+            code = e.code
+        os._exit(code or 0)
+    return pid
+
+def get_pid_files():
+    # Only PID files of live processes, stale ones are left for the daemonizer to purge.
+    pattern = os.path.join(utility.get_state_directory(), '%s*.pid' % daemon_prefix)
+    return sorted([path for path in glob.glob(pattern) if daemon.get_status(path)[1]])
+
+def probe_instance(runner, instance, deadline):
+    """
+    Wait until the instance accepts an authenticated connection and answers
+    @SystemInformation. Returns None when ready or an error message.
+    """
+    port = get_ports(runner, instance)['port']
+    pid_file = os.path.join(utility.get_state_directory(), '%s%d.pid' % (daemon_prefix, instance))
+    kwargs = dict(connect_timeout = 2, procedure_timeout = 10)
+    if runner.opts.username:
+        kwargs['username'] = runner.opts.username
+        if runner.opts.password:
+            kwargs['password'] = runner.opts.password
+    error = 'not started'
+    while time.time() < deadline:
+        if os.path.exists(pid_file) and not daemon.get_status(pid_file)[1]:
+            return 'the server process exited, see %s%d.out and .err' % (daemon_prefix, instance)
+        try:
+            client = VOLT.FastSerializer('localhost', port, **kwargs)
+            try:
+                proc = VOLT.VoltProcedure(client, '@SystemInformation', [VOLT.FastSerializer.VOLTTYPE_STRING])
+                response = proc.call(params = ['OVERVIEW'])
+            finally:
+                client.close()
+            if response.status == 1:
+                return None
+            error = response.statusString
+        except Exception, e:
+            error = str(e)
+        time.sleep(probe_interval)
+    return 'not ready after %d seconds (%s)' % (runner.opts.timeout, error)
+
+def stop_instances():
+    def stop(pid_file):
+        name = os.path.splitext(os.path.basename(pid_file))[0]
+        daemonizer = utility.Daemonizer(name, 'VoltDB server %s' % name,
+                                        output = utility.get_state_directory())
+        daemonizer.stop(expect_running = False)
+    failed = []
+    for pid_file, result, e in utility.run_parallel(stop, get_pid_files()):
+        if e is not None:
+            failed.append('%s: %s' % (pid_file, e))
+    return failed
+
+def cluster_start(runner):
+    if runner.opts.count < 1:
+        runner.abort('The instance count must be at least 1.')
+    if get_pid_files():
+        runner.abort('Cluster instances appear to be running:', get_pid_files(),
+                     'Run "voltdb cluster stop" first.')
+    check_ports(runner)
+    leader = 'localhost:%d' % get_ports(runner, 0)['internalport']
+    start = time.time()
+    for instance in range(runner.opts.count):
+        os.waitpid(start_instance(runner, instance, leader), 0)
+    if runner.is_dryrun():
+        return
+    runner.info('Waiting for %d instances to become ready...' % runner.opts.count)
+    deadline = start + runner.opts.timeout
+    errors = []
+    results = utility.run_parallel(lambda instance: probe_instance(runner, instance, deadline),
+                                   range(runner.opts.count))
+    for instance, error, e in results:
+        if e is not None:
+            error = str(e)
+        if error is not None:
+            errors.append('instance %d: %s' % (instance, error))
+    if errors:
+        runner.error('The cluster failed to start:', errors)
+        runner.info('Stopping all instances...')
+        stop_instances()
+        runner.abort()
+    rows = []
+    for instance in range(runner.opts.count):
+        ports = get_ports(runner, instance)
+        rows.append([instance] + [ports[name] for name, offset in port_offsets])
+    headings = ['INSTANCE'] + [name.upper() for name, offset in port_offsets]
+    print utility.format_table(rows, caption = 'Local Cluster', headings = headings)
+    runner.info('The cluster was ready in %.1f seconds.' % (time.time() - start))
+
+def cluster_stop(runner):
+    if not get_pid_files():
+        runner.abort('No cluster instances are running.')
+    failed = stop_instances()
+    if failed:
+        runner.abort('Unable to stop some instances:', failed)
+    runner.info('All cluster instances were stopped.')
+
+@VOLT.Multi_Command(
+    description = 'Start or stop a local multi-instance test cluster.',
+    description2 = '''
+"start" launches the instances as daemons with separate ports and voltdbroot
+directories, waits until every instance answers @SystemInformation, and stops
+all of them if any fails to start. "stop" stops all the instances.''',
+    options = (
+        VOLT.IntegerOption('-n', '--count', 'count',
+                           'number of server instances', default = 3),
+        VOLT.IntegerOption('-P', '--base-port', 'base_port',
+                           'first port, each instance uses %d ports from here' % ports_per_instance,
+                           default = 30000),
+        VOLT.StringOption('-d', '--deployment', 'deployment',
+                          'base deployment file (host count and voltdbroot are overridden)'),
+        VOLT.StringOption('-c', '--catalog', 'catalog',
+                          'the application catalog jar file path'),
+        VOLT.StringOption('-D', '--dir', 'dir',
+                          'directory for instance deployment files and voltdbroots',
+                          default = 'voltcluster'),
+        VOLT.IntegerOption('-s', '--sites', 'sites',
+                           'sites per host'),
+        VOLT.IntegerOption('-k', '--kfactor', 'kfactor',
+                           'K-safety factor'),
+        VOLT.IntegerOption('-t', '--timeout', 'timeout',
+                           'seconds to wait for the cluster to become ready', default = 120),
+        VOLT.StringOption('-u', '--user', 'username',
+                          'user name for readiness checks'),
+        VOLT.StringOption('-p', '--password', 'password',
+                          'password for readiness checks'),
+    ),
+    modifiers = (
+        VOLT.Modifier('start', cluster_start, 'Start the cluster instances and wait until they are ready.'),
+        VOLT.Modifier('stop', cluster_stop, 'Stop all the cluster instances.'),
+    )
+)
+def cluster(runner):
+    runner.go()
@@ -26,8 +26,374 @@ import sys
 # ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import os
+import re
+import glob
+import time
+import json
+import gzip
+import Queue
+import shutil
+import tempfile
+import cStringIO
+import threading
+import pipes
+import socket
+import tarfile
+import subprocess
+from voltcli import environment
+from voltcli import utility
+
+# Relative times, e.g. "6h" or "2d", and absolute epoch seconds, e.g. "@1425213296".
+re_relative_time = re.compile('^(\d+)([smhd])$')
+re_epoch_time = re.compile('^@(\d+)$')
+relative_time_units = dict(s = 1, m = 60, h = 3600, d = 86400)
+
+# Megabytes of compressed copies held in memory while they wait to be
+# written to the archive. The rest are written to temporary files.
+memory_limit_mb = 256
+
+# Timestamp at the start of a log line, e.g. "2015-03-01 12:34:56,789".
+re_log_time = re.compile('^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
+
+def parse_time(value, now):
+    """
+    Parse a relative ("6h", "30m", "2d"), epoch ("@seconds") or absolute
+    local time ("YYYY-MM-DD[ HH:MM[:SS]]") and return epoch seconds.
+    """
+    m = re_relative_time.match(value)
+    if m:
+        return now - int(m.group(1)) * relative_time_units[m.group(2)]
+    m = re_epoch_time.match(value)
+    if m:
+        return float(m.group(1))
+    for format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, format))
+        except ValueError:
+            pass
+    utility.abort('Bad time "%s", expected e.g. "6h", "2d" or "YYYY-MM-DD HH:MM".' % value)
+
+def get_first_log_time(path):
+    try:
+        f = open(path)
+        try:
+            m = re_log_time.match(f.readline())
+        finally:
+            f.close()
+        if m:
+            return time.mktime(time.strptime(m.group(1), '%Y-%m-%d %H:%M:%S'))
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def in_window(path, start, end, is_log = False):
+    """
+    True if the file was written after the window started and, for logs
+    whose first entry has a timestamp, didn't start after it ended.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    if mtime < start:
+        return False
+    first_time = None
+    if is_log:
+        first_time = get_first_log_time(path)
+    if first_time is None:
+        first_time = mtime
+    return first_time <= end
+
+def list_files(voltdbroot, start, end, skip_heap_dump):
+    """
+    List the files to collect, the same selection as the Java collector
+    restricted to the time window.
+    """
+    config_log = os.path.join(voltdbroot, 'config_log')
+    paths = [path for path in (os.path.join(config_log, 'deployment.xml'),
+                               os.path.join(config_log, 'catalog.jar'))
+                    if os.path.isfile(path)]
+    working_dir = voltdbroot
+    log_paths = []
+    try:
+        config = json.load(open(os.path.join(config_log, 'config.json')))
+        working_dir = config.get('workingDir', voltdbroot)
+        log_paths = [dst['path'] for dst in config.get('log4jDst', [])]
+    except (IOError, OSError, ValueError), e:
+        utility.warning('Unable to read the configuration log.', e)
+    for log_path in log_paths:
+        for path in glob.glob('%s*' % log_path):
+            if in_window(path, start, end, is_log = True):
+                paths.append(path)
+    for directory in set([voltdbroot, working_dir]):
+        for pattern in ('voltdb_crash*.txt', 'hs_err_pid*.log'):
+            for path in glob.glob(os.path.join(directory, pattern)):
+                if in_window(path, start, end):
+                    paths.append(path)
+    if not skip_heap_dump:
+        for path in glob.glob('/tmp/java_pid*.hprof'):
+            if in_window(path, start, end):
+                paths.append(path)
+    for path in glob.glob('/var/log/syslog*') + ['/var/log/dmesg']:
+        if os.access(path, os.R_OK) and in_window(path, start, end, is_log = True):
+            paths.append(path)
+    return sorted(set([os.path.realpath(path) for path in paths]))
+
+class SpillBuffer(object):
+    """
+    Write-only file object holding data in memory up to memory_limit bytes
+    and in an anonymous temporary file in spill_dir beyond that.
+    """
+    def __init__(self, memory_limit, spill_dir):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.data = cStringIO.StringIO()
+        self.size = 0
+
+    def write(self, data):
+        if (isinstance(self.data, cStringIO.OutputType)
+                and self.size + len(data) > self.memory_limit):
+            spill = tempfile.TemporaryFile(dir = self.spill_dir)
+            spill.write(self.data.getvalue())
+            self.data = spill
+        self.data.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+    def reader(self):
+        if isinstance(self.data, cStringIO.OutputType):
+            return cStringIO.StringIO(self.data.getvalue())
+        self.data.seek(0)
+        return self.data
+
+    def close(self):
+        self.data.close()
+
+def compress_file(path, open_source, mtime, memory_limit, spill_dir):
+    """
+    Gzip one file into a SpillBuffer. Runs in a worker thread, zlib
+    releases the interpreter lock while it compresses.
+    """
+    start = time.time()
+    buf = SpillBuffer(memory_limit, spill_dir)
+    src = open_source()
+    try:
+        dst = gzip.GzipFile('', 'wb', 6, buf, mtime)
+        try:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        finally:
+            dst.close()
+        size = src.tell()
+    finally:
+        src.close()
+    return (dict(path = path,
+                 size = size,
+                 mtime = mtime,
+                 compressed_size = buf.size,
+                 seconds = round(time.time() - start, 3)),
+            buf)
+
+def compress_files(sources, threads, memory_limit, spill_dir):
+    """
+    Compress (path, open_source, mtime) sources in worker threads and yield
+    (path, result, exception) as each finishes, where result is
+    compress_file()'s. A file is only started when fewer than threads are
+    being compressed or waiting to be consumed, so each compressed copy is
+    held only until the caller has written it out, and at most threads of
+    them at once.
+    """
+    pending = Queue.Queue()
+    for source in sources:
+        pending.put(source)
+    done = Queue.Queue()
+    slots = threading.Semaphore(threads)
+    def worker():
+        while True:
+            slots.acquire()
+            try:
+                path, open_source, mtime = pending.get_nowait()
+            except Queue.Empty:
+                slots.release()
+                return
+            try:
+                done.put((path, compress_file(path, open_source, mtime,
+                                              memory_limit / threads, spill_dir), None))
+            except Exception, e:
+                done.put((path, None, e))
+    for i in range(min(threads, len(sources))):
+        thread = threading.Thread(target = worker)
+        thread.daemon = True
+        thread.start()
+    for i in range(len(sources)):
+        yield done.get()
+        slots.release()
+
+def write_node_archive(fileobj, voltdbroot, start, end, threads, skip_heap_dump,
+                       spill_dir = None):
+    """
+    Stream this node's tar archive of individually gzipped files and a
+    manifest of sizes and timings to a file object. Files are compressed
+    once, in parallel, and written to the archive in the order they finish.
+    A tar member needs its size up front, so the compressed copies are
+    held until written: in memory up to memory_limit_mb in total, beyond
+    that in temporary files in spill_dir (default: the system temporary
+    directory). Only copies being compressed or waiting to be written
+    exist at any time, never a staged copy of every file.
+    """
+    collect_start = time.time()
+    sources = []
+    errors = []
+    for path in list_files(voltdbroot, start, end, skip_heap_dump):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError, e:
+            errors.append('%s: %s' % (path, e))
+            continue
+        sources.append((path, lambda path = path: open(path, 'rb'), mtime))
+    dmesg = ''
+    try:
+        dmesg = subprocess.Popen(['dmesg'], stdout = subprocess.PIPE,
+                                 stderr = open(os.devnull, 'w')).communicate()[0]
+    except OSError:
+        pass
+    sources.append(('dmesg.txt', lambda: cStringIO.StringIO(dmesg), time.time()))
+    files = []
+    archive = tarfile.open(fileobj = fileobj, mode = 'w|')
+    for path, result, e in compress_files(sources, threads, memory_limit_mb << 20, spill_dir):
+        if e is not None:
+            errors.append('%s: %s' % (path, e))
+            continue
+        info, buf = result
+        try:
+            tarinfo = tarfile.TarInfo('files/%s.gz' % path.strip('/'))
+            tarinfo.size = buf.size
+            tarinfo.mtime = info['mtime']
+            archive.addfile(tarinfo, buf.reader())
+        finally:
+            buf.close()
+        files.append(info)
+    manifest = json.dumps(dict(host = socket.gethostname(),
+                               voltdbroot = voltdbroot,
+                               window = [start, end],
+                               files = files,
+                               errors = errors,
+                               seconds = round(time.time() - collect_start, 3)),
+                          indent = 2)
+    tarinfo = tarfile.TarInfo('manifest.json')
+    tarinfo.size = len(manifest)
+    tarinfo.mtime = time.time()
+    archive.addfile(tarinfo, cStringIO.StringIO(manifest))
+    archive.close()
+
+def collect_node(runner, host, output_dir, start, end):
+    """
+    Collect one node into <output>/<prefix>_<host>.tar, locally or by
+    running this command on the node over ssh.
+    """
+    node_start = time.time()
+    path = os.path.join(output_dir, '%s_%s.tar' % (runner.opts.prefix, host))
+    f = open(path, 'wb')
+    try:
+        if host in ('localhost', socket.gethostname()):
+            write_node_archive(f, runner.opts.voltdbroot, start, end,
+                               runner.opts.threads, runner.opts.skipheapdump,
+                               spill_dir = output_dir)
+        else:
+            command = [os.path.join(environment.command_dir, environment.command_name),
+                       'collect', '--node-archive',
+                       '--from', '@%d' % start, '--to', '@%d' % end,
+                       '--threads', str(runner.opts.threads)]
+            if runner.opts.skipheapdump:
+                command.append('--skip-heap-dump')
+            command.append(runner.opts.voltdbroot)
+            process = subprocess.Popen(['ssh', '-o', 'BatchMode=yes', host,
+                                        ' '.join([pipes.quote(arg) for arg in command])],
+                                       stdout = f, stderr = subprocess.PIPE)
+            error = process.communicate()[1]
+            if process.returncode != 0:
+                raise RuntimeError('ssh exited with %d: %s' % (process.returncode, error.strip()))
+    except:
+        f.close()
+        os.remove(path)
+        raise
+    f.close()
+    return dict(host = host, archive = path, size = os.path.getsize(path),
+                seconds = round(time.time() - node_start, 3))
+
+def collect_nodes(runner):
+    now = time.time()
+    start = now - runner.opts.days * 86400
+    if runner.opts.since:
+        start = parse_time(runner.opts.since, now)
+    end = now
+    if runner.opts.until:
+        end = parse_time(runner.opts.until, now)
+    if end < start:
+        runner.abort('The end of the time window is before its start.')
+    if runner.opts.nodearchive:
+        # The archive is streamed to the original stdout. Point file
+        # descriptor 1 at stderr so that messages can't corrupt it.
+        sys.stdout.flush()
+        archive = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        try:
+            write_node_archive(archive, runner.opts.voltdbroot, start, end,
+                               runner.opts.threads, runner.opts.skipheapdump)
+        finally:
+            archive.close()
+        return
+    if runner.opts.dryrun:
+        print 'List of the files to be collected:'
+        for path in list_files(runner.opts.voltdbroot, start, end, runner.opts.skipheapdump):
+            print '  %s' % path
+        return
+    hosts = [host.strip() for host in runner.opts.hosts.split(',') if host.strip()]
+    if not hosts:
+        hosts = ['localhost']
+    output_dir = runner.opts.output
+    if not output_dir:
+        output_dir = os.getcwd()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    runner.info('Collecting files from %s to %s on %d node(s)...'
+                    % (time.strftime('%Y-%m-%d %H:%M', time.localtime(start)),
+                       time.strftime('%Y-%m-%d %H:%M', time.localtime(end)),
+                       len(hosts)))
+    nodes = []
+    failed = []
+    for host, node, e in utility.run_parallel(lambda host: collect_node(runner, host, output_dir, start, end),
+                                              hosts):
+        if e is None:
+            nodes.append(node)
+        else:
+            failed.append('%s: %s' % (host, e))
+    manifest_path = os.path.join(output_dir, '%s_manifest.json' % runner.opts.prefix)
+    f = open(manifest_path, 'w')
+    try:
+        json.dump(dict(window = [start, end], nodes = nodes, failed = failed), f, indent = 2)
+    finally:
+        f.close()
+    if nodes:
+        rows = [(node['host'], node['archive'], node['size'], '%.1f' % node['seconds'])
+                    for node in nodes]
+        print utility.format_table(rows, caption = 'Collected Archives',
+                                   headings = ('HOST', 'ARCHIVE', 'BYTES', 'SECONDS'))
+    runner.info('Manifest written to "%s".' % manifest_path)
+    if failed:
+        runner.abort('Collection failed on %d node(s):' % len(failed), failed)
+
 @VOLT.Command(
     description = 'Collect logs on the current node for problem analysis.',
+    description2 = '''
+By default the Java collector writes a single archive of the last --days of
+files, and --upload sends it via SFTP. With --hosts, --from, --to or --output,
+files overlapping the time window are instead compressed in parallel into one
+archive per node along with a manifest of sizes and timings. --hosts collects
+from several nodes concurrently over ssh and requires VoltDB to be installed in
+the same location on each node.''',
     options = (
         VOLT.StringOption (None, '--prefix', 'prefix',
                            'file name prefix for uniquely identifying collection',
@@ -52,7 +418,22 @@ import sys
                            default = False),
         VOLT.IntegerOption(None, '--days', 'days',
                            'number of days of files to collect (files included are log, crash files), Current day value is 1',
-                           default = 14)
+                           default = 14),
+        VOLT.StringOption (None, '--from', 'since',
+                           'start of the time window, e.g. "6h" or "YYYY-MM-DD HH:MM" (overrides --days)'),
+        VOLT.StringOption (None, '--to', 'until',
+                           'end of the time window (default: now)'),
+        VOLT.StringOption (None, '--hosts', 'hosts',
+                           'comma-separated list of nodes to collect from (default: this node)',
+                           default = ''),
+        VOLT.StringOption ('-o', '--output', 'output',
+                           'directory for the node archives and manifest (default: working directory)'),
+        VOLT.IntegerOption(None, '--threads', 'threads',
+                           'number of files compressed in parallel on each node (with --hosts, --from, --to or --output)',
+                           default = 4),
+        # Used by --hosts to stream a node archive back over ssh.
+        VOLT.BooleanOption(None, '--node-archive', 'nodearchive', None,
+                           default = False)
     ),
     arguments = (
         VOLT.PathArgument('voltdbroot', 'the voltdbroot path', absolute = True)
@@ -63,6 +444,12 @@ def collect(runner):
     if int(runner.opts.days) == 0:
 	print >> sys.stderr, "ERROR: '0' is invalid entry for option --days"
         sys.exit(-1)
+    if (runner.opts.hosts or runner.opts.since or runner.opts.until
+            or runner.opts.output or runner.opts.nodearchive):
+        if runner.opts.host:
+            runner.abort('--upload does not support --hosts, --from, --to or --output.')
+        collect_nodes(runner)
+        return
     runner.args.extend(['--voltdbroot='+runner.opts.voltdbroot, '--prefix='+runner.opts.prefix, '--host='+runner.opts.host, '--username='+runner.opts.username, '--password='+runner.opts.password,
     '--noprompt='+str(runner.opts.noprompt), '--dryrun='+str(runner.opts.dryrun), '--skipheapdump='+str(runner.opts.skipheapdump), '--days='+str(runner.opts.days)])
     runner.java_execute('org.voltdb.utils.Collector', None, *runner.args)
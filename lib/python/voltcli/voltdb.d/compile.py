@@ -26,11 +26,126 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 import os
+import shutil
+import tempfile
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+from voltcli import environment
 from voltcli import utility
 
 # Main Java class.
 VoltCompiler = 'org.voltdb.compiler.VoltCompiler'
 
+# Number of catalogs kept in the compile cache.
+cache_size = 50
+
+def hash_file(hasher, path):
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            hasher.update(data)
+    finally:
+        f.close()
+
+def raise_error(e):
+    raise e
+
+def get_classpath_entries(classpath):
+    """
+    Expand "dir/*" wildcards the way Java does, to the jar files in dir.
+    """
+    entries = []
+    for entry in classpath.split(':'):
+        directory = entry[:-1] or '.'
+        if (entry == '*' or entry.endswith('/*')) and os.path.isdir(directory):
+            entries.extend(sorted([os.path.join(directory, name) for name in os.listdir(directory)
+                                        if name.lower().endswith('.jar')]))
+        elif entry:
+            entries.append(entry)
+    return entries
+
+def get_cache_key(ddl_paths, classpath):
+    """
+    Hash everything the compiler reads: the VoltDB jar (compiler version),
+    the DDL files, and the class and jar files on the procedure classpath.
+    Missing classpath entries are part of the key, so that creating them
+    later changes it. Returns None if something can't be read, in which
+    case the catalog is compiled without the cache.
+    """
+    hasher = sha1()
+    try:
+        jar_stat = os.stat(environment.voltdb_jar)
+        hasher.update('%s\0%s\0%d\0%d\0' % (environment.version, environment.voltdb_jar,
+                                              jar_stat.st_size, int(jar_stat.st_mtime)))
+        for path in ddl_paths:
+            hasher.update('ddl\0%s\0' % path)
+            hash_file(hasher, path)
+        for entry in get_classpath_entries(classpath):
+            if os.path.isfile(entry):
+                hasher.update('jar\0%s\0' % entry)
+                hash_file(hasher, entry)
+            elif os.path.isdir(entry):
+                hasher.update('dir\0%s\0' % entry)
+                for dirpath, dirnames, filenames in os.walk(entry, onerror = raise_error):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        if filename.endswith('.class'):
+                            path = os.path.join(dirpath, filename)
+                            hasher.update('class\0%s\0' % os.path.relpath(path, entry))
+                            hash_file(hasher, path)
+            elif os.path.exists(entry):
+                return None
+            else:
+                hasher.update('missing\0%s\0' % entry)
+    except (IOError, OSError), e:
+        utility.verbose_info('Unable to hash the compiler inputs.', e)
+        return None
+    return hasher.hexdigest()
+
+def get_cache_dir(runner):
+    cache_dir = runner.opts.cache_dir
+    if not cache_dir:
+        cache_dir = runner.config.get('volt.compilecache')
+    if not cache_dir:
+        cache_dir = os.path.join(utility.get_state_directory(), 'catalog_cache')
+    return cache_dir
+
+def store_catalog(cache_dir, key, catalog):
+    # Copy to a temporary file first so that concurrent compiles never see
+    # a partial catalog in the cache.
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_path = tempfile.mkstemp(suffix = '.tmp', dir = cache_dir)
+        os.close(fd)
+        shutil.copyfile(catalog, temp_path)
+        os.rename(temp_path, os.path.join(cache_dir, '%s.jar' % key))
+        # Evict the least recently used catalogs.
+        cached = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.jar')]
+        cached.sort(key = lambda path: os.path.getmtime(path), reverse = True)
+        for path in cached[cache_size:]:
+            os.remove(path)
+    except (IOError, OSError), e:
+        utility.warning('Unable to save the catalog in the compile cache "%s".' % cache_dir, e)
+
+def fetch_catalog(cache_dir, key, catalog):
+    path = os.path.join(cache_dir, '%s.jar' % key)
+    if not os.path.isfile(path):
+        return False
+    try:
+        shutil.copyfile(path, catalog)
+        # Touch for least recently used eviction.
+        os.utime(path, None)
+    except (IOError, OSError), e:
+        utility.warning('Unable to use cached catalog "%s".' % path, e)
+        return False
+    return True
+
 # Command meta-data.
 @VOLT.Command(
     # Descriptions for help screen.
@@ -45,7 +160,12 @@ VoltCompiler = 'org.voltdb.compiler.VoltCompiler'
                           'the output application catalog jar file',
                           default = 'catalog.jar'),
         VOLT.StringOption('-p', '--project', 'project',
-                          'the project file, e.g. project.xml (deprecated)')
+                          'the project file, e.g. project.xml (deprecated)'),
+        VOLT.BooleanOption(None, '--no-cache', 'no_cache',
+                           'always run the compiler instead of reusing a cached catalog',
+                           default = False),
+        VOLT.StringOption(None, '--cache-dir', 'cache_dir',
+                          'the compiled catalog cache directory')
     ),
 
     # Command line arguments.
@@ -93,4 +213,17 @@ def compile(runner):
     if runner.opts.classpath:
        cpath = 'procedures:' + runner.opts.classpath
     kwargs = dict(classpath = cpath)
+
+    # Reuse a previously compiled catalog when none of the inputs changed.
+    # Project files name their own inputs, so they are not cached.
+    key = None
+    if not runner.opts.no_cache and not runner.opts.project and not runner.is_dryrun():
+        cache_dir = get_cache_dir(runner)
+        key = get_cache_key(runner.opts.ddl, cpath)
+        runner.verbose_info('Catalog cache key: %s' % key)
+        if key is not None and fetch_catalog(cache_dir, key, runner.opts.catalog):
+            runner.info('Inputs are unchanged, reused cached catalog "%s".' % runner.opts.catalog)
+            return
     runner.java_execute(VoltCompiler, None, *args, **kwargs)
+    if key is not None and os.path.isfile(runner.opts.catalog):
+        store_catalog(cache_dir, key, runner.opts.catalog)
@@ -0,0 +1,355 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import csv
+import time
+import multiprocessing
+import Queue
+from voltcli import utility
+
+# Bytes of input per parsing task. Files are split at line boundaries.
+default_chunk_mb = 16
+
+# Field value loaded as NULL, and additionally the empty string for
+# non-string columns.
+null_marker = '\\N'
+
+# Worker processes stop reporting rejected lines after this many.
+max_reported_rejects = 1000
+
+class Options(object):
+    """
+    Settings shared with the worker processes.
+    """
+    def __init__(self, runner, type_names):
+        self.hosts = [(host.host, host.port) for host in runner.opts.host]
+        self.kwargs = get_connection_kwargs(runner)
+        self.procedure = runner.opts.procedure or '%s.insert' % runner.opts.table.upper()
+        self.type_names = type_names
+        self.separator = runner.opts.separator
+        self.header = runner.opts.header
+        self.window = runner.opts.window
+        self.batch = runner.opts.batch
+
+class LoadResult(object):
+    """
+    Counts for loaded byte ranges. Passed between processes as a tuple
+    because classes declared in command files can't be pickled.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.calls = 0
+        self.rejected = 0
+        self.rejects = []
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def reject(self, line_text, message):
+        self.rejected += 1
+        if len(self.rejects) < max_reported_rejects:
+            self.rejects.append((self.path, line_text, message))
+
+    def to_tuple(self):
+        return (self.rows, self.calls, self.rejected, self.rejects, self.latency_total, self.latency_max)
+
+    def merge(self, values):
+        rows, calls, rejected, rejects, latency_total, latency_max = values
+        self.rows += rows
+        self.calls += calls
+        self.rejected += rejected
+        self.rejects.extend(rejects)
+        self.latency_total += latency_total
+        self.latency_max = max(self.latency_max, latency_max)
+
+def get_connection_kwargs(runner):
+    kwargs = {}
+    if runner.opts.username:
+        kwargs['username'] = runner.opts.username
+        if runner.opts.password:
+            kwargs['password'] = runner.opts.password
+    return kwargs
+
+def get_column_types(runner, client):
+    """
+    Return the table column type names in column order.
+    """
+    proc = VOLT.VoltProcedure(client, '@SystemCatalog', [VOLT.FastSerializer.VOLTTYPE_STRING])
+    response = proc.call(params = ['COLUMNS'])
+    if response.status != 1:
+        runner.abort('Unable to read the table columns.', (response,))
+    table = response.tables[0]
+    ci = dict((table.columns[i].name, i) for i in range(len(table.columns)))
+    columns = [(row[ci['ORDINAL_POSITION']], row[ci['TYPE_NAME']]) for row in table.tuples
+                    if row[ci['TABLE_NAME']].upper() == runner.opts.table.upper()]
+    if not columns:
+        runner.abort('Table "%s" does not exist.' % runner.opts.table)
+    type_names = [type_name for position, type_name in sorted(columns)]
+    unsupported = [type_name for type_name in type_names if type_name not in utility.volt_types]
+    if unsupported:
+        runner.abort('Unsupported column types:', unsupported)
+    return type_names
+
+def get_ranges(paths, chunk_size):
+    ranges = []
+    for path in paths:
+        size = os.path.getsize(path)
+        start = 0
+        while True:
+            end = min(start + chunk_size, size)
+            ranges.append((path, start, end))
+            if end >= size:
+                break
+            start = end
+    return ranges
+
+def read_range(path, start, end, header):
+    """
+    Generate the lines that start within [start, end).
+    """
+    f = open(path, 'rb')
+    try:
+        position = start
+        if start > 0:
+            # The line running through the start belongs to the previous range.
+            f.seek(start - 1)
+            position += len(f.readline()) - 1
+        elif header:
+            position += len(f.readline())
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+    finally:
+        f.close()
+
+class Loader(object):
+    """
+    Worker process state: one connection with pipelined insert calls.
+    Up to "window" calls are outstanding, the rest waits on the responses,
+    so the client slows down when the server applies backpressure.
+    """
+    def __init__(self, options, host):
+        self.options = options
+        self.client = VOLT.FastSerializer(host[0], host[1], **options.kwargs)
+        types = [utility.volt_types[type_name][0] for type_name in options.type_names]
+        self.converters = [utility.volt_types[type_name][1] for type_name in options.type_names]
+        self.string_columns = [utility.volt_types[type_name][0] == VOLT.FastSerializer.VOLTTYPE_STRING
+                                    for type_name in options.type_names]
+        self.proc = VOLT.VoltProcedure(self.client, options.procedure, types)
+        self.handle = 0
+        self.pending = {}
+        self.messages = []
+
+    def convert(self, fields):
+        if len(fields) != len(self.converters):
+            raise ValueError('expected %d fields, found %d' % (len(self.converters), len(fields)))
+        params = []
+        for i, field in enumerate(fields):
+            if field == null_marker or (field == '' and not self.string_columns[i]):
+                params.append(None)
+            else:
+                params.append(self.converters[i](field))
+        return params
+
+    def send(self):
+        if self.messages:
+            self.client.socket.sendall(''.join(self.messages))
+            self.messages = []
+
+    def receive(self, result):
+        response = VOLT.VoltResponse(self.client)
+        sent, line_text = self.pending.pop(response.clientHandle)
+        latency = time.time() - sent
+        result.calls += 1
+        result.latency_total += latency
+        result.latency_max = max(result.latency_max, latency)
+        if response.status == 1:
+            result.rows += 1
+        else:
+            result.reject(line_text, response.statusString)
+
+    def load(self, path, start, end):
+        result = LoadResult(path)
+        lines = read_range(path, start, end, self.options.header)
+        for fields in csv.reader(lines, delimiter = self.options.separator):
+            line_text = self.options.separator.join(fields)
+            try:
+                params = self.convert(fields)
+            except utility.volt_value_errors, e:
+                result.reject(line_text, str(e))
+                continue
+            self.handle += 1
+            try:
+                self.messages.append(self.proc.serialize(params, self.handle))
+            except utility.volt_value_errors, e:
+                del self.client.wbuf[:]
+                result.reject(line_text, str(e))
+                continue
+            self.pending[self.handle] = (time.time(), line_text)
+            if len(self.messages) >= self.options.batch:
+                self.send()
+            while len(self.pending) >= self.options.window:
+                self.send()
+                self.receive(result)
+        self.send()
+        while self.pending:
+            self.receive(result)
+        return result
+
+def worker(options, index, tasks, results):
+    try:
+        loader = Loader(options, options.hosts[index % len(options.hosts)])
+    except Exception, e:
+        results.put(('error', 'Unable to connect: %s' % e))
+        return
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        try:
+            results.put(('result', loader.load(*task).to_tuple()))
+        except Exception, e:
+            results.put(('error', '%s: %s' % (task[0], e)))
+            break
+    loader.client.close()
+
+@VOLT.Command(
+    bundles = VOLT.ConnectionBundle(default_port = 21212, min_count = 1, max_count = None),
+    description = 'Load CSV files into a table.',
+    description2 = '''
+Files are split into byte ranges that are parsed by parallel worker processes,
+each sending pipelined insert calls over its own connection. Records must not
+contain line breaks. "\\N" loads NULL, as does an empty field in a non-string
+column.''',
+    options = (
+        VOLT.StringOption('-s', '--separator', 'separator',
+                          'field separator', default = ','),
+        VOLT.BooleanOption(None, '--header', 'header',
+                           'skip the first line of each file', default = False),
+        VOLT.StringOption('-P', '--procedure', 'procedure',
+                          'insert procedure (default: TABLE.insert)'),
+        VOLT.IntegerOption('-w', '--workers', 'workers',
+                           'number of worker processes and connections',
+                           default = multiprocessing.cpu_count()),
+        VOLT.IntegerOption(None, '--chunk-size', 'chunk_size',
+                           'megabytes of input per parsing task', default = default_chunk_mb),
+        VOLT.IntegerOption(None, '--window', 'window',
+                           'maximum outstanding calls per connection', default = 500),
+        VOLT.IntegerOption(None, '--batch', 'batch',
+                           'calls sent together per socket write', default = 100),
+        VOLT.IntegerOption('-m', '--max-errors', 'max_errors',
+                           'stop after this many rejected rows, 0 for no limit', default = 100),
+        VOLT.StringOption('-r', '--reject', 'reject',
+                          'file for rejected lines and their errors'),
+    ),
+    arguments = (
+        VOLT.StringArgument('table', 'the table name'),
+        VOLT.PathArgument('files', 'CSV file(s)', exists = True, min_count = 1, max_count = None),
+    )
+)
+def load(runner):
+    if runner.opts.workers < 1 or runner.opts.window < 1 or runner.opts.batch < 1:
+        runner.abort('The worker count, window and batch size must be positive.')
+    if len(runner.opts.separator) != 1:
+        runner.abort('The separator must be a single character.')
+    host = runner.opts.host[0]
+    try:
+        client = VOLT.FastSerializer(host.host, host.port, **get_connection_kwargs(runner))
+    except Exception, e:
+        runner.abort('Unable to connect to %s:%d.' % (host.host, host.port), e)
+    try:
+        type_names = get_column_types(runner, client)
+    finally:
+        client.close()
+    options = Options(runner, type_names)
+    ranges = get_ranges(runner.opts.files, runner.opts.chunk_size * 1024 * 1024)
+    runner.verbose_info('Loading %d byte ranges with %d workers.' % (len(ranges), runner.opts.workers))
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for task in ranges:
+        tasks.put(task)
+    workers = []
+    for index in range(min(runner.opts.workers, len(ranges))):
+        tasks.put(None)
+        process = multiprocessing.Process(target = worker, args = (options, index, tasks, results))
+        process.daemon = True
+        process.start()
+        workers.append(process)
+    start = time.time()
+    total = LoadResult(None)
+    errors = []
+    done = 0
+    while done < len(ranges) and not errors:
+        try:
+            kind, value = results.get(timeout = 1)
+        except Queue.Empty:
+            if not [process for process in workers if process.is_alive()]:
+                errors.append('All worker processes exited.')
+            continue
+        if kind == 'error':
+            errors.append(value)
+            continue
+        done += 1
+        total.merge(value)
+        runner.verbose_info('%d/%d ranges, %d rows, %.0f rows/s'
+                                % (done, len(ranges), total.rows, total.rows / max(time.time() - start, 0.001)))
+        if runner.opts.max_errors and total.rejected >= runner.opts.max_errors:
+            errors.append('Stopped after %d rejected rows.' % total.rejected)
+    elapsed = max(time.time() - start, 0.001)
+    for process in workers:
+        if errors:
+            process.terminate()
+        process.join()
+    if total.rejects and runner.opts.reject:
+        try:
+            f = open(runner.opts.reject, 'w')
+            try:
+                for path, line_text, message in total.rejects:
+                    f.write('%s\n# %s: %s\n' % (line_text, path, message))
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            runner.warning('Unable to write rejected lines to "%s".' % runner.opts.reject, e)
+    elif total.rejects:
+        runner.warning('Rejected lines (first 10):',
+                       ['%s: %s' % (line_text, message) for path, line_text, message in total.rejects[:10]])
+    rows = [
+        ('Rows loaded', total.rows),
+        ('Rows rejected', total.rejected),
+        ('Seconds', '%.1f' % elapsed),
+        ('Rows/second', '%.0f' % (total.rows / elapsed)),
+        ('Average latency (ms)', '%.2f' % (total.latency_total * 1000 / max(total.calls, 1))),
+        ('Maximum latency (ms)', '%.2f' % (total.latency_max * 1000)),
+    ]
+    print utility.format_table(rows, caption = 'Load Results', headings = ('STATISTIC', 'VALUE'))
+    if errors:
+        runner.abort(*errors)
@@ -0,0 +1,177 @@
+# This file is part of VoltDB.
+
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# This file contains original code and/or modifications of original code.
+# Any modifications made by VoltDB Inc. are licensed under the following
+# terms and conditions:
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+from xml.etree import ElementTree
+from voltcli import environment
+
+# Sites per host assumed when no deployment file is given (server default).
+default_sites_per_host = 8
+
+# The JVM stops using compressed object pointers above roughly 32 GB.
+max_heap_mb = 30 * 1024
+
+# The default collector options, with thread counts added by the profile.
+cms_options = ' '.join(environment.java_opts_gc)
+
+g1_options = ' '.join((
+    '-XX:+UseG1GC',
+    '-XX:MaxGCPauseMillis=50',
+    '-XX:+ExplicitGCInvokesConcurrent'))
+
+def get_sites_per_host(runner):
+    if not runner.opts.deployment:
+        runner.info('No deployment file specified, assuming %d sites per host.'
+                        % default_sites_per_host)
+        return default_sites_per_host
+    try:
+        cluster = ElementTree.parse(runner.opts.deployment).getroot().find('cluster')
+    except (IOError, OSError, SyntaxError), e:
+        runner.abort('Unable to read deployment file "%s".' % runner.opts.deployment, e)
+    if cluster is None or not cluster.get('sitesperhost'):
+        return default_sites_per_host
+    try:
+        return int(cluster.get('sitesperhost'))
+    except ValueError:
+        runner.abort('Bad sitesperhost value in deployment file: %s' % cluster.get('sitesperhost'))
+
+def get_heap_mb(host, sites):
+    # Table data lives in native memory, so the heap mainly holds per-site
+    # work and the catalog. Start at 1 GB plus 128 MB per site (2 GB for the
+    # default 8 sites) and keep it within a quarter of the available memory.
+    heap_mb = 1024 + 128 * sites
+    memory_mb = host.effective_memory_mb()
+    if memory_mb:
+        heap_mb = min(heap_mb, max(512, memory_mb / 4))
+    return min(heap_mb, max_heap_mb)
+
+def get_gc_threads(host, sites):
+    # Mirror the JVM's own formula (all cores up to 8, then 5/8 of the rest),
+    # but leave one core per site for the execution engines. Keep at least
+    # two threads (or the JVM default, if lower) so that collections don't
+    # go single threaded when the sites use every core.
+    cores = host.effective_cores()
+    parallel = cores
+    if cores > 8:
+        parallel = 8 + (cores - 8) * 5 / 8
+    parallel = max(min(2, parallel), min(parallel, cores - sites))
+    concurrent = max(1, (parallel + 3) / 4)
+    return parallel, concurrent
+
+def build_profile(runner, host, sites):
+    """
+    Return (profile, recommendations) where profile maps "tune.*" keys to JVM
+    option strings and recommendations lists OS changes to make by hand.
+    """
+    heap_mb = get_heap_mb(host, sites)
+    memory_mb = host.effective_memory_mb()
+    heap = ['-Xmx%dm' % heap_mb]
+    if memory_mb and memory_mb > 1024 * 16:
+        heap.extend(['-Xms%dm' % heap_mb, '-XX:+AlwaysPreTouch'])
+    parallel, concurrent = get_gc_threads(host, sites)
+    if runner.opts.gc == 'g1':
+        gc = [g1_options]
+    else:
+        gc = [cms_options]
+    gc.append('-XX:ParallelGCThreads=%d -XX:ConcGCThreads=%d' % (parallel, concurrent))
+    recommendations = []
+    if host.hugepages and host.hugepage_kb:
+        if host.hugepages * host.hugepage_kb / 1024 >= heap_mb:
+            gc.append('-XX:+UseLargePages')
+        else:
+            recommendations.append('The huge page pool (%d MB) is smaller than the heap; '
+                                   'the JVM will not use large pages.'
+                                        % (host.hugepages * host.hugepage_kb / 1024))
+    if host.thp and host.thp != 'never':
+        recommendations.append('Disable transparent huge pages (currently "%s"): '
+                               'echo never > /sys/kernel/mm/transparent_hugepage/enabled'
+                                    % host.thp)
+    if host.numa_nodes and host.numa_nodes > 1:
+        recommendations.append('%d NUMA nodes: start the server under "numactl --interleave=all" '
+                               'or bind each instance to one node with '
+                               '"numactl --cpunodebind=N --membind=N".' % host.numa_nodes)
+    if sites >= host.effective_cores():
+        recommendations.append('%d sites per host leaves no spare cores out of %d; '
+                               'consider lowering sitesperhost.' % (sites, host.effective_cores()))
+    profile = {'tune.heap': ' '.join(heap), 'tune.gc': ' '.join(gc)}
+    return profile, recommendations
+
+@VOLT.Command(
+    description  = 'Generate a JVM tuning profile for this host.',
+    description2 = '''
+Inspects the host cores, memory, NUMA nodes, transparent huge pages and cgroup
+limits, combines them with the deployment's sites per host, and saves heap and
+garbage collector options to the local configuration. Servers started from
+this directory use the profile automatically. VOLTDB_HEAPMAX, VOLTDB_OPTS and
+JAVA_OPTS still take precedence. They are passed after the profile, which
+leaves out the heap size, collector and other options they set.''',
+    options = (
+        VOLT.StringOption('-d', '--deployment', 'deployment',
+                          'specify the location of the deployment file'),
+        VOLT.EnumOption(None, '--gc', 'gc',
+                        'garbage collector', 'cms', 'g1',
+                        default = 'cms'),
+        VOLT.BooleanOption(None, '--clear', 'clear',
+                           'remove the saved profile and restore the default JVM options',
+                           default = False),
+    )
+)
+def tune(runner):
+    if runner.opts.clear:
+        runner.config.remove_local('tune.heap', 'tune.gc')
+        runner.info('The tuning profile was removed.')
+        return
+    host = environment.get_host_info()
+    sites = get_sites_per_host(runner)
+    profile, recommendations = build_profile(runner, host, sites)
+    def show(value, suffix = ''):
+        if value is None:
+            return 'unknown'
+        return '%s%s' % (value, suffix)
+    rows = [
+        ('Cores', show(host.cores)),
+        ('Memory', show(host.memory_mb, ' MB')),
+        ('NUMA nodes', show(host.numa_nodes)),
+        ('Transparent huge pages', show(host.thp)),
+        ('Huge pages', show(host.hugepages)),
+        ('cgroup CPU limit', show(host.cgroup_cpus)),
+        ('cgroup memory limit', show(host.cgroup_mem_mb, ' MB')),
+        ('Sites per host', sites)]
+    print VOLT.utility.format_table(rows, caption = 'Host')
+    print VOLT.utility.format_table(VOLT.utility.dict_to_sorted_pairs(profile),
+                                    caption = 'JVM Profile')
+    if recommendations:
+        runner.warning('Operating system recommendations:', recommendations)
+    if runner.is_dryrun():
+        runner.info('Dry run, the profile was not saved.')
+    else:
+        runner.config.begin_batch()
+        try:
+            for key, value in VOLT.utility.dict_to_sorted_pairs(profile):
+                runner.config.set_local(key, value)
+        finally:
+            runner.config.end_batch()
+        runner.info('The tuning profile was saved to "%s".' % runner.config.local_path)
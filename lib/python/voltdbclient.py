@@ -26,6 +26,7 @@ import sys
 if sys.hexversion < 0x02050000:
     raise Exception("Python version 2.5 or greater is required.")
 import array
+import os
 import socket
 import struct
 import datetime
@@ -138,7 +139,8 @@ class FastSerializer:
                  password = "", dump_file_path = None,
                  connect_timeout = 8,
                  procedure_timeout = None,
-                 default_timeout = None):
+                 default_timeout = None,
+                 password_hash = None):
         """
         :param host: host string for connection or None
         :param port: port for connection or None
@@ -148,9 +150,12 @@ class FastSerializer:
         :param connect_timeout: timeout (secs) or None for authentication (default=8)
         :param procedure_timeout: timeout (secs) or None for procedure calls (default=None)
         :param default_timeout: default timeout (secs) or None for all other operations (default=None)
+        :param password_hash: SHA-1 digest of the password, sent instead of hashing password, or None
         """
         # connect a socket to host, port and get a file object
         self.wbuf = array.array('c')
+        # (offset, VoltVarbinaryFile) pairs spliced into wbuf by flush()
+        self.wfiles = []
         self.host = host
         self.port = port
         if not dump_file_path is None:
@@ -246,7 +251,7 @@ class FastSerializer:
         if not username is None and not password is None and not host is None:
             assert not self.socket is None
             self.socket.settimeout(connect_timeout)
-            self.authenticate(username, password)
+            self.authenticate(username, password, password_hash)
 
         if self.socket:
             self.socket.settimeout(self.default_timeout)
@@ -268,7 +273,7 @@ class FastSerializer:
             self.dump_file.close()
         self.socket.close()
 
-    def authenticate(self, username, password):
+    def authenticate(self, username, password, password_hash = None):
         # Requires sending a length preceded username and password even if
         # authentication is turned off.
 
@@ -285,10 +290,12 @@ class FastSerializer:
             # no username, just output length of 0
             self.writeString("")
 
-        # password supplied, sha-1 hash it
-        m = sha()
-        m.update(password)
-        pwHash = m.digest()
+        # password supplied, sha-1 hash it unless the caller already did
+        pwHash = password_hash
+        if pwHash is None:
+            m = sha()
+            m.update(password)
+            pwHash = m.digest()
         self.wbuf.extend(pwHash)
 
         self.prependLength()
@@ -330,26 +337,43 @@ class FastSerializer:
         # write 32 bit array length at offset 0, NOT including the
         # size of this length preceding value. This value is written
         # in the network order.
-        ttllen = self.wbuf.buffer_info()[1] * self.wbuf.itemsize
+        ttllen = self.size()
         lenBytes = struct.pack(self.inputBOM + 'i', ttllen)
         map(lambda x: self.wbuf.insert(0, x), lenBytes[::-1])
+        self.wfiles = [(offset + len(lenBytes), f) for offset, f in self.wfiles]
 
     def size(self):
-        """Returns the size of the write buffer.
+        """Returns the size of the write buffer, including streamed files.
         """
 
-        return (self.wbuf.buffer_info()[1] * self.wbuf.itemsize)
+        return (self.wbuf.buffer_info()[1] * self.wbuf.itemsize
+                + sum([f.size for offset, f in self.wfiles]))
 
     def flush(self):
         if self.socket is None:
             print "ERROR: not connected to server."
             exit(-1)
 
+        for data in self.chunks():
+            if self.dump_file != None:
+                self.dump_file.write(data)
+            self.socket.sendall(data)
         if self.dump_file != None:
-            self.dump_file.write(self.wbuf)
             self.dump_file.write("\n")
-        self.socket.sendall(self.wbuf.tostring())
         self.wbuf = array.array('c')
+        self.wfiles = []
+
+    def chunks(self):
+        """Yields the write buffer in pieces, with the contents of streamed
+        files between the buffered bytes around them.
+        """
+        start = 0
+        for offset, f in self.wfiles:
+            yield self.wbuf[start:offset].tostring()
+            for data in f.chunks():
+                yield data
+            start = offset
+        yield self.wbuf[start:].tostring()
 
     def bufferForRead(self):
         if self.socket is None:
@@ -626,6 +650,12 @@ class FastSerializer:
             self.writeInt32(self.NULL_STRING_INDICATOR)
             return
 
+        if isinstance(value, VoltVarbinaryFile):
+            # The content is read from the file as the message is sent.
+            self.writeInt32(value.size)
+            self.wfiles.append((self.wbuf.buffer_info()[1] * self.wbuf.itemsize, value))
+            return
+
         self.writeInt32(len(value))
         self.wbuf.extend(value)
 
@@ -1013,6 +1043,33 @@ class VoltResponse:
             msgstr += "Exception: %s" % (self.exception)
             return msgstr
 
+class VoltVarbinaryFile:
+    """VARBINARY parameter whose content is streamed from a file when the
+    procedure invocation is sent, instead of being copied into memory.
+    """
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def chunks(self):
+        f = open(self.path, 'rb')
+        try:
+            remaining = self.size
+            while remaining > 0:
+                data = f.read(min(remaining, self.CHUNK_SIZE))
+                if not data:
+                    raise IOError("%s: file shrank while being sent" % self.path)
+                yield data
+                remaining -= len(data)
+        finally:
+            f.close()
+
+    def send(self, sock):
+        for data in self.chunks():
+            sock.sendall(data)
+
 class VoltProcedure:
     "VoltDB called procedure interface"
     def __init__(self, fser, name, paramtypes = []):
@@ -1020,10 +1077,10 @@ class VoltProcedure:
         self.name = name             # procedure class name
         self.paramtypes = paramtypes # list of fser.WIRE_* values
 
-    def call(self, params = None, response = True, timeout = None):
+    def write(self, params = None, handle = 1):
         self.fser.writeByte(0)  # version number
         self.fser.writeString(self.name)
-        self.fser.writeInt64(1)            # client handle
+        self.fser.writeInt64(handle)       # client handle
         self.fser.writeInt16(len(self.paramtypes))
         for i in xrange(len(self.paramtypes)):
             try:
@@ -1037,6 +1094,22 @@ class VoltProcedure:
             except TypeError:
                 self.fser.writeWireType(self.paramtypes[i], params[i])
         self.fser.prependLength() # prepend the total length of the invocation
+
+    def serialize(self, params = None, handle = 1):
+        """Return the invocation message without sending it, e.g. to send
+        several pipelined invocations at once. Responses are read with
+        VoltResponse(fser) and matched by their clientHandle. The contents
+        of VoltVarbinaryFile parameters are read into the message.
+        """
+        try:
+            self.write(params, handle)
+            return ''.join(self.fser.chunks())
+        finally:
+            self.fser.wbuf = array.array('c')
+            self.fser.wfiles = []
+
+    def call(self, params = None, response = True, timeout = None):
+        self.write(params, 1)
         self.fser.flush()
 
         # The timeout in effect for the procedure call is the timeout argument
@@ -23,6 +23,7 @@
 
 package org.voltdb.sqlgenerator;
 
+import java.io.File;
 import java.util.ArrayList;
 
 import org.voltdb.BackendTarget;
@@ -42,6 +43,7 @@ public class SimpleServer {
         int hosts = 1;
         int sites = 1;
         int k_factor = 0;
+        int port = VoltDB.DEFAULT_PORT;
 
         for (int i=0; i < args.length; ++i) {
             arg = args[i].split("=");
@@ -62,6 +64,10 @@ public class SimpleServer {
             {
                 k_factor = Integer.valueOf(arg[1]);
             }
+            else if (arg[0].equals("port"))
+            {
+                port = Integer.valueOf(arg[1]);
+            }
             else if (args[i] != null)
             {
                 host_manager_args.add(args[i]);
@@ -79,20 +85,36 @@ public class SimpleServer {
             k_factor = 0;
         }
 
+        // A server on another client port, e.g. one running alongside
+        // another backend, shifts all of its ports by the same amount and
+        // uses its own catalog and voltdbroot.
+        String name = "simple";
+        String voltRoot = null;
+        int portOffset = port - VoltDB.DEFAULT_PORT;
+        if (portOffset != 0) {
+            name = "simple-" + port;
+            voltRoot = "/tmp/" + System.getProperty("user.name") + "/" + name;
+            new File(voltRoot).mkdirs();
+            config.m_adminPort = VoltDB.DEFAULT_ADMIN_PORT + portOffset;
+            config.m_internalPort = VoltDB.DEFAULT_INTERNAL_PORT + portOffset;
+            config.m_zkInterface = "127.0.0.1:" + (VoltDB.DEFAULT_ZK_PORT + portOffset);
+            config.m_drAgentPortStart = VoltDB.DEFAULT_DR_PORT + portOffset;
+        }
+
         builder = new VoltProjectBuilder();
         builder.addSchema(SimpleServer.class.getResource(schemaFileName));
         builder.setCompilerDebugPrintStream(System.out);
 
-        if (!builder.compile(Configuration.getPathToCatalogForTest("simple.jar"), sites, hosts, k_factor)) {
+        if (builder.compile(Configuration.getPathToCatalogForTest(name + ".jar"), sites, hosts, k_factor, voltRoot) == null) {
             System.err.println("Compilation failed");
             System.exit(-1);
         }
-        MiscUtils.copyFile(builder.getPathToDeployment(), Configuration.getPathToCatalogForTest("simple.xml"));
-        config.m_pathToCatalog = Configuration.getPathToCatalogForTest("simple.jar");
+        MiscUtils.copyFile(builder.getPathToDeployment(), Configuration.getPathToCatalogForTest(name + ".xml"));
+        config.m_pathToCatalog = Configuration.getPathToCatalogForTest(name + ".jar");
         System.out.println("catalog path: " + config.m_pathToCatalog);
-        config.m_pathToDeployment = Configuration.getPathToCatalogForTest("simple.xml");
+        config.m_pathToDeployment = Configuration.getPathToCatalogForTest(name + ".xml");
         System.out.println("deployment path: " + config.m_pathToDeployment);
-        config.m_port = VoltDB.DEFAULT_PORT;
+        config.m_port = port;
         ServerThread server = new ServerThread(config);
         server.start();
 
@@ -25,12 +25,13 @@
 import sys
 import cgi
 import os
-import cPickle
 import decimal
 import datetime
+from itertools import izip
 from distutils.util import strtobool
 from optparse import OptionParser
 from voltdbclient import VoltColumn, VoltTable, FastSerializer
+from SQLCoverageStore import StoreReader, decode_statement, decode_result
 
 __quiet = True
 
@@ -115,7 +116,10 @@ def safe_print(s):
     if not __quiet:
         print s
 
-def print_section(name, mismatches, output_dir):
+def print_section(name, mismatches, output_dir, load):
+    """ Lists the statement ids in mismatches, with their statements and
+    results read by load.
+    """
     result = """
 <h2>%s: %d</h2>
 <table cellpadding=3 cellspacing=1 border=1>
@@ -129,6 +133,7 @@ def print_section(name, mismatches, output_dir):
 
     temp = []
     for i in mismatches:
+        i = load(i)
         safe_print(i["SQL"])
         detail_page = generate_detail(name, i, output_dir)
         jniStatus = i["jni"]["Status"]
@@ -265,42 +270,39 @@ def generate_html_reports(suite, seed, statements_path, hsql_path, jni_path,
     if output_dir != None and not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    statements_file = open(statements_path, "rb")
-    hsql_file = open(hsql_path, "rb")
-    jni_file = open(jni_path, "rb")
+    statements = StoreReader(statements_path, decode_statement)
+    hsql_results = StoreReader(hsql_path, decode_result)
+    jni_results = StoreReader(jni_path, decode_result)
+    if len(jni_results) < len(statements) or len(hsql_results) < len(statements):
+        raise IOError("Not enough results for generated statements: %d statements, "
+                      "%d VoltDB and %d HSQLDB results" %
+                      (len(statements), len(jni_results), len(hsql_results)))
     failures = 0
     count = 0
+    # Only the ids of reported statements and the highlights of mismatches
+    # are kept; their statements and results are read again for the report.
     mismatches = []
-    all_results = []
-
-    try:
-        while True:
-            try:
-                statement = cPickle.load(statements_file)
-                # print "DEBUG loaded statement ", statement
-            except EOFError:
-                break
-
-            jni = cPickle.load(jni_file)
-            hsql = cPickle.load(hsql_file)
-
-            count += 1
-            if int(jni["Status"]) != 1:
-                failures += 1
-
-            statement["jni"] = jni
-            statement["hsqldb"] = hsql
-            if is_different(statement, cntonly):
-                mismatches.append(statement)
-            if report_all:
-                all_results.append(statement)
-
-    except EOFError as e:
-        raise IOError("Not enough results for generated statements: %s" % str(e))
-
-    statements_file.close()
-    hsql_file.close()
-    jni_file.close()
+    highlights = {}
+
+    for (statement, jni, hsql) in izip(statements, jni_results, hsql_results):
+        count += 1
+        if int(jni["Status"]) != 1:
+            failures += 1
+
+        statement["jni"] = jni
+        statement["hsqldb"] = hsql
+        if is_different(statement, cntonly):
+            mismatches.append(statement["id"])
+            if "highlight" in statement:
+                highlights[statement["id"]] = statement["highlight"]
+
+    def load(statement_id):
+        statement = statements[statement_id]
+        statement["jni"] = jni_results[statement_id]
+        statement["hsqldb"] = hsql_results[statement_id]
+        if statement_id in highlights:
+            statement["highlight"] = highlights[statement_id]
+        return statement
 
     topLine = getTopSummaryLine()
     currentTime = datetime.datetime.now().strftime("%A, %B %d, %I:%M:%S %p")
@@ -327,13 +329,17 @@ h2 {text-transform: uppercase}
 """ % (keyStats)
 
     def key(x):
-        return int(x["id"])
+        return int(x)
     if(len(mismatches) > 0):
         sorted(mismatches, cmp=cmp, key=key)
-        report += print_section("Mismatched Statements", mismatches, output_dir)
+        report += print_section("Mismatched Statements", mismatches, output_dir, load)
 
     if report_all:
-        report += print_section("Total Statements", all_results, output_dir)
+        report += print_section("Total Statements", xrange(count), output_dir, load)
+
+    statements.close()
+    hsql_results.close()
+    jni_results.close()
 
     report += """
 </body>
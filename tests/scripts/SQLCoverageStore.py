@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# This file is part of VoltDB.
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+# Files of the generated statements and of each backend's results. A file is
+# a sequence of length-prefixed records, one per statement in statement id
+# order, followed by an index of the record offsets by statement id. Records
+# can be streamed in order or read one at a time by statement id, so only the
+# statements being compared or reported are in memory at once.
+#
+# Layout: MAGIC, records of a 4 byte big-endian length and the payload, the
+# index as an array of native longs, then the index offset and record count
+# as 8 byte big-endian integers and MAGIC again. A file without the trailer,
+# e.g. from a backend that crashed, is indexed by scanning its records.
+
+import array
+import cPickle
+import os
+import struct
+import zlib
+from voltdbclient import VoltColumn, VoltTable
+
+MAGIC = "VoltSQLCov1\n"
+
+# Payloads at least this long are compressed
+compress_size = 1024
+
+length_format = ">i"
+length_size = struct.calcsize(length_format)
+trailer_format = ">qq"
+trailer_size = struct.calcsize(trailer_format) + len(MAGIC)
+
+def encode_statement(statement):
+    sql = statement["SQL"]
+    if isinstance(sql, unicode):
+        sql = sql.encode("utf-8")
+    return sql
+
+def decode_statement(statement_id, data):
+    return {"id": statement_id, "SQL": data.decode("utf-8")}
+
+def encode_result(result):
+    """ Tables are stored by column, as (name, type) pairs and a tuple of
+    values for each column, rather than as pickled VoltTable objects.
+    """
+    columns = None
+    values = None
+    table = result["Result"]
+    if table:
+        columns = [(column.name, column.type) for column in table.columns]
+        values = zip(*table.tuples)
+    data = cPickle.dumps((result["Status"], result["Info"], result["Exception"],
+                          columns, values), 2)
+    if len(data) >= compress_size:
+        return "z" + zlib.compress(data)
+    return "p" + data
+
+def decode_result(statement_id, data):
+    if data[0] == "z":
+        data = zlib.decompress(data[1:])
+    else:
+        data = data[1:]
+    (status, info, exception, columns, values) = cPickle.loads(data)
+    table = None
+    if columns is not None:
+        table = VoltTable(None)
+        for (name, type) in columns:
+            column = VoltColumn()
+            column.name = name
+            column.type = type
+            table.columns.append(column)
+        if values:
+            table.tuples = map(list, zip(*values))
+    return {"Status": status, "Info": info, "Result": table, "Exception": exception}
+
+class StoreWriter:
+    def __init__(self, path, encode):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.encode = encode
+        self.offset = len(MAGIC)
+        self.offsets = array.array("l")
+
+    def write(self, record):
+        """ Appends the record of the next statement id """
+        data = self.encode(record)
+        self.file.write(struct.pack(length_format, len(data)))
+        self.file.write(data)
+        self.offsets.append(self.offset)
+        self.offset += length_size + len(data)
+
+    def close(self):
+        self.file.write(self.offsets.tostring())
+        self.file.write(struct.pack(trailer_format, self.offset, len(self.offsets)))
+        self.file.write(MAGIC)
+        self.file.close()
+
+class StoreReader:
+    def __init__(self, path, decode):
+        self.path = path
+        self.decode = decode
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise IOError("%s is not a SQL coverage statement or result file" % path)
+        self.offsets = self.read_index()
+
+    def read_index(self):
+        size = os.fstat(self.file.fileno()).st_size
+        offsets = array.array("l")
+        if size >= len(MAGIC) + trailer_size:
+            self.file.seek(size - trailer_size)
+            trailer = self.file.read(trailer_size)
+            if trailer.endswith(MAGIC):
+                (index_offset, count) = struct.unpack(trailer_format, trailer[:-len(MAGIC)])
+                self.file.seek(index_offset)
+                offsets.fromstring(self.file.read(count * offsets.itemsize))
+                return offsets
+        # No index, so keep the complete records
+        offset = len(MAGIC)
+        while offset + length_size <= size:
+            self.file.seek(offset)
+            (length,) = struct.unpack(length_format, self.file.read(length_size))
+            if offset + length_size + length > size:
+                break
+            offsets.append(offset)
+            offset += length_size + length
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, statement_id):
+        """ Reads the record of one statement id """
+        self.file.seek(self.offsets[statement_id])
+        (length,) = struct.unpack(length_format, self.file.read(length_size))
+        return self.decode(statement_id, self.file.read(length))
+
+    def __iter__(self):
+        """ Streams the records in statement id order """
+        f = open(self.path, "rb")
+        try:
+            f.seek(len(MAGIC))
+            for statement_id in xrange(len(self.offsets)):
+                (length,) = struct.unpack(length_format, f.read(length_size))
+                yield self.decode(statement_id, f.read(length))
+        finally:
+            f.close()
+
+    def close(self):
+        self.file.close()
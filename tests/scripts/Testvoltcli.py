@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+# This file is part of VoltDB.
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import sys
+# add the path to the volt python client, just based on knowing
+# where we are now
+sys.path.append('../../lib/python')
+
+import os
+import unittest
+import datetime
+import decimal
+import socket
+import struct
+import StringIO
+import array
+import tempfile
+import threading
+
+# voltcli.environment aborts when it can't find java, which none of
+# these tests run.
+os.environ.setdefault("JAVA_HOME", "/usr")
+
+from voltdbclient import *
+from voltcli import utility
+
+class TestVoltTypes(unittest.TestCase):
+    """String conversions shared by the load and sql verbs."""
+
+    def testTimestamp(self):
+        expected = datetime.datetime.fromtimestamp(86400).replace(microsecond = 250000)
+        convert = utility.volt_types["TIMESTAMP"][1]
+        self.assertEqual(convert("1970-01-02 00:00:00.25"), expected)
+        self.assertEqual(convert("86400250000"), expected)
+        self.assertEqual(convert("1970-01-02"), expected.replace(microsecond = 0))
+
+    def testConverters(self):
+        self.assertEqual(utility.volt_types["DECIMAL"][1]("1.50"), decimal.Decimal("1.50"))
+        self.assertEqual(utility.volt_types["VARBINARY"][1]("0aff"), "\x0a\xff")
+        self.assertEqual(utility.volt_types["VARCHAR"][1]("\xc3\xa7a"), u"\xe7a")
+        self.assertRaises(utility.volt_value_errors, utility.volt_types["INTEGER"][1], "x")
+
+class TestSqlSession(unittest.TestCase):
+    """Statements run by the voltcli sql verb against a fake server."""
+
+    def setUp(self):
+        from voltcli import runner
+        self.sql = {"VOLT": runner.VOLT(runner.VerbDecorators({}))}
+        execfile("../../lib/python/voltcli/future.d/sql.py", self.sql)
+        (self.ours, self.theirs) = socket.socketpair()
+        client = FastSerializer(None, None)
+        client.socket = self.ours
+        class Options:
+            format = "tab"
+            clean = True
+            exception_stacks = False
+        class Runner:
+            opts = Options()
+        Runner.client = client
+        self.session = self.sql["Session"](Runner())
+        self.output = StringIO.StringIO()
+        self.session.formatter = self.sql["Formatter"]("tab", True, self.output)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.ours.close()
+        self.theirs.close()
+
+    def reply(self, rows):
+        """Answers the next invocation with a one column table of rows."""
+        fs = FastSerializer(None, None)
+        fs.socket = self.theirs
+        (length,) = struct.unpack(">i", self.theirs.recv(4))
+        message = ""
+        while len(message) < length:
+            message += self.theirs.recv(length - len(message))
+        (namelen,) = struct.unpack(">i", message[1:5])
+        (handle,) = struct.unpack(">q", message[5 + namelen:13 + namelen])
+        table = VoltTable(fs)
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_INTEGER,
+                                        name = "C1"))
+        table.tuples = [[row] for row in rows]
+        fs.writeByte(0)
+        fs.writeInt64(handle)
+        fs.writeByte(0)
+        fs.writeByte(1)
+        fs.writeByte(0)
+        fs.writeInt32(0)
+        fs.writeInt16(1)
+        table.writeToSerializer()
+        fs.prependLength()
+        fs.flush()
+        return handle
+
+    def testBadStatementBeforeGoodStatement(self):
+        self.session.layouts = {"INSERT": [utility.volt_types["TINYINT"]]}
+        self.session.execute("exec Insert 1000")
+        self.session.execute("select c1 from t")
+        self.assertEqual(self.reply([7]), 2)
+        self.session.drain()
+        self.assertEqual(self.output.getvalue(), "7\n")
+        self.assertEqual(self.session.failures, 1)
+        self.assertEqual(self.session.responses, {})
+
+    def testBlockComments(self):
+        split_statements = self.sql["split_statements"]
+        self.assertEqual(split_statements("select 1 /* a; 'b */ from t; /* c */ select 2;"),
+                         (["select 1   from t", "select 2"], ""))
+        self.assertEqual(split_statements("select '/*;' from t; select 2 /* x; y"),
+                         (["select '/*;' from t"], "select 2 /* x; y"))
+        self.assertEqual(split_statements("-- /* a;\nselect 1; /* -- */ select 2;"),
+                         (["select 1", "select 2"], ""))
+
+    def testCatalogCommands(self):
+        self.assertEqual(self.session.get_call("show classes")[2], ["CLASSES"])
+        self.assertEqual(self.session.get_call("list proc")[2], ["PROCEDURES"])
+        self.assertEqual(self.session.get_call("LIST  Tables")[2], ["TABLES"])
+
+    def testInteractiveOnlyCommands(self):
+        for statement in ("file setup.sql", "load classes procs.jar", "help", "recall 3"):
+            self.session.execute(statement)
+        self.assertEqual(self.session.failures, 4)
+        self.assertEqual(self.session.pending, {})
+
+    def testInteractiveDelegatesToSQLCommand(self):
+        calls = []
+        class Host:
+            host = "volt1"
+            port = 21212
+        class Options:
+            host = Host()
+            username = None
+            format = "csv"
+            clean = False
+            exception_stacks = False
+        class Runner:
+            opts = Options()
+            def java_execute(self, java_class, java_opts_override, *args):
+                calls.append((java_class, args))
+        self.sql["run_interactive"](Runner())
+        self.assertEqual(calls, [("org.voltdb.utils.SQLCommand",
+                                  ("--servers=volt1", "--port=21212", "--output-format=csv"))])
+
+class TestLoader(unittest.TestCase):
+    """Rows sent by the voltcli load verb to a fake server."""
+
+    def setUp(self):
+        from voltcli import runner
+        self.load = {"VOLT": runner.VOLT(runner.VerbDecorators({}))}
+        execfile("../../lib/python/voltcli/voltdb.d/load.py", self.load)
+        class Options:
+            kwargs = {}
+            procedure = "T.insert"
+            type_names = ["INTEGER", "TINYINT"]
+            separator = ","
+            header = False
+            window = 500
+            batch = 100
+        self.loader = self.load["Loader"](Options(), (None, None))
+        (self.ours, self.theirs) = socket.socketpair()
+        self.loader.client.socket = self.ours
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        self.ours.close()
+        self.theirs.close()
+        os.remove(self.path)
+
+    def serve(self, count):
+        """Answers count invocations with success."""
+        fs = FastSerializer(None, None)
+        fs.socket = self.theirs
+        for i in range(count):
+            (length,) = struct.unpack(">i", self.theirs.recv(4))
+            message = ""
+            while len(message) < length:
+                message += self.theirs.recv(length - len(message))
+            (namelen,) = struct.unpack(">i", message[1:5])
+            (handle,) = struct.unpack(">q", message[5 + namelen:13 + namelen])
+            fs.writeByte(0)
+            fs.writeInt64(handle)
+            fs.writeByte(0)
+            fs.writeByte(1)
+            fs.writeByte(0)
+            fs.writeInt32(0)
+            fs.writeInt16(0)
+            fs.prependLength()
+            fs.flush()
+
+    def testOutOfRangeRowRejected(self):
+        f = open(self.path, "wb")
+        f.write("1,1\n2,1000\n3,-7\n")
+        f.close()
+        server = threading.Thread(target = self.serve, args = (2,))
+        server.start()
+        result = self.loader.load(self.path, 0, os.path.getsize(self.path))
+        server.join()
+        self.assertEqual(result.rows, 2)
+        self.assertEqual(result.calls, 2)
+        self.assertEqual(result.rejected, 1)
+        self.assertEqual(result.rejects[0][1], "2,1000")
+        self.assertEqual(self.loader.pending, {})
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Latency percentiles computed by voltadmin top."""
+
+    def histogram(self, values):
+        """Encodes values like LatencyStats.constructHistogram(), in microseconds."""
+        counts = [0] * (26 * 128)
+        for value in values:
+            if value < 256:
+                counts[value] += 1
+            else:
+                bucket = len(bin(value)) - 2 - 8
+                counts[((bucket + 1) << 7) + (value >> bucket) - 128] += 1
+        data = struct.pack("<qqiq", 1, 3600000000, 2, len(values))
+        data += struct.pack("<%dq" % len(counts), *counts)
+        return self.top["LatencyHistogram"](array.array("c", data))
+
+    def setUp(self):
+        from voltcli import runner
+        self.top = {"VOLT": runner.VOLT(runner.VerbDecorators({}))}
+        execfile("../../lib/python/voltcli/voltadmin.d/top.py", self.top)
+
+    def testPercentiles(self):
+        histogram = self.histogram([100] * 50 + [300] * 45 + [2000] * 5)
+        self.assertEqual(histogram.row(), ["0.100", "0.300", "2.000"])
+
+    def testDiff(self):
+        older = self.histogram([100] * 10)
+        newer = self.histogram([100] * 10 + [300] * 4)
+        delta = newer.diff(older)
+        self.assertEqual(delta.total, 4)
+        self.assertEqual(delta.percentile_ms(50), 0.3)
+        self.assertEqual(newer.total, 14)
+        self.assertEqual(older.diff(newer).total, 10)
+
+class TestMergeHostResponses(unittest.TestCase):
+    """Per-host responses merged by the voltcli cluster admin bundle."""
+
+    def response(self, tables):
+        response = VoltResponse(None)
+        response.status = 1
+        response.tables = []
+        for rows in tables:
+            table = VoltTable(None)
+            table.columns = [VoltColumn(type = FastSerializer.VOLTTYPE_INTEGER, name = "HOST_ID"),
+                             VoltColumn(type = FastSerializer.VOLTTYPE_STRING, name = "VALUE")]
+            table.tuples = rows
+            response.tables.append(table)
+        return response
+
+    def testMerge(self):
+        from voltcli import runner
+        merged = runner.merge_host_responses([
+            ("a:21211", self.response([[[0, "x"], [1, "y"]], [[7, "z"]]])),
+            ("b:21211", self.response([[[1, "y"]], []])),
+        ])
+        self.assertEqual(merged.status, 1)
+        self.assertEqual(len(merged.tables), 2)
+        self.assertEqual([(c.name, c.type) for c in merged.tables[0].columns],
+                         [("HOST", FastSerializer.VOLTTYPE_STRING),
+                          ("HOST_ID", FastSerializer.VOLTTYPE_INTEGER),
+                          ("VALUE", FastSerializer.VOLTTYPE_STRING)])
+        self.assertEqual(merged.tables[0].tuples,
+                         [["a:21211", 0, "x"], ["a:21211", 1, "y"], ["b:21211", 1, "y"]])
+        self.assertEqual(merged.tables[1].tuples, [["a:21211", 7, "z"]])
+
+    def testMergeNothing(self):
+        from voltcli import runner
+        merged = runner.merge_host_responses([])
+        self.assertEqual(merged.status, 1)
+        self.assertEqual(merged.tables, [])
+
+class TestConnectionPool(unittest.TestCase):
+    """Idle connections lent by the voltcli connection broker."""
+
+    class Connection(object):
+        def __init__(self, sock):
+            self.socket = sock
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+            self.socket.close()
+
+    def setUp(self):
+        from voltcli import broker
+        self.pool = broker.ConnectionPool()
+        self.key = ("localhost", 21212, "", "digest")
+        self.peers = []
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.close()
+
+    def pooled(self):
+        sock, peer = socket.socketpair()
+        self.peers.append(peer)
+        connection = self.Connection(sock)
+        self.pool.checkin(self.key, connection)
+        return connection, peer
+
+    def testLendsLiveConnection(self):
+        connection = self.pooled()[0]
+        self.assertTrue(self.pool.checkout(self.key, "") is connection)
+        self.assertFalse(connection.closed)
+
+    def testDiscardsClosedConnection(self):
+        live = self.pooled()[0]
+        closed, peer = self.pooled()
+        peer.close()
+        self.assertTrue(self.pool.checkout(self.key, "") is live)
+        self.assertTrue(closed.closed)
+
+class TestBuildJavaOpts(unittest.TestCase):
+    """JVM options from a tuning profile combined with the user's."""
+
+    profile = {"heap": "-Xmx4096m -Xms4096m -XX:+AlwaysPreTouch",
+               "gc": "-XX:+UseParNewGC -XX:+UseConcMarkSweepGC "
+                     "-XX:CMSInitiatingOccupancyFraction=75 -XX:ParallelGCThreads=4"}
+
+    def setUp(self):
+        from voltcli import environment
+        self.environment = environment
+        self.java_opts_user = environment.java_opts_user[:]
+
+    def tearDown(self):
+        self.environment.java_opts_user[:] = self.java_opts_user
+
+    def build(self, user_opts):
+        from voltcli import utility
+        self.environment.java_opts_user[:] = user_opts
+        return utility.merge_java_options(self.environment.build_java_opts(self.profile))
+
+    def testUserCollectorSurvivesProfile(self):
+        opts = self.build(["-XX:+UseG1GC"])
+        self.assertEqual(opts[-1], "-XX:+UseG1GC")
+        self.assertTrue("-XX:+UseConcMarkSweepGC" not in opts)
+        self.assertTrue("-XX:+UseParNewGC" not in opts)
+        self.assertTrue("-XX:ParallelGCThreads=4" in opts)
+        self.assertTrue("-Xmx4096m" in opts)
+
+    def testUserOptionsLast(self):
+        opts = self.build(["-Xmx1024m", "-XX:CMSInitiatingOccupancyFraction=60"])
+        self.assertEqual(opts[-2:], ["-Xmx1024m", "-XX:CMSInitiatingOccupancyFraction=60"])
+        self.assertTrue("-Xms4096m" not in opts)
+        self.assertTrue("-XX:+AlwaysPreTouch" not in opts)
+        self.assertTrue("-XX:CMSInitiatingOccupancyFraction=75" not in opts)
+        self.assertTrue("-XX:+UseConcMarkSweepGC" in opts)
+
+if __name__ == "__main__":
+    unittest.main()
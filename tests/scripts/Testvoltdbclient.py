@@ -38,6 +38,8 @@ import struct
 import subprocess
 import time
 import array
+import os
+import tempfile
 
 from voltdbclient import *
 
@@ -234,6 +236,90 @@ class TestFastSerializer(unittest.TestCase):
         result.readFromSerializer()
         self.assertEqual(result, table)
 
+class TestVoltProcedure(unittest.TestCase):
+    """Invocation messages, built without a server."""
+
+    def setUp(self):
+        self.fs = FastSerializer(None, None)
+        self.path = tempfile.mktemp()
+        f = open(self.path, "wb")
+        f.write("catalog" * 1000)
+        f.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def readMessage(self, message):
+        """Returns the name, handle and parameter bytes of a message."""
+        (length,) = struct.unpack(">i", message[:4])
+        self.assertEqual(length, len(message) - 4)
+        (namelen,) = struct.unpack(">i", message[5:9])
+        name = message[9:9 + namelen]
+        (handle,) = struct.unpack(">q", message[9 + namelen:17 + namelen])
+        return (name, handle, message[17 + namelen:])
+
+    def testSerialize(self):
+        proc = VoltProcedure(self.fs, "@AdHoc", [FastSerializer.VOLTTYPE_STRING])
+        message = proc.serialize([u"select * from t"], 42)
+        (name, handle, params) = self.readMessage(message)
+        self.assertEqual(name, "@AdHoc")
+        self.assertEqual(handle, 42)
+        self.assertEqual(params, struct.pack(">hbi", 1, FastSerializer.VOLTTYPE_STRING, 15)
+                         + "select * from t")
+        self.assertEqual(self.fs.size(), 0)
+
+    def testSerializeMatchesWrite(self):
+        proc = VoltProcedure(self.fs, "Insert", [FastSerializer.VOLTTYPE_INTEGER,
+                                                 FastSerializer.VOLTTYPE_STRING])
+        proc.write([7, u"ça"], 3)
+        written = self.fs.wbuf.tostring()
+        self.fs.wbuf = array.array('c')
+        self.assertEqual(proc.serialize([7, u"ça"], 3), written)
+
+    def testSerializeFailureResetsBuffer(self):
+        proc = VoltProcedure(self.fs, "Insert", [FastSerializer.VOLTTYPE_TINYINT])
+        self.assertRaises(struct.error, proc.serialize, [1000], 1)
+        self.assertEqual(self.fs.size(), 0)
+
+    def testSerializeVarbinaryFile(self):
+        proc = VoltProcedure(self.fs, "@UpdateApplicationCatalog",
+                             [FastSerializer.VOLTTYPE_VARBINARY, FastSerializer.VOLTTYPE_STRING])
+        message = proc.serialize([VoltVarbinaryFile(self.path), None], 1)
+        (name, handle, params) = self.readMessage(message)
+        self.assertEqual(params,
+                         struct.pack(">hbi", 2, FastSerializer.VOLTTYPE_VARBINARY, 7000)
+                         + "catalog" * 1000
+                         + struct.pack(">bi", FastSerializer.VOLTTYPE_STRING, -1))
+        self.assertEqual(self.fs.wfiles, [])
+
+    def testFlushVarbinaryFile(self):
+        (ours, theirs) = socket.socketpair()
+        dump_path = tempfile.mktemp()
+        try:
+            self.fs = FastSerializer(None, None, dump_file_path = dump_path)
+            self.fs.socket = ours
+            proc = VoltProcedure(self.fs, "@UpdateApplicationCatalog",
+                                 [FastSerializer.VOLTTYPE_VARBINARY])
+            expected = proc.serialize([VoltVarbinaryFile(self.path)], 1)
+            proc.write([VoltVarbinaryFile(self.path)], 1)
+            self.assertEqual(self.fs.size(), len(expected))
+            self.fs.flush()
+            ours.close()
+            received = []
+            while True:
+                data = theirs.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+            self.assertEqual("".join(received), expected)
+            self.fs.dump_file.close()
+            f = open(dump_path, "rb")
+            self.assertEqual(f.read(), expected + "\n")
+            f.close()
+        finally:
+            theirs.close()
+            os.remove(dump_path)
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         sys.exit(-1)
@@ -54,66 +54,85 @@ __NULL = {VOLTTYPE_TINYINT: -128,
 
 RELIABLE_DECIMAL_DIGITS = 12
 
-def normalize_value(v, vtype):
+def get_value_normalizer(vtype):
+    """Returns the function that normalizes the values of a column type, so
+    the type is checked once per column rather than once per value.
+    """
     global __NULL
-    if v == None:
+    null = __NULL.get(vtype)
+    log10 = math.log10
+    floor = math.floor
+    def round_float(v):
+        if v != 0.0:
+            # round to the desired number of decimal places -- including any digits before the decimal
+            return round(v, RELIABLE_DECIMAL_DIGITS - 1 - int(floor(log10(abs(v)))))
         return v
-    if vtype in __NULL and v == __NULL[vtype]:
-        return None
-    elif vtype == VOLTTYPE_BIGINT:
+    if vtype == VOLTTYPE_BIGINT:
         # Adapt (with rounding?) to the way HSQL returns some BIGINT results as floats
-        ### print "DEBUG in fuzzynormalizer's normalize_value, v was " , v , " of type " , type(v)
-        v = float(v)
-        ### print "DEBUG in fuzzynormalizer's normalize_value, v now " , v
-        vtype = VOLTTYPE_FLOAT
+        def normalize_bigint(v):
+            if v is None or v == null:
+                return None
+            return round_float(float(v))
+        return normalize_bigint
     elif vtype == VOLTTYPE_DECIMAL:
         # Adapt (with rounding?) to the way HSQL returns some DECIMAL results
-        ### print "DEBUG in fuzzynormalizer's normalize_value, v was " , v , " of type " , type(v)
-        v = float(str(v))
-        ### print "DEBUG in fuzzynormalizer's normalize_value, v now " , v
-        vtype = VOLTTYPE_FLOAT
-    if vtype == VOLTTYPE_FLOAT:
-        if v != 0.0:
-            # round to the desired number of decimal places -- including any digits before the decimal
-            decimal_places = RELIABLE_DECIMAL_DIGITS - 1 - int(math.floor(math.log10(abs(v))))
-            ### print "DEBUG in fuzzynormalizer's normalize_value, v finally " , round(v, decimal_places) , \
-            ###        " of type " , type(round(v, decimal_places))
-            return round(v, decimal_places)
-    return v
+        def normalize_decimal(v):
+            if v is None:
+                return None
+            return round_float(float(str(v)))
+        return normalize_decimal
+    elif vtype == VOLTTYPE_FLOAT:
+        def normalize_float(v):
+            if v is None or v == null:
+                return None
+            return round_float(v)
+        return normalize_float
+    elif vtype in __NULL:
+        def normalize_other(v):
+            if v == null:
+                return None
+            return v
+        return normalize_other
+    else:
+        return None
 
 def normalize_values(tuples, columns):
-    # 'c' here is a voltdbclient.VoltColumn and
-    # I assume t is a voltdbclient.VoltTable.
-    if hasattr(tuples, "__iter__"):
-        for i in xrange(len(tuples)):
-            if hasattr(tuples[i], "__iter__"):
-                normalize_values(tuples[i], columns)
-            else:
-                tuples[i] = normalize_value(tuples[i], columns[i].type)
+    """Normalizes the rows of a table in place, one column at a time.
+    """
+    for i in xrange(len(columns)):
+        normalize_value = get_value_normalizer(columns[i].type)
+        if normalize_value is None:
+            continue
+        for row in tuples:
+            row[i] = normalize_value(row[i])
 
 def filter_sorted(row, sorted_cols):
     """Extract the values in the ORDER BY columns from a row.
     """
 
-    ret = []
+    return [row[i] for i in sorted_cols]
 
-    if not sorted_cols:
-        return ret
-
-    for i in sorted_cols:
-        ret.append(row[i])
-
-    return ret
+def get_row_key(key_cols):
+    """Returns the function that builds the sort key of a row from the values
+    in the key columns, ordering None before any other value.
+    """
+    return lambda row: tuple([(row[i] is not None, row[i]) for i in key_cols])
 
-def extract_key(sorted_cols, row):
-    """Extract the values in the non-ORDERBY columns from a row.
+def sort_range(l, begin, end, row_key):
+    """Sorts l[begin:end] on their keys, unless the rows are already in order.
+    Each row's key is built once.
     """
 
-    k = []
-    for i in xrange(len(row)):
-        if i not in sorted_cols:
-            k.append(row[i])
-    return k
+    if end - begin < 2:
+        return
+    keys = map(row_key, l[begin:end])
+    for i in xrange(1, len(keys)):
+        if keys[i] < keys[i - 1]:
+            break
+    else:
+        return
+    order = sorted(xrange(len(keys)), key=keys.__getitem__)
+    l[begin:end] = [l[begin + i] for i in order]
 
 def sort(l, sorted_cols):
     """Two steps:
@@ -123,25 +142,24 @@ def sort(l, sorted_cols):
         2. sort them on the rest of the columns.
     """
 
-    begin = 0
-    end = 0                     # exclusive
-    prev = None
-    key = lambda x: extract_key(sorted_cols, x)
-
-    for i in xrange(len(l)):
-        if not sorted_cols:
-            l[:] = sorted(l, cmp=cmp, key=key)
-            return
+    if not l:
+        return
+    key_cols = [i for i in xrange(len(l[0])) if i not in sorted_cols]
+    row_key = get_row_key(key_cols)
+    if not sorted_cols:
+        sort_range(l, 0, len(l), row_key)
+        return
 
+    begin = 0
+    prev = filter_sorted(l[0], sorted_cols)
+    for i in xrange(1, len(l)):
         tmp = filter_sorted(l[i], sorted_cols)
         if prev != tmp:
-            if prev is not None:
-                end = i
-                l[begin:end] = sorted(l[begin:end], cmp=cmp, key=key)
+            sort_range(l, begin, i, row_key)
             prev = tmp
             begin = i
 
-    l[begin:] = sorted(l[begin:], cmp=cmp, key=key)
+    sort_range(l, begin, len(l), row_key)
 
 def parse_sql(x):
     """Finds if the SQL statement contains ORDER BY command.
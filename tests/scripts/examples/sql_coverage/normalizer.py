@@ -36,16 +36,6 @@ from voltdbclient import FastSerializer
 
 from SQLCoverageReport import generate_html_reports
 
-# the compare function which can handle None
-def mycmp(x, y):
-    if x is None:
-        if y is None:
-            return 0
-        return -1
-    if y is None:
-        return 1
-    return cmp(x, y)
-
 # lame, but it matches at least up to 6 ORDER BY columns
 __EXPR = re.compile(r"ORDER BY\s(\w+\.(?P<column_1>\w+)(\s+\w+)?)"
                     r"(,\s+\w+\.(?P<column_2>\w+)(\s+\w+)?)?"
@@ -65,63 +55,99 @@ __NULL = {FastSerializer.VOLTTYPE_TINYINT: FastSerializer.NULL_TINYINT_INDICATOR
 
 SIGNIFICANT_DIGITS = 12
 
-def normalize_value(v, vtype):
+def get_value_normalizer(vtype):
+    """Returns the function that normalizes the values of a column type, so
+    the type is checked once per column rather than once per value.
+    """
     global __NULL
-    if not v:
-        return None
-    if vtype in __NULL and v == __NULL[vtype]:
-        return None
-    elif vtype == FastSerializer.VOLTTYPE_FLOAT:
-        # round to the desired number of decimal places -- accounting for significant digits before the decimal
-        decimal_places = SIGNIFICANT_DIGITS
-        abs_v = abs(float(v))
-        if abs_v >= 1.0:
-            # round to the total number of significant digits, including the integer part
-            decimal_places = SIGNIFICANT_DIGITS - 1 - int(math.floor(math.log10(abs_v)))
-        # print "DEBUG normalized float:(", round(v, decimal_places), ")"
-        return round(v, decimal_places)
+    if vtype == FastSerializer.VOLTTYPE_FLOAT:
+        null = __NULL[vtype]
+        log10 = math.log10
+        floor = math.floor
+        def normalize_float(v):
+            if not v or v == null:
+                return None
+            # round to the desired number of decimal places -- accounting for significant digits before the decimal
+            abs_v = abs(float(v))
+            if abs_v >= 1.0:
+                # round to the total number of significant digits, including the integer part
+                return round(v, SIGNIFICANT_DIGITS - 1 - int(floor(log10(abs_v))))
+            return round(v, SIGNIFICANT_DIGITS)
+        return normalize_float
     elif vtype == FastSerializer.VOLTTYPE_DECIMAL:
-        # print "DEBUG normalized_to:(", decimal.Decimal(v)._rescale(-12, "ROUND_HALF_EVEN"), ")"
-        return decimal.Decimal(v)._rescale(-12, "ROUND_HALF_EVEN")
+        Decimal = decimal.Decimal
+        def normalize_decimal(v):
+            if not v:
+                return None
+            if v.__class__ is not Decimal:
+                v = Decimal(v)
+            return v._rescale(-12, "ROUND_HALF_EVEN")
+        return normalize_decimal
+    elif vtype in __NULL:
+        null = __NULL[vtype]
+        def normalize_other(v):
+            if not v or v == null:
+                return None
+            return v
+        return normalize_other
     else:
-        # print "DEBUG normalized pass-through:(", v, ")"
-        return v
+        return lambda v: v or None
 
 def normalize_values(tuples, columns):
-    # 'c' here is a voltdbclient.VoltColumn and
-    # I assume t is a voltdbclient.VoltTable.
-    if hasattr(tuples, "__iter__"):
-        for i in xrange(len(tuples)):
-            if hasattr(tuples[i], "__iter__"):
-                normalize_values(tuples[i], columns)
-            else:
-                tuples[i] = normalize_value(tuples[i], columns[i].type)
+    """Normalizes the rows of a table in place, one column at a time.
+    """
+    for i in xrange(len(columns)):
+        normalize_value = get_value_normalizer(columns[i].type)
+        for row in tuples:
+            row[i] = normalize_value(row[i])
 
 def filter_sorted(row, sorted_cols):
     """Extract the values in the ORDER BY columns from a row.
     """
 
-    ret = []
-
-    if not sorted_cols:
-        return ret
-
-    for i in sorted_cols:
-        ret.append(row[i])
+    return [row[i] for i in sorted_cols]
 
-    return ret
-
-def extract_key(sorted_cols, row):
-    """Extract the values in the non-ORDERBY columns from a row.
+def decimal_key(v):
+    """Orders normalized DECIMAL values, which all have 12 decimal places, by
+    their digits as an integer. Comparing Decimals is much slower.
+    """
+    digits = int(v._int)
+    if v._sign:
+        return -digits
+    return digits
+
+def get_row_key(key_cols, decimal_cols):
+    """Returns the function that builds the sort key of a row from the values
+    in the key columns, ordering None before any other value.
+    """
+    decimal_positions = [p for (p, i) in enumerate(key_cols) if i in decimal_cols]
+    if not decimal_positions:
+        return lambda row: tuple([(row[i] is not None, row[i]) for i in key_cols])
+    def row_key(row):
+        values = [row[i] for i in key_cols]
+        for p in decimal_positions:
+            if values[p] is not None:
+                values[p] = decimal_key(values[p])
+        return tuple([(v is not None, v) for v in values])
+    return row_key
+
+def sort_range(l, begin, end, row_key):
+    """Sorts l[begin:end] on their keys, unless the rows are already in order.
+    Each row's key is built once.
     """
 
-    k = []
-    for i in xrange(len(row)):
-        if i not in sorted_cols:
-            k.append(row[i])
-    return k
+    if end - begin < 2:
+        return
+    keys = map(row_key, l[begin:end])
+    for i in xrange(1, len(keys)):
+        if keys[i] < keys[i - 1]:
+            break
+    else:
+        return
+    order = sorted(xrange(len(keys)), key=keys.__getitem__)
+    l[begin:end] = [l[begin + i] for i in order]
 
-def sort(l, sorted_cols):
+def sort(l, sorted_cols, decimal_cols=()):
     """Two steps:
 
         1. find the subset of rows which have the same values in the ORDER BY
@@ -129,25 +155,24 @@ def sort(l, sorted_cols):
         2. sort them on the rest of the columns.
     """
 
-    begin = 0
-    end = 0                     # exclusive
-    prev = None
-    key = lambda x: extract_key(sorted_cols, x)
-
-    for i in xrange(len(l)):
-        if not sorted_cols:
-            l[:] = sorted(l, cmp=mycmp, key=key)
-            return
+    if not l:
+        return
+    key_cols = [i for i in xrange(len(l[0])) if i not in sorted_cols]
+    row_key = get_row_key(key_cols, decimal_cols)
+    if not sorted_cols:
+        sort_range(l, 0, len(l), row_key)
+        return
 
+    begin = 0
+    prev = filter_sorted(l[0], sorted_cols)
+    for i in xrange(1, len(l)):
         tmp = filter_sorted(l[i], sorted_cols)
         if prev != tmp:
-            if prev is not None:
-                end = i
-                l[begin:end] = sorted(l[begin:end], cmp=mycmp, key=key)
+            sort_range(l, begin, i, row_key)
             prev = tmp
             begin = i
 
-    l[begin:] = sorted(l[begin:], cmp=mycmp, key=key)
+    sort_range(l, begin, len(l), row_key)
 
 def parse_sql(x):
     """Finds if the SQL statement contains ORDER BY command.
@@ -168,15 +193,17 @@ def normalize(table, sql):
 
     sort_cols = parse_sql(sql)
     indices = []
-    if sort_cols:
-        for i in xrange(len(table.columns)):
-            if table.columns[i].name in sort_cols:
-                indices.append(i)
+    decimal_cols = []
+    for i in xrange(len(table.columns)):
+        if sort_cols and table.columns[i].name in sort_cols:
+            indices.append(i)
+        if table.columns[i].type == FastSerializer.VOLTTYPE_DECIMAL:
+            decimal_cols.append(i)
 
     # Make sure if there is an ORDER BY clause, the order by columns appear in
     # the result table. Otherwise all the columns will be sorted by the
     # normalizer.
-    sort(table.tuples, indices)
+    sort(table.tuples, indices, decimal_cols)
 
     return table
 
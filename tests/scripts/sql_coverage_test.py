@@ -30,19 +30,31 @@ sys.path.append('../../lib/python')
 import random
 import time
 import subprocess
-import cPickle
+import multiprocessing
+import Queue
+import traceback
 import os.path
 import imp
 import re
+import hashlib
+import shelve
 from voltdbclient import *
 from optparse import OptionParser
 from Query import VoltQueryClient
 from SQLCoverageReport import generate_summary
+from SQLCoverageStore import StoreReader, StoreWriter, \
+    decode_statement, encode_statement, encode_result
 from SQLGenerator import SQLGenerator
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
 from subprocess import call # invoke unix/linux cmds
 from XMLUtils import prettify # To create a human readable xml file
+from collections import deque
+
+# Number of @AdHoc invocations sent ahead of reading their responses, and the
+# seconds to wait for a response before the oldest statement is timed out
+adhoc_window = 100
+adhoc_timeout = 5.0
 
 class Config:
     def __init__(self, filename):
@@ -103,7 +115,192 @@ def print_elapsed_seconds(message_end="", prev_time=-1,
     print_seconds(diff_time, message_end, message_begin)
     return diff_time
 
-def run_once(name, command, statements_path, results_path, submit_verbosely, testConfigKit):
+def start_process(function, *args):
+    """Starts a child process running function(*args), and returns the
+    process and a queue that receives the function's result and the
+    elapsed seconds when it is done. Get them with finish_process().
+    """
+    queue = multiprocessing.Queue()
+    def run():
+        start = time.time()
+        (result, seconds) = (None, 0)
+        try:
+            result = function(*args)
+            seconds = time.time() - start
+        except SystemExit:
+            pass
+        except:
+            traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        queue.put((result, seconds))
+    process = multiprocessing.Process(target=run)
+    process.start()
+    return (process, queue)
+
+def finish_process(started):
+    """Waits for a process from start_process(), and returns the result and
+    elapsed seconds of its function, or None and 0 if it failed.
+    """
+    (process, queue) = started
+    (result, seconds) = (None, 0)
+    while True:
+        # Checked before waiting, so a process that is gone and sent nothing
+        # by the end of the wait never will, e.g. if it was killed
+        alive = process.is_alive()
+        try:
+            (result, seconds) = queue.get(timeout=1)
+            break
+        except Queue.Empty:
+            if not alive:
+                print >> sys.stderr, "Process %d exited with %s without a result" % \
+                    (process.pid, process.exitcode)
+                break
+        except (IOError, EOFError):
+            break
+    process.join()
+    return (result, seconds)
+
+def get_ports(slot):
+    """Returns the client ports of the JNI and HSQLDB servers of a suite run
+    in the given slot. Servers on other than the default port shift all of
+    their ports by the same amount (see SimpleServer), so each slot gets
+    two port_offset apart.
+    """
+    return (defaultPort + port_offset * 2 * slot,
+            defaultPort + port_offset * (2 * slot + 1))
+
+def get_result(response, sql):
+    table = None
+    if response.tables:
+        ### print "DEBUG: got table(s) from ", sql ,"."
+        table = normalize(response.tables[0], sql)
+        if len(response.tables) > 1:
+            print "WARNING: ignoring extra table(s) from result of query ?", sql ,"?"
+    # else:
+        # print "WARNING: returned no table(s) from ?", sql ,"?"
+    return {"Status": response.status,
+            "Info": response.statusString,
+            "Result": table,
+            "Exception": str(response.exception)}
+
+class ResultCache:
+    """ HSQLDB results of earlier runs, replayed instead of being run again.
+    Each result is keyed by a hash of the DDL, the normalizer, the server
+    command, the statement and every earlier statement that may have changed
+    the data, so it is only replayed where HSQLDB would return the same.
+    """
+    def __init__(self, cache_dir, suite_name, config, command):
+        self.path = os.path.join(cache_dir, suite_name)
+        digest = hashlib.sha1(command)
+        for key in ("ddl", "normalizer"):
+            if key in config:
+                f = open(config[key], "rb")
+                digest.update(f.read())
+                f.close()
+        self.base = digest.digest()
+        self.results = None
+
+    def open(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.results = shelve.open(self.path, protocol = 2)
+
+    def close(self):
+        self.results.close()
+
+    def get_plan(self, statements):
+        """ Returns the key of each statement, and whether it has to be sent to
+        the server: its result isn't cached, or it may change the data seen
+        by a later statement whose result isn't cached.
+        """
+        keys = []
+        changes = []
+        state = self.base
+        for statement in statements:
+            sql = statement["SQL"].strip()
+            if isinstance(sql, unicode):
+                sql = sql.encode("utf-8")
+            digest = hashlib.sha1(state + sql)
+            keys.append(digest.hexdigest())
+            # Anything but a query may change the data
+            changes.append(not sql.lstrip("( ").upper().startswith("SELECT"))
+            if changes[-1]:
+                state = digest.digest()
+        send = [False] * len(keys)
+        needed = False
+        for i in xrange(len(keys) - 1, -1, -1):
+            if keys[i] not in self.results:
+                send[i] = needed = True
+            elif needed and changes[i]:
+                send[i] = True
+        return zip(keys, send)
+
+def run_statements(name, client, statements, write_result, submit_verbosely):
+    """ Submits the statements to the backend as @AdHoc invocations, keeping
+    up to adhoc_window of them in flight, and passes their ids and results
+    to write_result in statement order as they complete, along with False
+    for results made up on the client side, i.e. timeouts. Returns False if
+    the backend failed, in which case the results stop at the last statement
+    before the failure.
+    """
+    fs = client.fs
+    fs.socket.settimeout(adhoc_timeout)
+    pending = {}     # statement id -> SQL awaiting a response
+    results = {}     # statement id -> result received out of order
+    order = deque()  # statement ids in submission order
+    timed_out = set()
+
+    def receive():
+        try:
+            response = VoltResponse(fs)
+        except socket.timeout:
+            # Time out the oldest statement, as a blocking call would have
+            response = VoltResponse(None)
+            response.statusString = "timeout: procedure call took longer than %d seconds" % adhoc_timeout
+            response.clientHandle = order[0]
+            timed_out.add(order[0])
+        # A late response to a timed out statement has no pending entry
+        sql = pending.pop(response.clientHandle, None)
+        if sql is not None:
+            results[response.clientHandle] = get_result(response, sql)
+        while order and order[0] in results:
+            statement_id = order.popleft()
+            write_result(statement_id, results.pop(statement_id),
+                         statement_id not in timed_out)
+
+    for statement in statements:
+        try:
+            if submit_verbosely:
+                print "Submitting to backend " + name + " adhoc " + statement["SQL"]
+            # Stripped, as the client's adhoc command sent it
+            message = client.adhoc.serialize([statement["SQL"].strip()], statement["id"])
+        except:
+            print >> sys.stderr, "Error occurred while executing '%s': %s" % \
+                (statement["SQL"], sys.exc_info()[1])
+            return False
+        try:
+            fs.socket.sendall(message)
+            pending[statement["id"]] = statement["SQL"]
+            order.append(statement["id"])
+            while len(pending) >= adhoc_window:
+                receive()
+        except IOError:
+            print >> sys.stderr, "Lost the connection (server crash?) while executing statement '%s': %s" % \
+                (statement["SQL"], sys.exc_info()[1])
+            return False
+
+    try:
+        while pending:
+            receive()
+    except IOError:
+        print >> sys.stderr, "Lost the connection (server crash?) before the results of %d statement(s): %s" % \
+            (len(pending), sys.exc_info()[1])
+        return False
+    return True
+
+def run_once(name, command, statements_path, results_path, submit_verbosely, testConfigKit,
+             port=None, cache=None):
 
     print "Running \"run_once\":"
     print "  name: %s" % (name)
@@ -113,7 +310,8 @@ def run_once(name, command, statements_path, results_path, submit_verbosely, tes
     sys.stdout.flush()
 
     host = defaultHost
-    port = defaultPort
+    if port == None:
+        port = defaultPort
     if(name == "jni"):
         akey = "hostname"
         if akey in testConfigKit:
@@ -121,7 +319,41 @@ def run_once(name, command, statements_path, results_path, submit_verbosely, tes
             port = testConfigKit["hostport"]
 
     global normalize
+    results_file = StoreWriter(results_path, encode_result)
+    statements_file = StoreReader(statements_path, decode_statement)
+    statements = iter(statements_file)
+    def write_result(statement_id, result, from_server):
+        results_file.write(result)
+    if cache != None:
+        # Statement ids are their positions in the statements file
+        cache.open()
+        plan = cache.get_plan(statements_file)
+        sent = [statement_id for (statement_id, (key, send)) in enumerate(plan) if send]
+        print "Replaying %d cached results, running %d statements" % \
+            (len(plan) - len(sent), len(sent))
+        statements = (statement for statement in statements if plan[statement["id"]][1])
+        written = [0]
+        def replay(end):
+            for (key, send) in plan[written[0]:end]:
+                results_file.write(cache.results[key])
+            written[0] = end
+        def write_result(statement_id, result, from_server):
+            replay(statement_id)
+            # A timeout says nothing about what HSQLDB would return
+            if from_server:
+                cache.results[plan[statement_id][0]] = result
+            results_file.write(result)
+            written[0] = statement_id + 1
+        if not sent:
+            replay(len(plan))
+            cache.close()
+            results_file.close()
+            statements_file.close()
+            return 0
+
     if(host == defaultHost):
+        if port != defaultPort:
+            command += " port=%d" % (port)
         server = subprocess.Popen(command + " backend=" + name, shell = True)
 
     client = None
@@ -129,7 +361,7 @@ def run_once(name, command, statements_path, results_path, submit_verbosely, tes
         try:
             client = VoltQueryClient(host, port)
             client.set_quiet(True)
-            client.set_timeout(5.0) # 5 seconds
+            client.set_timeout(adhoc_timeout)
             break
         except socket.error:
             time.sleep(1)
@@ -145,52 +377,19 @@ def run_once(name, command, statements_path, results_path, submit_verbosely, tes
         # Flush database
         client.onecmd("updatecatalog " + testConfigKit["testCatalog"]  + " " + testConfigKit["deploymentFile"])
 
-    statements_file = open(statements_path, "rb")
-    results_file = open(results_path, "wb")
-    while True:
-        try:
-            statement = cPickle.load(statements_file)
-        except EOFError:
-            break
-
-        try:
-            if submit_verbosely:
-                print "Submitting to backend " + name + " adhoc " + statement["SQL"]
-            client.onecmd("adhoc " + statement["SQL"])
-        except:
-            print >> sys.stderr, "Error occurred while executing '%s': %s" % \
-                (statement["SQL"], sys.exc_info()[1])
-            if(host == defaultHost):
-                # Should kill the server now
-                killer = subprocess.Popen("kill -9 %d" % (server.pid), shell = True)
-                killer.communicate()
-                if killer.returncode != 0:
-                    print >> sys.stderr, \
-                        "Failed to kill the server process %d" % (server.pid)
-            break
-        table = None
-        if client.response == None:
-            print >> sys.stderr, "No error, but an unexpected null client response (server crash?) from executing statement '%s': %s" % \
-                (statement["SQL"], sys.exc_info()[1])
-            if(host == defaultHost):
-                killer = subprocess.Popen("kill -9 %d" % (server.pid), shell = True)
-                killer.communicate()
-                if killer.returncode != 0:
-                    print >> sys.stderr, \
-                        "Failed to kill the server process %d" % (server.pid)
-            break
-        if client.response.tables:
-            ### print "DEBUG: got table(s) from ", statement["SQL"] ,"."
-            table = normalize(client.response.tables[0], statement["SQL"])
-            if len(client.response.tables) > 1:
-                print "WARNING: ignoring extra table(s) from result of query ?", statement["SQL"] ,"?"
-        # else:
-            # print "WARNING: returned no table(s) from ?", statement["SQL"] ,"?"
-        cPickle.dump({"Status": client.response.status,
-                      "Info": client.response.statusString,
-                      "Result": table,
-                      "Exception": str(client.response.exception)},
-                     results_file)
+    if run_statements(name, client, statements, write_result, submit_verbosely):
+        if cache != None:
+            # The statements after the last one sent
+            replay(len(plan))
+    elif(host == defaultHost):
+        # Should kill the server now
+        killer = subprocess.Popen("kill -9 %d" % (server.pid), shell = True)
+        killer.communicate()
+        if killer.returncode != 0:
+            print >> sys.stderr, \
+                "Failed to kill the server process %d" % (server.pid)
+    if cache != None:
+        cache.close()
     results_file.close()
     statements_file.close()
 
@@ -209,7 +408,7 @@ def run_once(name, command, statements_path, results_path, submit_verbosely, tes
         return 0
 
 def run_config(suite_name, config, basedir, output_dir, random_seed, report_all, generate_only,
-    subversion_generation, submit_verbosely, args, testConfigKit):
+    subversion_generation, submit_verbosely, args, testConfigKit, slot=0):
 
     # Store the current, initial system time (in seconds since January 1, 1970)
     time0 = time.time()
@@ -243,9 +442,9 @@ def run_config(suite_name, config, basedir, output_dir, random_seed, report_all,
     generator = SQLGenerator(config["schema"], template, subversion_generation)
     counter = 0
 
-    statements_file = open(statements_path, "wb")
+    statements_file = StoreWriter(statements_path, encode_statement)
     for i in generator.generate():
-        cPickle.dump({"id": counter, "SQL": i}, statements_file)
+        statements_file.write({"id": counter, "SQL": i})
         counter += 1
     statements_file.close()
 
@@ -259,26 +458,43 @@ def run_config(suite_name, config, basedir, output_dir, random_seed, report_all,
     global gensql_time
     gensql_time += print_elapsed_seconds("for generating statements (" + suite_name + ")", time0)
 
-    if run_once("jni", command, statements_path, jni_path, submit_verbosely, testConfigKit) != 0:
+    # The two backends are independent, so run them at the same time on
+    # their own ports, each writing its own results file.
+    (jni_port, hsql_port) = get_ports(slot)
+    jni = start_process(run_once, "jni", command, statements_path, jni_path,
+                        submit_verbosely, testConfigKit, jni_port)
+
+    random.seed(random_seed)
+    random.setstate(random_state)
+
+    cache = None
+    if cache_dir != None:
+        cache = ResultCache(cache_dir, suite_name, config, command)
+    hsql = start_process(run_once, "hsqldb", command, statements_path, hsql_path,
+                         submit_verbosely, testConfigKit, hsql_port, cache)
+    (jni_status, jni_seconds) = finish_process(jni)
+    (hsql_status, hsql_seconds) = finish_process(hsql)
+
+    if jni_status != 0:
         print >> sys.stderr, "Test with the JNI backend had errors."
         print >> sys.stderr, "  jni_path: %s" % (jni_path)
         sys.stderr.flush()
         exit(1)
 
-    # Print the elapsed time, with a message
-    global voltdb_time
-    voltdb_time += print_elapsed_seconds("for running VoltDB (JNI) statements (" + suite_name + ")")
-
-    random.seed(random_seed)
-    random.setstate(random_state)
-
-    if run_once("hsqldb", command, statements_path, hsql_path, submit_verbosely, testConfigKit) != 0:
+    if hsql_status != 0:
         print >> sys.stderr, "Test with the HSQLDB backend had errors."
         exit(1)
 
-    # Print the elapsed time, with a message
+    # Print the elapsed times, with a message
+    global voltdb_time
     global hsqldb_time
-    hsqldb_time += print_elapsed_seconds("for running HSqlDB statements (" + suite_name + ")")
+    print_seconds(jni_seconds, "for running VoltDB (JNI) statements (" + suite_name + ")",
+                  "Backend time: ")
+    voltdb_time += jni_seconds
+    print_seconds(hsql_seconds, "for running HSqlDB statements (" + suite_name + ")",
+                  "Backend time: ")
+    hsqldb_time += hsql_seconds
+    print_elapsed_seconds("for running both backends concurrently (" + suite_name + ")")
 
     global compare_results
     compare_results = imp.load_source("normalizer", config["normalizer"]).compare_results
@@ -292,6 +508,21 @@ def run_config(suite_name, config, basedir, output_dir, random_seed, report_all,
 
     return success
 
+def run_suite(config_name, config, basedir, report_dir, random_seed, report_all, generate_only,
+              subversion_generation, submit_verbosely, args, testConfigKit, slot):
+    """Runs one suite in a child process (see start_process), and returns
+    its result along with the times it added to the totals. Suites finish
+    in any order, so they can't share one random sequence; each one's
+    statements are generated from the seed and the suite name.
+    """
+    random.seed("%d %s" % (random_seed, config_name))
+    global gensql_time, voltdb_time, hsqldb_time, compar_time
+    gensql_time = voltdb_time = hsqldb_time = compar_time = 0.0
+    result = run_config(config_name, config, basedir, report_dir, random_seed, report_all,
+                        generate_only, subversion_generation, submit_verbosely, args,
+                        testConfigKit, slot)
+    return (result, (gensql_time, voltdb_time, hsqldb_time, compar_time))
+
 def get_voltcompiler(basedir):
     key = "voltdb"
     (head, tail) = basedir.split(key)
@@ -477,6 +708,12 @@ if __name__ == "__main__":
     parser.add_option("-g", "--generate-only", action="store_true",
                       dest="generate_only", default=False,
                       help="only generate and report SQL statements, do not start any database servers")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="the number of suites to run concurrently, each with its own servers; "
+                      "each suite's statements are then generated from the seed and its name")
+    parser.add_option("-C", "--cache-dir", dest="cache_dir", default=None,
+                      help="directory of HSQLDB results cached across runs; only the statements "
+                      "whose results can't be replayed from it are run against HSQLDB")
     (options, args) = parser.parse_args()
 
     if options.seed == None:
@@ -512,6 +749,11 @@ if __name__ == "__main__":
     testConfigKits = {}
     defaultHost = "localhost"
     defaultPort = 21212
+    # Distance between the client ports of servers running at the same time
+    port_offset = 100
+    cache_dir = options.cache_dir
+    if cache_dir != None:
+        cache_dir = os.path.abspath(cache_dir)
     if(options.hostname != None and options.hostname != defaultHost):
         # To set a dictionary with following 4 keys:
         # testConfigKits["voltcompiler"]
@@ -522,24 +764,62 @@ if __name__ == "__main__":
 
     success = True
     statistics = {}
-    for config_name in configs_to_run:
-        print >> sys.stderr, "\nSQLCOVERAGE: STARTING ON CONFIG: %s\n" % config_name
-        report_dir = output_dir + '/' + config_name
-        config = config_list.get_config(config_name)
-        if(options.hostname != None and options.hostname != defaultHost):
-            testDDL = basedir + "/" + config['ddl']
-            testProjectFile = create_projectFile(testDDL, 'test')
-            testCatalog = create_catalogFile(testConfigKits['voltcompiler'], testProjectFile, 'test')
-            # To add one more key
-            testConfigKits["testCatalog"] = testCatalog
-        result = run_config(config_name, config, basedir, report_dir, seed, options.report_all,
-                            options.generate_only, options.subversion_generation,
-                            options.report_all, args, testConfigKits)
+    def record_result(config_name, result):
+        global success
         statistics[config_name] = result["keyStats"]
         statistics["seed"] = seed
         if result["mis"] != 0:
             success = False
 
+    # All suites share the one cluster of a remote leader.
+    if options.jobs <= 1 or testConfigKits:
+        for config_name in configs_to_run:
+            print >> sys.stderr, "\nSQLCOVERAGE: STARTING ON CONFIG: %s\n" % config_name
+            report_dir = output_dir + '/' + config_name
+            config = config_list.get_config(config_name)
+            if(options.hostname != None and options.hostname != defaultHost):
+                testDDL = basedir + "/" + config['ddl']
+                testProjectFile = create_projectFile(testDDL, 'test')
+                testCatalog = create_catalogFile(testConfigKits['voltcompiler'], testProjectFile, 'test')
+                # To add one more key
+                testConfigKits["testCatalog"] = testCatalog
+            result = run_config(config_name, config, basedir, report_dir, seed, options.report_all,
+                                options.generate_only, options.subversion_generation,
+                                options.report_all, args, testConfigKits)
+            record_result(config_name, result)
+    else:
+        # Each running suite holds a slot, which picks its servers' ports.
+        free_slots = range(options.jobs)
+        running = []
+        def finish_suite():
+            (config_name, slot, started) = running.pop(0)
+            (returned, seconds) = finish_process(started)
+            if returned == None:
+                print >> sys.stderr, "Suite %s had errors." % config_name
+                sys.exit(1)
+            (result, times) = returned
+            global gensql_time, voltdb_time, hsqldb_time, compar_time
+            gensql_time += times[0]
+            voltdb_time += times[1]
+            hsqldb_time += times[2]
+            compar_time += times[3]
+            record_result(config_name, result)
+            free_slots.append(slot)
+        for config_name in configs_to_run:
+            if not free_slots:
+                finish_suite()
+            slot = free_slots.pop(0)
+            print >> sys.stderr, "\nSQLCOVERAGE: STARTING ON CONFIG: %s\n" % config_name
+            report_dir = output_dir + '/' + config_name
+            config = config_list.get_config(config_name)
+            started = start_process(run_suite, config_name, config, basedir, report_dir, seed,
+                                    options.report_all, options.generate_only,
+                                    options.subversion_generation, options.report_all, args,
+                                    testConfigKits, slot)
+            running.append((config_name, slot, started))
+        while running:
+            finish_suite()
+
     # Write the summary
     time1 = time.time()
     generate_summary(output_dir, statistics)
@@ -10,56 +10,172 @@
 
 
 
-import copy
+import atexit
+import calendar
+from collections import namedtuple
+import cStringIO
 from datetime import datetime
 import heapq
-from optparse import OptionParser
+import json
+import mmap
+import multiprocessing
+from optparse import OptionParser, OptionValueError
 import os.path
+import Queue
 import re
+import shutil
 import sys
 import tarfile
+import tempfile
 import time
 import gzip
-import tempfile
 
 #Known timestamp formats
 # apprunner           04-18 07:14:35
 # dragent             2013-03-14 00:00:33
 # servers             2013-03-14 00:00:33,877
 # syslog              Aug  6 09:06:38
+# jvm gc log          2013-03-14T00:00:33.877+0000:
+
+def utc_offset(seconds):
+    """Return the local time offset from UTC in seconds at a time"""
+    return calendar.timegm(time.localtime(seconds)) - seconds
+
+class TimestampParser(object):
+    """Converts between fixed layout yyyy-mm-dd hh:mm:ss[,xxx] local
+    timestamps and ms since epoch. The digits are sliced out directly and
+    the epoch of each date/hour prefix is cached, with a fallback to
+    strptime/mktime wherever the shortcut could give a different result
+    (malformed timestamps, hours near a DST transition). Formatting
+    caches the prefix of each minute in the same way.
+    """
+    def __init__(self):
+        self.hours = {}
+        self.minutes = {}
+
+    def epoch_seconds(self, ts):
+        """Return seconds since epoch for yyyy-mm-dd hh:mm:ss"""
+        prefix = ts[:13]
+        hour_start = self.hours.get(prefix)
+        if hour_start is None:
+            hour_start = self.hours[prefix] = self.get_hour_start(ts)
+        if hour_start is not False and ts[13] == ':' and ts[16] == ':':
+            minutes = ts[14:16]
+            seconds = ts[17:19]
+            if minutes.isdigit() and seconds.isdigit():
+                minutes = int(minutes)
+                seconds = int(seconds)
+                if minutes < 60 and seconds < 60:
+                    return hour_start + minutes * 60 + seconds
+        return int(time.mktime(time.strptime(ts, "%Y-%m-%d %H:%M:%S")))
+
+    def get_hour_start(self, ts):
+        """Return the epoch of the start of the hour, or False if the
+        hour can't be computed by offset from its start"""
+        if len(self.hours) > 100000:
+            self.hours.clear()
+        try:
+            start = int(time.mktime(time.strptime(ts[:13] + ":00:00", "%Y-%m-%d %H:%M:%S")))
+        except ValueError:
+            return False
+        # Skip hours near a DST transition, where local times can be
+        # missing or ambiguous. Transitions are months apart, so an equal
+        # UTC offset a few hours either side means there is none.
+        if utc_offset(start - 3 * 3600) != utc_offset(start + 4 * 3600):
+            return False
+        return start
+
+    def epoch_millis(self, ts):
+        """Return ms since epoch for timestamp of format yyyy-mm-dd hh:mm:ss[,xxx]
+        """
+        if len(ts) == 19:
+            return self.epoch_seconds(ts) * 1000
+        if len(ts) > 20 and ts[19] == ',' and ts[20:].isdigit():
+            return self.epoch_seconds(ts[:19]) * 1000 + int(ts[20:])
+        split_ts = ts.split(',')
+        seconds = time.strptime(split_ts[0],"%Y-%m-%d %H:%M:%S")
+        if len(split_ts) > 1:
+            millis = int(split_ts[1])
+        else:
+            millis = 0
+        return int(time.mktime(seconds) * 1000) + int(millis)
+
+    def format_millis(self, epoch_ms):
+        """Return the local yyyy-mm-dd hh:mm:ss,xxx timestamp for ms since epoch"""
+        seconds = epoch_ms / 1000
+        minute = seconds / 60
+        prefix = self.minutes.get(minute)
+        if prefix is None:
+            if len(self.minutes) > 100000:
+                self.minutes.clear()
+            t = time.localtime(minute * 60)
+            # A minute that doesn't start at :00 local time can't be
+            # formatted from its prefix.
+            if t.tm_sec == 0 and time.localtime(minute * 60 + 59).tm_sec == 59:
+                prefix = time.strftime("%Y-%m-%d %H:%M:", t)
+            else:
+                prefix = False
+            self.minutes[minute] = prefix
+        if prefix is False:
+            return "%s,%03d" % (time.strftime("%Y-%m-%d %H:%M:%S",
+                                              time.localtime(seconds)),
+                                epoch_ms % 1000)
+        return "%s%02d,%03d" % (prefix, seconds % 60, epoch_ms % 1000)
+
+timestamp_parser = TimestampParser()
 
 def epochtimemillis_keyfunc(ts):
     """Return ms since epoch for timestamp of format yyyy-mm-dd hh:mm:ss[,xxx]
     """
-    split_ts = ts.split(',')
-    seconds = time.strptime(split_ts[0],"%Y-%m-%d %H:%M:%S")
-    if len(split_ts) > 1:
-        millis = int(split_ts[1])
-    else:
-        millis = 0
+    return timestamp_parser.epoch_millis(ts)
+
+ts_date = '\d{0,4}-?\d{2}-\d{2}'
+ts_mmm = '\w{3}'
+ts_day = '\d{1,2}'
+ts_time = '\d{2}:\d{2}:\d{2},?\d{0,3}'
 
-    return int(time.mktime(seconds) * 1000) + int(millis)
+ts_format = ts_date + '\s+' + ts_time
+ts_format_syslog = ts_mmm + '\s+' + ts_day + '\s+' + ts_time
+ts_format_gc = '\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}[+-]\d{4}:'
+
+log_re = re.compile(r'''(?P<datetime>%s|%s|%s)
+                         \s+
+                         (?P<message>.*)
+                         ''' % (ts_format, ts_format_syslog, ts_format_gc), re.VERBOSE)
+syslog_re = re.compile(ts_format_syslog)
+
+def normalize_datetime(dt, year):
+    """Return the yyyy-mm-dd hh:mm:ss[,xxx] form of a matched timestamp"""
+    #Add a year if none exists (like in apprunner.log)
+    #Note to self: make apprunner log the year.
+
+    if syslog_re.match(dt):
+       ts = time.strptime(year + ' ' + dt, "%Y %b %d %H:%M:%S")
+       dt = time.strftime("%Y-%m-%d %H:%M:%S", ts)
+
+    #GC log date stamps are ISO 8601. Drop the zone, the other formats
+    #are local time without one.
+    if dt[-1] == ':':
+        dt = dt[:10] + ' ' + dt[11:19] + ',' + dt[20:23]
+
+    if dt[4] != '-':
+        dt = year + '-' + dt
+    return dt
+
+# A merged log entry. Fields are in name order so that entries with the
+# same time sort as they did when they were dicts.
+LogRecord = namedtuple('LogRecord', 'datetime filename message newdatetime')
 
 def decorated_log_split(f, offset, keyfunc, fnamedict = {}):
     """ Generator that splits on timestamps. This returns
-    (millis-since-epoch, {"datetime":<original timestamp> ,
-                          "newdatetime":<offset timestamp>,
-                          "message": <log message>
-                          "filename":<filename>})
+    (millis-since-epoch, LogRecord(datetime=<original timestamp>,
+                                   filename=<filename>,
+                                   message=<log message>,
+                                   newdatetime=<offset timestamp>))
+    Continuation lines are collected and joined once per entry.
     """
-    ts_date = '\d{0,4}-?\d{2}-\d{2}'
-    ts_mmm = '\w{3}'
-    ts_day = '\d{1,2}'
-    ts_time = '\d{2}:\d{2}:\d{2},?\d{0,3}'
-
-    ts_format = ts_date + '\s+' + ts_time
-    ts_format_syslog = ts_mmm + '\s+' + ts_day + '\s+' + ts_time
-
-    log_re = re.compile(r'''(?P<datetime>%s|%s)
-                             \s+
-                             (?P<message>.*)
-                             ''' % (ts_format, ts_format_syslog), re.VERBOSE)
     new_epoch_ms = None
+    year = str(datetime.now().year)
 
     if f.name in fnamedict:
         fname = fnamedict[f.name]
@@ -67,41 +183,31 @@ def decorated_log_split(f, offset, keyfunc, fnamedict = {}):
         fname = os.path.basename(f.name)
     else:
         fname = ''
-    currentdict = {}
+    dt = None
+    newdt = None
+    message = None
+    line = ''
     for line in f:
         m = log_re.match(line)
         if m:
-            #When we match, spit back the accumulated currentdict
-            if currentdict:
-                yield (keyfunc(currentdict["newdatetime"]), currentdict)
-            #Then re-initialize currentdict with the new match
-            currentdict = copy.deepcopy(m.groupdict())
-            currentdict["filename"] = fname
-            #Add a year if none exists (like in apprunner.log)
-            #Note to self: make apprunner log the year.
-
-            if re.match(ts_format_syslog, currentdict["datetime"]):
-               ts = time.strptime(str(datetime.now().year) + ' ' + currentdict["datetime"], "%Y %b %d %H:%M:%S")
-               currentdict["datetime"] = time.strftime("%Y-%m-%d %H:%M:%S", ts)
-
-            if currentdict["datetime"][4] != '-':
-                currentdict["datetime"] = str(datetime.now().year) + \
-                    '-' + currentdict["datetime"]
-
-            new_epoch_ms = keyfunc(currentdict["datetime"]) + offset
-            currentdict["newdatetime"] = time_str = "%s,%03d" % \
-                (time.strftime("%Y-%m-%d %H:%M:%S",
-                               time.localtime((new_epoch_ms / 1000))),
-                 (new_epoch_ms % 1000))
+            #When we match, spit back the accumulated entry
+            if message is not None:
+                yield (keyfunc(newdt), LogRecord(dt, fname, ''.join(message), newdt))
+            #Then start the new entry with the match
+            dt = normalize_datetime(m.group('datetime'), year)
+            message = [m.group('message')]
 
-        else:
-            if "message" in currentdict:
-                currentdict["message"] += line
+            new_epoch_ms = keyfunc(dt) + offset
+            newdt = timestamp_parser.format_millis(new_epoch_ms)
+
+        elif message is not None:
+            message.append(line)
 
     if not new_epoch_ms:
         sys.stderr.write("Entry in %s had no valid timestamp" % f.name)
         sys.stderr.write("    %s" % line)
-    yield (new_epoch_ms, currentdict)
+    if message is not None:
+        yield (new_epoch_ms, LogRecord(dt, fname, ''.join(message), newdt))
 
 def exclude_callback(option, opt_str, value, parser):
     if value.lower() == "none":
@@ -125,132 +231,607 @@ def tz_offset_callback(option, opt_str, value, parser):
         raise OptionValueError(value + " is not a valid timezone offset")
 
 
-def merge_logs(files, offsets, fnamedict = {}):
-    #print options.tzoffset
-    for (epoch_ms, entry) in heapq.merge(*[decorated_log_split(f, offsets[f.name], epochtimemillis_keyfunc, fnamedict) for f in files]):
+# Records per batch sent from a worker, and batches queued per worker
+# before it waits for the merge to catch up.
+batch_size = 1000
+queued_batches = 8
+
+# Bytes of merged output buffered between writes
+output_buffer_size = 1 << 20
+
+# Megabytes of gzipped compressed archive members held in memory
+default_memory_mb = 256
+
+def open_log(f, tar = None):
+    """Return f, or a private reader for f if it is a member of the
+    LogArchive tar. Members are opened in the process that reads them,
+    each with its own handle on the archive.
+    """
+    if isinstance(f, ArchiveMember):
+        return tar.open_member(f.name)
+    return f
+
+def merge_files(files, offsets, fnamedict = {}, tar = None):
+    return heapq.merge(*[decorated_log_split(open_log(f, tar), offsets[f.name], epochtimemillis_keyfunc, fnamedict) for f in files])
+
+def merge_worker(files, offsets, fnamedict, tar, queue):
+    """Merge a group of files and send the records in batches"""
+    try:
+        batch = []
+        for record in merge_files(files, offsets, fnamedict, tar):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                queue.put(batch)
+                batch = []
+        if batch:
+            queue.put(batch)
+        queue.put(None)
+    except Exception as e:
+        queue.put("%s: %s" % (e.__class__.__name__, str(e)))
+
+def read_batches(queue, process):
+    while True:
+        try:
+            batch = queue.get(timeout=1)
+        except Queue.Empty:
+            if not process.is_alive():
+                sys.exit("Log parsing process exited unexpectedly")
+            continue
+        if batch is None:
+            return
+        if isinstance(batch, str):
+            sys.exit("Error parsing logs: " + batch)
+        for record in batch:
+            yield record
+
+def time_callback(option, opt_str, value, parser):
+    """ store a yyyy-mm-dd[ hh:mm:ss[,xxx]] time as ms since epoch"""
+    if len(value) == 10:
+        value += " 00:00:00"
+    try:
+        setattr(parser.values, option.dest, epochtimemillis_keyfunc(value))
+    except ValueError:
+        raise OptionValueError(value + " is not a valid yyyy-mm-dd hh:mm:ss[,xxx] time")
+
+
+def merge_logs(files, offsets, fnamedict = {}, jobs = 1, tar = None):
+    """Merge the files in time order. With more than one job, the files
+    are split into groups parsed and merged by worker processes, and
+    their sorted batches are merged here. Bounded queues hold back the
+    workers that are ahead of the merge.
+    """
+    jobs = min(jobs, len(files))
+    if jobs <= 1:
+        for (epoch_ms, entry) in merge_files(files, offsets, fnamedict, tar):
+            yield (epoch_ms, entry)
+        return
+    streams = []
+    for i in range(jobs):
+        group = files[len(files) * i / jobs:len(files) * (i + 1) / jobs]
+        queue = multiprocessing.Queue(queued_batches)
+        process = multiprocessing.Process(target=merge_worker,
+                                          args=(group, offsets, fnamedict, tar, queue))
+        process.daemon = True
+        process.start()
+        streams.append(read_batches(queue, process))
+    for (epoch_ms, entry) in heapq.merge(*streams):
         yield (epoch_ms, entry)
 
 
-class ApprunnerTarFile():
-    def __init__(self, f):
+def literal_prefix(pattern):
+    """Return the literal text any match of pattern starts with, or ''"""
+    if '|' in pattern:
+        return ''
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    prefix = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            c = pattern[i + 1]
+            i += 1
+        elif c in '\\.^$*+?{}[]()':
+            break
+        prefix += c
+        i += 1
+    # A following */?/{ makes the last character optional
+    if i < len(pattern) and pattern[i] in '*?{':
+        prefix = prefix[:-1]
+    return prefix
+
+
+# Capturing groups allowed in one regular expression
+max_groups = 99
+
+def compile_alternation(patterns):
+    """Return alternations that together match any of the patterns, split
+    so that none of them has more capturing groups than re allows"""
+    alternations = []
+    chunk = []
+    groups = 0
+    for p in patterns:
+        n = re.compile(p).groups
+        if chunk and groups + n > max_groups:
+            alternations.append(re.compile('|'.join('(?:%s)' % c for c in chunk)))
+            chunk = []
+            groups = 0
+        chunk.append(p)
+        groups += n
+    if chunk:
+        alternations.append(re.compile('|'.join('(?:%s)' % c for c in chunk)))
+    return alternations
+
+
+def search_any(regexes, message):
+    for p in regexes:
+        if p.search(message):
+            return True
+    return False
+
+
+class MessageMatcher():
+    """Matches messages against any of a list of patterns in one search.
+    Patterns starting with literal text are guarded by a search for those
+    prefixes alone, so messages without any of them never run the full
+    alternation. Patterns that can't share an alternation, those with
+    backreferences, named groups or inline flags, are searched one by one.
+    """
+    def __init__(self, patterns):
+        guarded = []
+        unguarded = []
+        self.standalone = []
+        for p in patterns:
+            if re.search(r'\\[1-9]|\(\?P|\(\?[iLmsux]+\)', p):
+                self.standalone.append(re.compile(p))
+            elif literal_prefix(p):
+                guarded.append(p)
+            else:
+                unguarded.append(p)
+        self.prefixes = compile_alternation(
+            sorted(set(re.escape(literal_prefix(p)) for p in guarded)))
+        self.guarded = compile_alternation(guarded)
+        self.unguarded = compile_alternation(unguarded)
+
+    def search(self, message):
+        if search_any(self.prefixes, message) and \
+                search_any(self.guarded, message):
+            return True
+        return search_any(self.unguarded, message) or \
+            search_any(self.standalone, message)
+
+
+def read_patterns(values, source):
+    patterns = [p for p in values if p]
+    for p in patterns:
+        try:
+            re.compile(p)
+        except re.error as e:
+            sys.exit("Invalid pattern '%s' in %s: %s" % (p, source, str(e)))
+    return patterns
+
+
+class LogArchive():
+    """A tar archive of logs. Members of an uncompressed archive are
+    indexed by name from their headers and read through their own handles
+    on the archive, so logs can be read side by side without seeking a
+    shared stream back and forth.
+
+    A compressed stream can't seek without decompressing from the start,
+    so a compressed archive is decompressed exactly once, in archive
+    order, as it is opened: the index is built as the members stream by,
+    the logs (is_log()) are kept gzipped, in memory up to memory_limit
+    bytes and in temporary files beyond it, and the first line of each
+    header member (is_header()) is kept. Everything else reads those.
+    """
+    def __init__(self, f, memory_limit = default_memory_mb << 20):
+        self.name = f
         self.tar = tarfile.open(f)
-        self.prefix = os.path.commonprefix(self.tar.getnames())
+        self.compressed = not isinstance(self.tar.fileobj, file)
+        self.loaded = {}
+        self.loaded_bytes = 0
+        self.memory_limit = memory_limit
+        self.spill_dir = None
+        self.first_lines = {}
+        if self.compressed:
+            self.tar.close()
+            self.tar = tarfile.open(f, 'r|*')
+            self.infos = []
+            for m in self.tar:
+                self.infos.append(m)
+                if m.isfile() and self.is_log(m.name):
+                    self.load_member(m)
+                elif m.isfile() and self.is_header(m.name):
+                    self.first_lines[m.name] = self.tar.extractfile(m).readline()
+            self.tar.close()
+        else:
+            self.infos = self.tar.getmembers()
+        self.names = [m.name for m in self.infos]
+        self.index = dict((m.name, m) for m in self.infos if m.isfile())
 
-        #validate this file is really apprunner
-        if not re.match('tmp/\S+/apprunner/\S+',
-                        os.path.commonprefix(self.tar.getnames())):
-            raise IOError(f + " isn't a valid apprunner file")
+    def is_log(self, name):
+        """Whether a member is a log that may be merged"""
+        return False
 
-    def show_files(self):
-        return self.tar.getnames()
+    def is_header(self, name):
+        """Whether only the first line of a member is read"""
+        return False
 
-    def get_serverlogs(self):
-        pat = '/serverlogs/.*-log\.txt'
-        return [f for f in self.tar.getnames() if re.search(pat,f)]
-
-    def get_otherlogs(self):
-        patterns = [
-            'apprunner.log',           #apprunner logging
-            '\.Benchmark\.(?!jstack)',           #client benchmark
-            'VoltDBReplicationAgent\.(?!jstack)',  #dragent
-            '.*SchemaChangeClient.*',
-            #'stdout.txt$',            #VEM
-            ]
-        pat = '|'.join(patterns)
-        return [f for f in self.tar.getnames() if re.search(pat,f)]
+    def find(self, pattern, match = re.search):
+        """Return the names of the files in the archive matching pattern"""
+        return [m.name for m in self.infos if m.isfile() and match(pattern, m.name)]
 
     def get_server_tzoffset(self):
-        """Gets the date 1st file in the apprunner archive
+        """Gets the date 1st file in the archive
         EDT or EST and returns the appropriate offset.
         This method will do dumb things if we run in another timezone
         and possibly when daylight savings is set/unset
         """
-        mtime = self.tar.getmember(self.tar.getnames()[0]).mtime
+        mtime = self.infos[0].mtime
         if time.localtime(mtime).tm_isdst:
             offset_hours = -4
         else:
             offset_hours = -5
         return str(offset_hours * 60 * 60 * 1000)
 
+    def load_member(self, m):
+        """Keep a member of a compressed archive as it streams by. Members
+        that are gzipped already are kept as they are, others are gzipped
+        at level 1. A member is kept in memory while it fits in
+        memory_limit, judged by its size in the archive, and is written to
+        a temporary file otherwise."""
+        src = self.tar.extractfile(m)
+        if self.loaded_bytes + m.size <= self.memory_limit:
+            data = cStringIO.StringIO()
+        else:
+            data = self.spill_file()
+        if m.name.endswith('.gz'):
+            shutil.copyfileobj(src, data, 1024 * 1024)
+        else:
+            dst = gzip.GzipFile(m.name, 'wb', 1, data)
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            dst.close()
+        if isinstance(data, file):
+            data.close()
+            self.loaded[m.name] = SpilledLog(m.name, data.name)
+        else:
+            self.loaded[m.name] = LoadedLog(m.name, data.getvalue())
+            self.loaded_bytes += len(self.loaded[m.name].data)
+
+    def spill_file(self):
+        """Return a new temporary file, removed when logmerger exits"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='logmerger-')
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+        (fd, path) = tempfile.mkstemp(suffix='.gz', dir=self.spill_dir)
+        os.close(fd)
+        return open(path, 'wb')
+
+    def open_member(self, name):
+        """Return a private reader for a member"""
+        if self.compressed:
+            return self.loaded[name]
+        return MemberLog(self.name, self.index[name])
+
+    def extract_members(self, names):
+        """Yield (name, file) for members. Members of an uncompressed
+        archive are read in archive order, those of a compressed one from
+        the copies kept when it was opened."""
+        if self.compressed:
+            for name in names:
+                yield (name, self.loaded[name].open())
+            return
+        infos = sorted([self.index[name] for name in names],
+                       key=lambda m: m.offset_data)
+        for m in infos:
+            f = self.tar.extractfile(m)
+            if m.name.endswith('.gz'):
+                f = gzip.GzipFile(fileobj=f)
+            yield (m.name, f)
+
+    def get_first_lines(self, names):
+        """Return the first line of each member by name"""
+        if self.compressed:
+            return dict((name, self.first_lines[name]) for name in names)
+        return dict((name, f.readline()) for (name, f) in self.extract_members(names))
+
+
+class MemberLog():
+    """A member of a LogArchive. Iterating opens its own handle on the
+    archive, which is closed when the iteration ends or is abandoned.
+    """
+    def __init__(self, path, info):
+        self.name = info.name
+        self.path = path
+        self.info = info
+
+    def __iter__(self):
+        tar = tarfile.open(self.path)
+        try:
+            f = tar.extractfile(self.info)
+            if self.name.endswith('.gz'):
+                f = gzip.GzipFile(fileobj=f)
+            for line in f:
+                yield line
+        finally:
+            tar.close()
+
 
-class LogfilePackage():
-    def __init__(self, f):
-        self.tar = tarfile.open(f)
+class LoadedLog():
+    """A member of a compressed LogArchive kept in memory by load_member()"""
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def open(self):
+        return gzip.GzipFile(fileobj=cStringIO.StringIO(self.data))
+
+    def __iter__(self):
+        return iter(self.open())
+
+
+class SpilledLog():
+    """A member of a compressed LogArchive written to a temporary file by
+    load_member(). Iterating opens its own handle on the file."""
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    def open(self):
+        return gzip.open(self.path, 'rb')
+
+    def __iter__(self):
+        f = self.open()
+        try:
+            for line in f:
+                yield line
+        finally:
+            f.close()
+
+
+class ArchiveMember():
+    """A log in a LogArchive, opened by open_log() in the process reading it"""
+    def __init__(self, name):
+        self.name = name
+
+
+class MemoryLog():
+    """Lines of a log generated in memory"""
+    def __init__(self, name, lines):
+        self.name = name
+        self.lines = lines
+
+    def __iter__(self):
+        return iter(self.lines)
 
-        self.ts_date = '\d{4}-\d{2}-\d{2}'
-        self.ts_time = '\d{2}:\d{2}:\d{2}\.\d{6}'
 
+class ApprunnerTarFile(LogArchive):
+    serverlogs_pattern = '/serverlogs/.*-log\.txt'
+    otherlogs_pattern = '|'.join([
+        'apprunner.log',           #apprunner logging
+        '\.Benchmark\.(?!jstack)',           #client benchmark
+        'VoltDBReplicationAgent\.(?!jstack)',  #dragent
+        '.*SchemaChangeClient.*',
+        #'stdout.txt$',            #VEM
+        ])
+
+    def __init__(self, f, memory_limit = default_memory_mb << 20):
+        LogArchive.__init__(self, f, memory_limit)
+        self.prefix = os.path.commonprefix(self.names)
+
+        #validate this file is really apprunner
+        if not re.match('tmp/\S+/apprunner/\S+', self.prefix):
+            raise IOError(f + " isn't a valid apprunner file")
+
+    def show_files(self):
+        return self.names
+
+    def is_log(self, name):
+        return bool(re.search(self.serverlogs_pattern, name) or
+                    re.search(self.otherlogs_pattern, name))
+
+    def get_serverlogs(self):
+        return self.find(self.serverlogs_pattern)
+
+    def get_otherlogs(self):
+        return self.find(self.otherlogs_pattern)
+
+
+class LogfilePackage(LogArchive):
+    ts_date = '\d{4}-\d{2}-\d{2}'
+    ts_time = '\d{2}:\d{2}:\d{2}\.\d{6}'
+    name_re = re.compile('.*' + ts_date + '-' + ts_time + '\.tgz')
+    logs_pattern = '^log/.*|/log/.*'
+    syslogs_pattern = 'syslog/syslog.*'
+    crashfile_pattern = 'voltdb_crash/voltdb_crash' + ts_date + '-' + ts_time + '\.txt'
+
+    def __init__(self, f, memory_limit = default_memory_mb << 20):
         # validate f is valid logfile package
-        if not re.match('.*' + self.ts_date + '-' + self.ts_time + '\.tgz', f):
+        if not LogfilePackage.name_re.match(f):
             raise IOError(f + " isn't a valid logfile package")
+        LogArchive.__init__(self, f, memory_limit)
+
+    def is_log(self, name):
+        return bool(re.search(self.logs_pattern, name) or
+                    re.search(self.syslogs_pattern, name))
+
+    def is_header(self, name):
+        return bool(re.match(self.crashfile_pattern, name))
 
     def get_logs(self):
-        pat = '^log/.*|/log/.*'
-        return [f for f in self.tar.getnames() if re.search(pat, f)]
+        return self.find(self.logs_pattern)
 
     def get_syslogs(self):
-        pat = 'syslog/syslog.*'
-        return [f for f in self.tar.getnames() if re.search(pat, f)]
+        return self.find(self.syslogs_pattern)
 
     def get_crashfiles(self):
-        pat = 'voltdb_crash/voltdb_crash' + self.ts_date + '-' + self.ts_time + '\.txt'
-        crashfiles = [f for f in self.tar.getnames() if re.match(pat, f)]
-        return sorted(crashfiles)
-
-    # copied from ApprunnerTarFile
-    def get_server_tzoffset(self):
-        mtime = self.tar.getmember(self.tar.getnames()[0]).mtime
-        if time.localtime(mtime).tm_isdst:
-            offset_hours = -4
-        else:
-            offset_hours = -5
-        return str(offset_hours * 60 * 60 * 1000)
+        return sorted(self.find(self.crashfile_pattern, re.match))
 
     # add a timestamped line for each file created
     # for now only interested in voltdb crash files
     def get_file_creation_events(self):
-        crashfiles = self.get_crashfiles()
-
-        self.f = tempfile.NamedTemporaryFile()
-
         ts_format = self.ts_date + '\s+' + self.ts_time
         header_re = re.compile(r'Time:\s+(?P<timestamp>%s)' % ts_format)
 
-        for f in crashfiles:
-            header = self.tar.extractfile(f).readline()
-
+        crashfiles = self.get_crashfiles()
+        events = {}
+        for (f, header) in self.get_first_lines(crashfiles).items():
             m = header_re.match(header)
             if m:
                 ts = m.groupdict()['timestamp']
                 line = ts[-4::-1].replace('.', ",", 1)[::-1] + " crash file " + os.path.basename(f) + " created\n"
-                self.f.write(line)
+                events[f] = line
 
-        self.f.flush()
-        self.f.seek(0)
+        return MemoryLog('file_creation', [events[f] for f in crashfiles if f in events])
 
-        return self.f
-
-
-if __name__ == "__main__":
-
-    parser = OptionParser(usage = "usage: %prog [options] FILE...")
-    parser.add_option("-o", "--output", dest="outputfile",
-                      help="write to ")
-    parser.add_option("-t", "--tzoffset", type="string", default="0",
-                      nargs=1, #metavar="TZ_OFFSET",
-                      action="callback", callback=tz_offset_callback,
-                      help="Change the timestamps by [-|+]hh:mm to timezones. "
-                      "EST is -05:00, PDT is -08:00. Don't forget daylight savings.")
-    parser.add_option("-e", "--exclude", type = "string",
-                      default = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                               'exclude.txt'),
-                      nargs=1,
-                      dest = "exclude_file",  action = "callback", callback = exclude_callback,
-                      help="Exclude file to use. Default it exclude.txt.  If 'None' is specified, no exclude file will be used"
-                      )
-
-    (options, args) = parser.parse_args()
 
+class MappedLog():
+    """Lines of an extracted log between two byte offsets, read through a
+    memory map. Has the name of the archive member it was extracted from.
+    """
+    def __init__(self, name, path, start = 0, end = None):
+        self.name = name
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def is_empty(self):
+        end = self.end
+        if end is None:
+            end = os.path.getsize(self.path)
+        return end <= self.start
+
+    def __iter__(self):
+        f = open(self.path, 'rb')
+        try:
+            if os.path.getsize(self.path) == 0:
+                return
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            end = self.end
+            if end is None:
+                end = m.size()
+            m.seek(self.start)
+            while m.tell() < end:
+                yield m.readline()
+        finally:
+            m.close()
+
+
+class LogIndex():
+    """Sidecar index of the logs in an archive. The logs are extracted
+    once into <archive>.index/, or <directory>/<archive name>.index/ when a
+    directory is given, along with index.json, which records
+    checkpoints every checkpoint_bytes of each log as
+    (byte offset, latest timestamp before it, earliest timestamp after it)
+    so that a time window can be read without scanning whole logs.
+    """
+    version = 1
+    checkpoint_bytes = 256 * 1024
+
+    def __init__(self, tar, members, directory = None):
+        self.archive = tar.name
+        self.tar = tar
+        self.members = members
+        if directory:
+            self.directory = os.path.join(directory,
+                                          os.path.basename(self.archive) + '.index')
+        else:
+            self.directory = self.archive + '.index'
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.year = str(datetime.now().year)
+        self.logs = self.load()
+        if self.logs is None:
+            self.logs = self.build()
+
+    def get_stamp(self):
+        st = os.stat(self.archive)
+        return [LogIndex.version, st.st_size, int(st.st_mtime), self.year]
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if index.get('stamp') != self.get_stamp():
+            return None
+        logs = index.get('logs', {})
+        for member in self.members:
+            if member not in logs or not os.path.exists(logs[member]['path']):
+                return None
+        return logs
+
+    def build(self):
+        sys.stderr.write("Building time index of %s\n" % self.archive)
+        logs = {}
+        for (member, src) in self.tar.extract_members(self.members):
+            path = os.path.join(self.directory, 'logs', member)
+            if member.endswith('.gz'):
+                path = path[:-3]
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            logs[member] = dict(path=os.path.abspath(path),
+                                checkpoints=self.get_checkpoints(path))
+        index_tmp = self.index_path + '.tmp'
+        with open(index_tmp, 'w') as f:
+            json.dump(dict(stamp=self.get_stamp(), logs=logs), f)
+        os.rename(index_tmp, self.index_path)
+        return logs
+
+    def get_checkpoints(self, path):
+        """Return [offset, latest before, earliest from] lists, where the
+        times are ms since epoch of the timestamps in the log itself"""
+        checkpoints = []
+        latest = None
+        offset = 0
+        next_checkpoint = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                m = log_re.match(line)
+                if m:
+                    try:
+                        epoch_ms = epochtimemillis_keyfunc(
+                            normalize_datetime(m.group('datetime'), self.year))
+                    except ValueError:
+                        epoch_ms = None
+                    if epoch_ms is not None:
+                        if offset >= next_checkpoint:
+                            checkpoints.append([offset, latest, epoch_ms])
+                            next_checkpoint = offset + LogIndex.checkpoint_bytes
+                        latest = max(latest, epoch_ms)
+                        checkpoints[-1][2] = min(checkpoints[-1][2], epoch_ms)
+                offset += len(line)
+        # Make the earliest times cover everything after each checkpoint.
+        for i in range(len(checkpoints) - 2, -1, -1):
+            checkpoints[i][2] = min(checkpoints[i][2], checkpoints[i + 1][2])
+        return checkpoints
+
+    def get_log(self, member, start_ms = None, end_ms = None):
+        """Return a MappedLog of the part of a member that can have records
+        between start_ms and end_ms, given as log file times"""
+        log = self.logs[member]
+        start = 0
+        end = None
+        checkpoints = log['checkpoints']
+        for i, (offset, latest, earliest) in enumerate(checkpoints):
+            if start_ms is not None and latest is not None and latest < start_ms:
+                start = offset
+            if end_ms is not None and earliest > end_ms:
+                end = offset
+                break
+        return MappedLog(member, log['path'], start, end)
+
+
+def open_logs(parser, options, args):
+    """Open the log files or the archive given on the command line.
+    Returns (files, offsets, fnamedict, tar) to pass on to merge_logs(),
+    where tar is the LogArchive, if any.
+    """
     fnamedict = {}
     offsets = {}
     tar = None
@@ -271,12 +852,9 @@ if __name__ == "__main__":
 
     #If we have 1 arg, see if it is a tarfile
     if len(args) == 1 and tarfile.is_tarfile(args[0]):
-        ts_date = '\d{4}-\d{2}-\d{2}'
-        ts_time = '\d{2}:\d{2}:\d{2}'
-
-        if re.match('.*' + ts_date + '-' + ts_time + '\.tgz', f):
+        if LogfilePackage.name_re.match(args[0]):
             try:
-                tar = LogfilePackage(args[0])
+                tar = LogfilePackage(args[0], options.memory_mb << 20)
             except IOError as e:
                 sys.exit(e)
 
@@ -288,18 +866,19 @@ if __name__ == "__main__":
             for f in syslogs:
                 offsets[f] = 0
 
-            tar.get_file_creation_events()
+            events = tar.get_file_creation_events()
 
-            files = [gzip.GzipFile(fileobj=f) if f.name.endswith('.gz') else f for f in map(tar.tar.extractfile, logs + syslogs)]
+            members = logs + syslogs
+            files = map(ArchiveMember, members)
 
-            if os.path.getsize(tar.f.name) > 0:
-                files += [tar.f]
-                offsets[tar.f.name] = 0
-                fnamedict[tar.f.name] = 'file_creation'
+            if events.lines:
+                files += [events]
+                offsets[events.name] = 0
+                fnamedict[events.name] = 'file_creation'
 
         else:
             try:
-                tar = ApprunnerTarFile(args[0])
+                tar = ApprunnerTarFile(args[0], options.memory_mb << 20)
             except IOError as e:
                 sys.exit(e)
 
@@ -309,7 +888,8 @@ if __name__ == "__main__":
             otherlogs = tar.get_otherlogs()
             for f in otherlogs:
                 offsets[f] = 0
-            files = map(tar.tar.extractfile, serverlogs + otherlogs)
+            members = serverlogs + otherlogs
+            files = map(ArchiveMember, members)
 
 
     else:
@@ -320,6 +900,24 @@ if __name__ == "__main__":
         for f in files:
             offsets[f.name] = int(options.tzoffset)
 
+    # Read only the part of each archive member around the time window.
+    # Without a writable index the entries are filtered as they are merged.
+    index = None
+    if tar and (options.start is not None or options.end is not None):
+        try:
+            index = LogIndex(tar, members, options.index_dir)
+        except (IOError, OSError) as e:
+            sys.stderr.write("Cannot save the time index, reading whole logs: %s\n" % str(e))
+    if index:
+        def window(ms, offset):
+            if ms is None:
+                return None
+            return ms - offset
+        files = [index.get_log(f.name,
+                               window(options.start, offsets[f.name]),
+                               window(options.end, offsets[f.name]))
+                 if f.name in index.logs else f for f in files]
+
     # Use directory paths if there are identical filenames
     _fnamedict = {}
     filenames = [os.path.basename(f.name) for f in files]
@@ -329,12 +927,70 @@ if __name__ == "__main__":
         _fnamedict = dict((f.name,os.path.basename(f.name)) for f in files if f.name not in fnamedict)
     fnamedict.update(_fnamedict)
 
+    return (files, offsets, fnamedict, tar)
+
+
+def add_input_options(parser):
+    """Add the options used by open_logs() and merge_logs()"""
+    parser.add_option("-t", "--tzoffset", type="string", default="0",
+                      nargs=1, #metavar="TZ_OFFSET",
+                      action="callback", callback=tz_offset_callback,
+                      help="Change the timestamps by [-|+]hh:mm to timezones. "
+                      "EST is -05:00, PDT is -08:00. Don't forget daylight savings.")
+    parser.add_option("-j", "--jobs", type="int",
+                      default=multiprocessing.cpu_count(),
+                      help="Number of processes parsing files in parallel. "
+                      "Default is the number of CPUs.")
+    parser.add_option("--from", type="string", dest="start",
+                      action="callback", callback=time_callback,
+                      help="Only merge entries from this yyyy-mm-dd[ hh:mm:ss[,xxx]] "
+                      "time on (after the timezone change). For archives, a time "
+                      "index is saved next to the archive to skip to the window.")
+    parser.add_option("--to", type="string", dest="end",
+                      action="callback", callback=time_callback,
+                      help="Only merge entries up to this yyyy-mm-dd[ hh:mm:ss[,xxx]] time")
+    parser.add_option("--index-dir", type="string", dest="index_dir",
+                      help="Directory to save archive time indexes in instead of "
+                      "next to the archive")
+    parser.add_option("--memory-mb", type="int", dest="memory_mb",
+                      default=default_memory_mb,
+                      help="Megabytes of logs from a compressed archive kept in "
+                      "memory, gzipped, for the merge. The rest are written to "
+                      "temporary files. Default is %d." % default_memory_mb)
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(usage = "usage: %prog [options] FILE...")
+    parser.add_option("-o", "--output", dest="outputfile",
+                      help="write to ")
+    add_input_options(parser)
+    parser.add_option("-e", "--exclude", type = "string",
+                      default = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                               'exclude.txt'),
+                      nargs=1,
+                      dest = "exclude_file",  action = "callback", callback = exclude_callback,
+                      help="Exclude file to use. Default it exclude.txt.  If 'None' is specified, no exclude file will be used"
+                      )
+
+    parser.add_option("-g", "--grep", type="string", dest="includes",
+                      action="append", default=[],
+                      help="Only merge entries matching this regular expression. "
+                      "Can be given more than once to match any of them.")
+
+    (options, args) = parser.parse_args()
+
+    (files, offsets, fnamedict, tar) = open_logs(parser, options, args)
+    merged = [f for f in files if not (isinstance(f, MappedLog) and f.is_empty())]
+
     if options.outputfile:
         try:
-            sys.stdout = open(options.outputfile, 'w')
+            output = open(options.outputfile, 'w', output_buffer_size)
         except IOError as e:
             sys.exit("Cannot write output file %s: %s " %
                      (options.outputfile, str(e)))
+    else:
+        output = os.fdopen(os.dup(sys.stdout.fileno()), 'w', output_buffer_size)
 
     excludes = []
     if options.exclude_file:
@@ -344,6 +1000,10 @@ if __name__ == "__main__":
         except IOError as e:
             sys.exit("Cannot read exclude file %s: %s" %
                      (options.exclude_file, str(e)))
+    excludes = MessageMatcher(read_patterns(excludes, options.exclude_file))
+    includes = None
+    if options.includes:
+        includes = MessageMatcher(read_patterns(options.includes, "--grep"))
 
     name_dict = {
         '(volt\w*)-.*.txt': '  ',
@@ -353,38 +1013,45 @@ if __name__ == "__main__":
         '(.*)\.SchemaChangeClient\.': '--',
         }
 
+    # Decorated names, worked out once per input file
+    decorated_names = {}
+    def decorate_filename(filename):
+        for key in name_dict:
+            fmatch = re.match(key, filename)
+            if fmatch:
+                filename = "%s %s %s" % (
+                    name_dict[key], fmatch.group(1), name_dict[key])
+        return filename
+
     #Go, go, go
-    print "------ Files merged"
-    print '\n'.join(sorted(['  ' + f.name for f in files]))
-    print "------"
-    for  (time_str, entry) in merge_logs(files, offsets, fnamedict):
-        #This is really only good for apprunnerish stuff
-        if tar:
-            for key in name_dict:
-                fmatch = re.match(key, entry["filename"])
-                if fmatch:
-                    entry["filename"] = "%s %s %s" % (
-                        name_dict[key], fmatch.group(1), name_dict[key])
-
-        ematch = None
-        for e in excludes:
-            if e:
-                ematch = re.search(e, entry["message"])
-                if ematch:
-                    break
-        if ematch:
-            continue
-        new_logline = "%s\t%s\t%s" % (entry["newdatetime"],
-                                      entry["filename"],
-                                      entry["message"])
-        try:
-            print new_logline
-        except IOError as e:
-            import errno
-            if e.errno == errno.EPIPE:
-                sys.exit(0)
-            else:
-                sys.exit("Error writing output: " + str(e))
+    write = output.write
+    try:
+        write("------ Files merged\n")
+        write('\n'.join(sorted(['  ' + f.name for f in files])) + "\n")
+        write("------\n")
+        for  (time_str, entry) in merge_logs(merged, offsets, fnamedict, options.jobs, tar):
+            if options.start is not None and (time_str is None or time_str < options.start):
+                continue
+            if options.end is not None and (time_str is None or time_str > options.end):
+                continue
+            if excludes.search(entry.message):
+                continue
+            if includes and not includes.search(entry.message):
+                continue
+            #This is really only good for apprunnerish stuff
+            filename = entry.filename
+            if tar:
+                if filename not in decorated_names:
+                    decorated_names[filename] = decorate_filename(filename)
+                filename = decorated_names[filename]
+            write("%s\t%s\t%s\n" % (entry.newdatetime, filename, entry.message))
+        output.close()
+    except IOError as e:
+        import errno
+        if e.errno == errno.EPIPE:
+            sys.exit(0)
+        else:
+            sys.exit("Error writing output: " + str(e))
 
 
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# This file is part of VoltDB.
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+
+import logmerger
+
+server_log = ''.join('2015-03-01 08:%02d:00,000   INFO  [Thread-1] HOST: Message %d\n'
+                     % (i, i) for i in range(10))
+
+
+class MessageMatcherTest(unittest.TestCase):
+    def test_many_groups(self):
+        # More capturing groups than re allows in a single expression
+        patterns = [r'flush %d took (\d+) ms' % i for i in range(150)] + \
+                   [r'(\w+) rejoined %d' % i for i in range(150)]
+        matcher = logmerger.MessageMatcher(patterns)
+        assert len(matcher.guarded) > 1
+        assert len(matcher.unguarded) > 1
+        assert matcher.search('flush 0 took 12 ms')
+        assert matcher.search('flush 149 took 12 ms')
+        assert matcher.search('host3 rejoined 149')
+        assert not matcher.search('flush 150 took 12 ms')
+        assert not matcher.search('rejoined 3')
+
+    def test_standalone(self):
+        matcher = logmerger.MessageMatcher([r'(?P<n>\d+) (?P=n)', r'(a)\1'])
+        assert not matcher.guarded
+        assert matcher.search('7 7')
+        assert matcher.search('xaa')
+        assert not matcher.search('7 8')
+
+
+class TimeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        log = os.path.join(self.tempdir, 'a-log.txt')
+        out = open(log, 'w')
+        out.write(server_log)
+        out.close()
+        self.archive = os.path.join(self.tempdir, 'run.tgz')
+        tar = tarfile.open(self.archive, 'w:gz')
+        tar.add(log, 'tmp/run1/apprunner/x/serverlogs/a-log.txt')
+        tar.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def logmerger(self, *args):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'logmerger.py')
+        # Apprunner server logs are moved to EST
+        env = dict(os.environ, TZ='UTC')
+        proc = subprocess.Popen((sys.executable, script, '-e', 'none',
+                                 '--from', '2015-03-01 03:07:00') + args,
+                                env = env,
+                                stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (stdout, stderr) = proc.communicate()
+        self.assertEquals(0, proc.returncode, stderr)
+        self.assertEquals(['Message 7', 'Message 8', 'Message 9'],
+                          [l.split(': ')[-1] for l in stdout.splitlines()
+                           if 'HOST: ' in l])
+        return stderr
+
+    def testIndexDir(self):
+        index_dir = os.path.join(self.tempdir, 'indexes')
+        os.mkdir(index_dir)
+        self.logmerger('--index-dir', index_dir, self.archive)
+        assert os.path.exists(os.path.join(index_dir, 'run.tgz.index', 'index.json'))
+        assert not os.path.exists(self.archive + '.index')
+
+    def testUnwritableIndex(self):
+        # A file in place of the directory can't be written, even by root
+        not_a_dir = os.path.join(self.tempdir, 'file')
+        open(not_a_dir, 'w').close()
+        stderr = self.logmerger('--index-dir', not_a_dir, self.archive)
+        assert 'Cannot save the time index' in stderr
+
+
+class LoadMembersTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tempdir, 'run.tgz')
+        tar = tarfile.open(self.archive, 'w:gz')
+        for name in ('a-log.txt', 'b-log.txt'):
+            log = os.path.join(self.tempdir, name)
+            out = open(log, 'w')
+            out.write(server_log)
+            out.close()
+            tar.add(log, 'serverlogs/' + name)
+        tar.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_memory_limit(self):
+        class ServerLogArchive(logmerger.LogArchive):
+            def is_log(self, name):
+                return name.startswith('serverlogs/')
+
+        archive = ServerLogArchive(self.archive, len(server_log))
+        names = ['serverlogs/a-log.txt', 'serverlogs/b-log.txt']
+        a = archive.open_member(names[0])
+        b = archive.open_member(names[1])
+        assert isinstance(a, logmerger.LoadedLog)
+        assert isinstance(b, logmerger.SpilledLog)
+        assert archive.loaded_bytes <= len(server_log)
+        # Spilled members can be read side by side, more than once
+        self.assertEquals(list(zip(a, b)), list(zip(server_log.splitlines(True),
+                                                     server_log.splitlines(True))))
+        self.assertEquals(''.join(b), server_log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# Extracts time series of metrics from the entries merged by logmerger.py,
+# e.g. snapshot durations, GC pauses and rejoin progress, to line server
+# events up with client throughput. Metrics are named patterns read from
+# metrics.txt or other pattern files, and their values are aggregated in
+# per-second or per-minute buckets for each host.
+
+import csv
+import json
+from optparse import OptionParser
+import os.path
+import re
+import sys
+import time
+
+import logmerger
+
+# Seconds per time bucket
+bucket_sizes = {'second': 1, 'minute': 60}
+
+aggregates = ['count', 'sum', 'min', 'max', 'mean']
+
+
+class Metric():
+    def __init__(self, name, aggregate, pattern):
+        self.name = name
+        self.aggregate = aggregate
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+
+    def get_value(self, message):
+        """Return the value in message, or None if it doesn't match"""
+        m = self.regex.search(message)
+        if not m:
+            return None
+        if self.aggregate == 'count' or not m.groups():
+            return 1
+        try:
+            return float(m.group(1).replace(',', ''))
+        except (TypeError, ValueError):
+            return None
+
+
+def read_metrics(path):
+    """Return the metrics in a pattern file of name, aggregate, pattern lines"""
+    metrics = []
+    try:
+        with open(path) as pf:
+            for (lineno, line) in enumerate(pf, 1):
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                fields = line.split(None, 2)
+                if len(fields) != 3 or fields[1] not in aggregates:
+                    sys.exit("%s:%d: expected name, one of %s and a pattern" %
+                             (path, lineno, '/'.join(aggregates)))
+                try:
+                    metrics.append(Metric(*fields))
+                except re.error as e:
+                    sys.exit("%s:%d: invalid pattern: %s" % (path, lineno, str(e)))
+    except IOError as e:
+        sys.exit("Cannot read pattern file %s: %s" % (path, str(e)))
+    return metrics
+
+
+class TimeSeries():
+    """Aggregates metric values by host, metric and time bucket"""
+    def __init__(self, bucket_size):
+        self.bucket_size = bucket_size
+        # (host, metric name) -> {bucket start: [count, sum, min, max]}
+        self.series = {}
+        self.metrics = {}
+
+    def add(self, host, metric, epoch_ms, value):
+        self.metrics[metric.name] = metric
+        bucket = epoch_ms / 1000 / self.bucket_size * self.bucket_size
+        buckets = self.series.setdefault((host, metric.name), {})
+        acc = buckets.get(bucket)
+        if acc is None:
+            buckets[bucket] = [1, value, value, value]
+        else:
+            acc[0] += 1
+            acc[1] += value
+            acc[2] = min(acc[2], value)
+            acc[3] = max(acc[3], value)
+
+    def get_value(self, name, acc):
+        aggregate = self.metrics[name].aggregate
+        if aggregate == 'count':
+            return acc[0]
+        if aggregate == 'sum':
+            return acc[1]
+        if aggregate == 'min':
+            return acc[2]
+        if aggregate == 'max':
+            return acc[3]
+        return acc[1] / acc[0]
+
+    def get_points(self):
+        """Return (bucket, host, metric name, value) points in time order"""
+        points = []
+        for ((host, name), buckets) in self.series.iteritems():
+            for (bucket, acc) in buckets.iteritems():
+                points.append((bucket, host, name, self.get_value(name, acc)))
+        points.sort()
+        return points
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def format_bucket(bucket):
+    """Return the local time of a bucket, the same clock as logmerger's output"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(bucket))
+
+
+def write_csv(series, output):
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['time', 'epoch', 'host', 'metric', 'value'])
+    for (bucket, host, name, value) in series.get_points():
+        writer.writerow([format_bucket(bucket), bucket, host, name, format_value(value)])
+
+
+def write_json(series, output):
+    by_series = {}
+    for (bucket, host, name, value) in series.get_points():
+        by_series.setdefault((host, name), []).append([bucket, value])
+    result = []
+    for ((host, name), points) in sorted(by_series.iteritems()):
+        result.append({'host': host,
+                       'metric': name,
+                       'aggregate': series.metrics[name].aggregate,
+                       'points': points})
+    json.dump({'bucket_seconds': series.bucket_size, 'series': result},
+              output, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == "__main__":
+
+    parser = OptionParser(usage = "usage: %prog [options] FILE...")
+    parser.add_option("-o", "--output", dest="outputfile",
+                      help="Write to this file instead of stdout")
+    logmerger.add_input_options(parser)
+    parser.add_option("-p", "--patterns", type="string", dest="pattern_files",
+                      action="append", default=[],
+                      help="Pattern file of metrics to extract. Can be given "
+                      "more than once. Default is metrics.txt.")
+    parser.add_option("-m", "--metric", type="string", dest="names",
+                      action="append", default=[],
+                      help="Only extract this metric. Can be given more than once.")
+    parser.add_option("-b", "--bucket", type="choice", choices=sorted(bucket_sizes),
+                      default="minute",
+                      help="Time bucket to aggregate values in, second or minute. "
+                      "Default is minute.")
+    parser.add_option("-f", "--format", type="choice", choices=['csv', 'json'],
+                      default="csv",
+                      help="Output format, csv or json. Default is csv.")
+    parser.add_option("--host-pattern", type="string", dest="host_pattern",
+                      help="Regular expression whose first group is the host "
+                      "in a log file name. By default each file is a host.")
+
+    (options, args) = parser.parse_args()
+
+    pattern_files = options.pattern_files or [
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), 'metrics.txt')]
+    metrics = []
+    for path in pattern_files:
+        metrics += read_metrics(path)
+    if options.names:
+        unknown = set(options.names) - set(m.name for m in metrics)
+        if unknown:
+            parser.error("Unknown metric: " + ', '.join(sorted(unknown)))
+        metrics = [m for m in metrics if m.name in options.names]
+    # Most entries match no metric at all, so rule them out in one search.
+    matcher = logmerger.MessageMatcher([m.pattern for m in metrics])
+
+    host_re = None
+    if options.host_pattern:
+        try:
+            host_re = re.compile(options.host_pattern)
+        except re.error as e:
+            parser.error("Invalid host pattern: " + str(e))
+    hosts = {}
+    def get_host(filename):
+        m = host_re and host_re.search(filename)
+        if m and m.groups():
+            return m.group(1)
+        return filename
+
+    (files, offsets, fnamedict, tar) = logmerger.open_logs(parser, options, args)
+    merged = [f for f in files
+              if not (isinstance(f, logmerger.MappedLog) and f.is_empty())]
+
+    series = TimeSeries(bucket_sizes[options.bucket])
+    for (epoch_ms, entry) in logmerger.merge_logs(merged, offsets, fnamedict,
+                                                  options.jobs, tar):
+        if epoch_ms is None:
+            continue
+        if options.start is not None and epoch_ms < options.start:
+            continue
+        if options.end is not None and epoch_ms > options.end:
+            continue
+        if not matcher.search(entry.message):
+            continue
+        if entry.filename not in hosts:
+            hosts[entry.filename] = get_host(entry.filename)
+        host = hosts[entry.filename]
+        for metric in metrics:
+            value = metric.get_value(entry.message)
+            if value is not None:
+                series.add(host, metric, epoch_ms, value)
+
+    output = sys.stdout
+    if options.outputfile:
+        try:
+            output = open(options.outputfile, 'w')
+        except IOError as e:
+            sys.exit("Cannot write output file %s: %s " %
+                     (options.outputfile, str(e)))
+    if options.format == 'json':
+        write_json(series, output)
+    else:
+        write_csv(series, output)
+    output.close()
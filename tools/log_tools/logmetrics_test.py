@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# This file is part of VoltDB.
+# Copyright (C) 2008-2015 VoltDB Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+volt_log = """\
+2015-03-01 08:00:05,123   INFO  [SnapshotDaemon] SNAPSHOT: Snapshot nonce1 finished at 1425196805123 and took 2.5 seconds 
+2015-03-01 08:00:40,000   WARN  [Thread-3] HOST: Something to look at
+2015-03-01 08:01:10,000   INFO  [Thread-3] REJOIN: Live rejoin data transfer completed in 12 seconds.
+2015-03-01 08:01:20,000   ERROR [Thread-3] HOST: Something failed
+java.lang.RuntimeException: took 5 milliseconds
+"""
+
+gc_log = """\
+2015-03-01T08:00:10.000+0000: 5.000: [GC (Allocation Failure) 2015-03-01T08:00:10.000+0000: 5.000: [ParNew: 1000K->100K(2000K), 0.2000000 secs] 3000K->1100K(9000K), 0.2500000 secs] [Times: user=0.50 sys=0.00, real=0.25 secs] 
+2015-03-01T08:00:50.000+0000: 45.000: [GC (CMS Initial Mark) [1 CMS-initial-mark: 900K(7000K)] 1200K(9000K), 0.1250000 secs] [Times: user=0.12 sys=0.00, real=0.13 secs] 
+2015-03-01T08:00:51.000+0000: 46.000: [CMS-concurrent-mark: 0.500/0.500 secs] [Times: user=1.00 sys=0.00, real=0.50 secs] 
+2015-03-01T08:01:30.000+0000: 85.000: [Full GC (System.gc()) 2015-03-01T08:01:30.000+0000: 85.000: [CMS: 900K->800K(7000K), 0.5000000 secs] 1200K->800K(9000K), [Metaspace: 100K->100K(200K)], 0.7500000 secs] [Times: user=0.75 sys=0.00, real=0.75 secs] 
+"""
+
+client_log = """\
+2015-03-01 08:00:20,000   INFO  [Timer-0] HOST: 00:00:05 Throughput 1000/s, Aborts/Failures 0/0, Avg/95% Latency 2.50/4.00ms
+2015-03-01 08:00:25,000   INFO  [Timer-0] HOST: 00:00:10 Throughput 3000/s, Aborts/Failures 0/0, Avg/95% Latency 1.50/3.00ms
+"""
+
+
+class LogMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for (name, text) in (('volt.log', volt_log),
+                             ('gc.log', gc_log),
+                             ('client.log', client_log)):
+            out = open(os.path.join(self.tempdir, name), 'w')
+            out.write(text)
+            out.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def logmetrics(self, *args):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'logmetrics.py')
+        env = dict(os.environ, TZ='UTC')
+        proc = subprocess.Popen((sys.executable, script) + args,
+                                cwd = self.tempdir, env = env,
+                                stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (stdout, stderr) = proc.communicate()
+        self.assertEquals(0, proc.returncode, stderr)
+        return stdout
+
+    def testCsv(self):
+        stdout = self.logmetrics('volt.log', 'gc.log', 'client.log')
+        self.assertEquals("""\
+time,epoch,host,metric,value
+2015-03-01 08:00:00,1425196800,client.log,client_latency_ms,2
+2015-03-01 08:00:00,1425196800,client.log,client_throughput,2000
+2015-03-01 08:00:00,1425196800,gc.log,gc_max_pause_seconds,0.25
+2015-03-01 08:00:00,1425196800,gc.log,gc_pause_seconds,0.375
+2015-03-01 08:00:00,1425196800,volt.log,snapshot_seconds,2.5
+2015-03-01 08:00:00,1425196800,volt.log,warnings,1
+2015-03-01 08:01:00,1425196860,gc.log,gc_full_collections,1
+2015-03-01 08:01:00,1425196860,gc.log,gc_max_pause_seconds,0.75
+2015-03-01 08:01:00,1425196860,gc.log,gc_pause_seconds,0.75
+2015-03-01 08:01:00,1425196860,volt.log,errors,1
+2015-03-01 08:01:00,1425196860,volt.log,rejoin_transfer_seconds,12
+2015-03-01 08:01:00,1425196860,volt.log,took_ms,5
+""", stdout)
+
+    def testSecondBuckets(self):
+        stdout = self.logmetrics('-b', 'second', '-m', 'client_throughput',
+                                 'client.log')
+        self.assertEquals("""\
+time,epoch,host,metric,value
+2015-03-01 08:00:20,1425196820,client.log,client_throughput,1000
+2015-03-01 08:00:25,1425196825,client.log,client_throughput,3000
+""", stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -118,22 +118,27 @@ def get_config(runner, reset = False):
     missing = []
     defaults = []
     msgblocks = []
-    for name in sorted(Global.config_properties.keys()):
-        config_property = Global.config_properties[name]
-        key = config_key(name)
-        value = runner.config.get(key)
-        if not value or reset:
-            if config_property.default is None:
-                missing.append(name)
-                runner.config.set_permanent(key, '')
+    # Save all the applied defaults at once.
+    runner.config.begin_batch()
+    try:
+        for name in sorted(Global.config_properties.keys()):
+            config_property = Global.config_properties[name]
+            key = config_key(name)
+            value = runner.config.get(key)
+            if not value or reset:
+                if config_property.default is None:
+                    missing.append(name)
+                    runner.config.set_permanent(key, '')
+                else:
+                    defaults.append(name)
+                    value = Global.config_properties[name].default
+                    runner.config.set_permanent(key, value)
+                    setattr(config, name, value)
             else:
-                defaults.append(name)
-                value = Global.config_properties[name].default
-                runner.config.set_permanent(key, value)
-                setattr(config, name, value)
-        else:
-            # Use an existing config value.
-            config[name] = value
+                # Use an existing config value.
+                config[name] = value
+    finally:
+        runner.config.end_batch()
     samples = []
     if not reset and missing:
         table = [(name, Global.config_properties[name].description) for name in missing]
@@ -272,12 +277,16 @@ def run_config_set(runner):
             bad.append(arg)
     if bad:
         runner.abort('Bad arguments (must be KEY=VALUE format):', bad)
-    for arg in runner.opts.arg:
-        key, value = [s.strip() for s in arg.split('=', 1)]
-        if key.find('.') == -1:
-            key = config_key(key)
-        runner.config.set_permanent(key, value)
-        print 'set %s=%s' % (key, value)
+    runner.config.begin_batch()
+    try:
+        for arg in runner.opts.arg:
+            key, value = [s.strip() for s in arg.split('=', 1)]
+            if key.find('.') == -1:
+                key = config_key(key)
+            runner.config.set_permanent(key, value)
+            print 'set %s=%s' % (key, value)
+    finally:
+        runner.config.end_batch()
 
 #===============================================================================
 def run_config_reset(runner):